@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+ميزانية عرض نطاق مشتركة للعملية كلها (تنزيل/رفع) مع تحكم AIMD في عدد الأجزاء المتوازية
+"""
+
+import os
+import time
+import asyncio
+import threading
+from urllib.parse import urlparse
+
+from metrics import TRANSFER_BYTES, TRANSFER_MBPS, ACTIVE_STREAMS
+
+
+def parse_rate(value):
+    """'50M' أو '800K' أو '1048576' -> بايت/ثانية (0 = بدون حد)"""
+    value = str(value or '0').strip().upper()
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    try:
+        if value and value[-1] in units:
+            return int(float(value[:-1]) * units[value[-1]])
+        return int(float(value))
+    except ValueError:
+        return 0
+
+
+def parse_share(value, default=0.7):
+    """'0.7' -> 0.7 (قيمة غير صالحة أو خارج 0..1 -> default)"""
+    try:
+        share = float(value)
+    except (TypeError, ValueError):
+        return default
+    return share if 0.0 <= share <= 1.0 else default
+
+
+# إجمالي سعة الخط (FHRS_BANDWIDTH=40M مثلاً) ونصيب كل اتجاه عندما يعمل الاتجاهان معاً
+TOTAL_BANDWIDTH = parse_rate(os.environ.get('FHRS_BANDWIDTH', '0'))
+DOWNLOAD_SHARE = parse_share(os.environ.get('FHRS_DOWNLOAD_SHARE'))
+UPLOAD_SHARE = 1.0 - DOWNLOAD_SHARE
+
+MIN_FRAGMENTS = 1
+MAX_FRAGMENTS = 16
+START_FRAGMENTS = 4
+
+
+class TokenBucket:
+    """دلو رموز بسيط آمن للخيوط"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = float(rate)
+        self.stamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def set_rate(self, rate):
+        with self.lock:
+            self.rate = rate
+            self.tokens = min(self.tokens, float(rate))
+
+    def reserve(self, nbytes):
+        """خصم nbytes وإرجاع مدة الانتظار اللازمة (بالثواني)"""
+        with self.lock:
+            if self.rate <= 0:
+                return 0.0
+            now = time.monotonic()
+            self.tokens = min(float(self.rate), self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            self.tokens -= nbytes
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+
+class AimdController:
+    """
+    ضبط عدد الأجزاء المتوازية لكل خادم: زيادة تدريجية (+1) طالما السرعة تتحسن،
+    وتنصيف عند الأخطاء أو هبوط السرعة (علامة على الخنق من الخادم)
+    """
+
+    def __init__(self, start=START_FRAGMENTS, minimum=MIN_FRAGMENTS, maximum=MAX_FRAGMENTS):
+        self.start = start
+        self.minimum = minimum
+        self.maximum = maximum
+        self.hosts = {}
+        self.lock = threading.Lock()
+
+    def _state(self, host):
+        state = self.hosts.get(host)
+        if state is None:
+            state = self.hosts[host] = {'fragments': self.start, 'ewma': 0.0}
+        return state
+
+    def fragments(self, url):
+        host = urlparse(url).netloc or url
+        with self.lock:
+            return self._state(host)['fragments']
+
+    def report(self, url, throughput, errors=0):
+        """تسجيل نتيجة قياس (بايت/ثانية، عدد الأخطاء) وإرجاع العدد الجديد"""
+        host = urlparse(url).netloc or url
+        with self.lock:
+            state = self._state(host)
+            ewma = state['ewma']
+            if errors or (ewma and throughput < ewma * 0.8):
+                state['fragments'] = max(self.minimum, state['fragments'] // 2)
+            elif not ewma or throughput >= ewma * 0.95:
+                state['fragments'] = min(self.maximum, state['fragments'] + 1)
+            state['ewma'] = throughput if not ewma else ewma * 0.7 + throughput * 0.3
+            return state['fragments']
+
+
+class Stream:
+    """تدفق واحد (تنزيل أو رفع) مسجل في المدير"""
+
+    def __init__(self, manager, direction, url):
+        self.manager = manager
+        self.direction = direction
+        self.url = url
+        self.started = time.monotonic()
+        self.bytes = 0
+        self.errors = 0
+        self.last_total = 0
+        self.closed = False
+
+    def rate_limit(self):
+        """الحد الحالي لهذا التدفق (0 = بدون حد)"""
+        return self.manager.stream_rate(self.direction)
+
+    def fragments(self):
+        return self.manager.controller.fragments(self.url)
+
+    def throttle(self, nbytes):
+        self.bytes += nbytes
+        TRANSFER_BYTES.inc(nbytes, direction=self.direction)
+        delay = self.manager.reserve(self.direction, nbytes)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def throttle_async(self, nbytes):
+        self.bytes += nbytes
+        TRANSFER_BYTES.inc(nbytes, direction=self.direction)
+        delay = self.manager.reserve(self.direction, nbytes)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def throttle_total(self, total_bytes):
+        """مثل throttle لكن بقيمة تراكمية (كما في خطافات yt-dlp و Pyrogram)"""
+        delta = max(0, total_bytes - self.last_total)
+        self.last_total = max(self.last_total, total_bytes)
+        if delta:
+            self.throttle(delta)
+
+    async def throttle_total_async(self, total_bytes):
+        delta = max(0, total_bytes - self.last_total)
+        self.last_total = max(self.last_total, total_bytes)
+        if delta:
+            await self.throttle_async(delta)
+
+    def error(self):
+        self.errors += 1
+
+    def throughput(self):
+        elapsed = time.monotonic() - self.started
+        return self.bytes / elapsed if elapsed > 0 else 0.0
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.manager.close_stream(self)
+
+
+class BandwidthManager:
+    """مدير عرض النطاق على مستوى العملية"""
+
+    def __init__(self, total=TOTAL_BANDWIDTH, download_share=DOWNLOAD_SHARE):
+        self.total = total
+        self.shares = {'download': download_share, 'upload': 1.0 - download_share}
+        self.active = {'download': 0, 'upload': 0}
+        self.buckets = {'download': TokenBucket(0), 'upload': TokenBucket(0)}
+        self.controller = AimdController()
+        self.lock = threading.Lock()
+        self._rebalance()
+
+    def _direction_rate(self, direction):
+        if not self.total:
+            return 0
+        other = 'upload' if direction == 'download' else 'download'
+        # إذا كان الاتجاه الآخر متوقفاً نستخدم الخط كاملاً
+        if not self.active[other]:
+            return self.total
+        return int(self.total * self.shares[direction])
+
+    def _rebalance(self):
+        for direction, bucket in self.buckets.items():
+            bucket.set_rate(self._direction_rate(direction))
+
+    def open_stream(self, direction, url=''):
+        with self.lock:
+            self.active[direction] += 1
+            self._rebalance()
+        ACTIVE_STREAMS.inc(direction=direction)
+        return Stream(self, direction, url)
+
+    def close_stream(self, stream):
+        with self.lock:
+            self.active[stream.direction] = max(0, self.active[stream.direction] - 1)
+            self._rebalance()
+        ACTIVE_STREAMS.dec(direction=stream.direction)
+        if stream.bytes:
+            TRANSFER_MBPS.observe(stream.throughput() / 1024 ** 2, direction=stream.direction)
+        if stream.direction == 'download' and stream.bytes:
+            self.controller.report(stream.url, stream.throughput(), stream.errors)
+
+    def stream_rate(self, direction):
+        with self.lock:
+            rate = self._direction_rate(direction)
+            return rate // max(1, self.active[direction]) if rate else 0
+
+    def reserve(self, direction, nbytes):
+        return self.buckets[direction].reserve(nbytes)
+
+    def ytdl_options(self, stream):
+        """خيارات yt-dlp للتدفق: حد السرعة الحالي وعدد الأجزاء المتعلم لهذا الخادم"""
+        return {
+            'ratelimit': stream.rate_limit() or None,
+            'concurrent_fragment_downloads': stream.fragments(),
+        }
+
+    def ytdl_hook(self, stream, inner=None):
+        """خطاف تقدم yt-dlp يطبق الميزانية المشتركة (يعمل من أي خيط)"""
+        def hook(status):
+            if status.get('status') == 'downloading':
+                stream.throttle_total(status.get('downloaded_bytes') or 0)
+            elif status.get('status') == 'error':
+                stream.error()
+            if inner:
+                inner(status)
+        return hook
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_manager():
+    """المدير المشترك للعملية"""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = BandwidthManager()
+        return _manager
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+فحص المتطلبات مع ذاكرة دائمة (حسب مسار الأداة وتاريخ تعديلها) واستيراد كسول للحزم الثقيلة
+"""
+
+import os
+import sys
+import json
+import shutil
+import importlib
+import importlib.util
+import subprocess
+
+import tracing
+
+CACHE_DIR = os.environ.get('FHRS_CACHE_DIR') or os.path.join(os.path.expanduser('~'), '.cache', 'fhrs')
+CAPS_FILE = os.path.join(CACHE_DIR, 'capabilities.json')
+
+_caps = None
+
+
+def _load_caps():
+    global _caps
+    if _caps is None:
+        try:
+            with open(CAPS_FILE, 'r', encoding='utf-8') as f:
+                _caps = json.load(f)
+        except (OSError, ValueError):
+            _caps = {}
+    return _caps
+
+
+def _save_caps():
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp = CAPS_FILE + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(_caps, f)
+        os.replace(tmp, CAPS_FILE)
+    except OSError:
+        pass
+
+
+def tool_available(name, version_args=('-version',)):
+    """
+    هل الأداة تعمل؟ يتم تشغيلها مرة واحدة فقط لكل (مسار، تاريخ تعديل)
+    وبعد ذلك تكفي عملية stat واحدة
+    """
+    path = shutil.which(name)
+    if not path:
+        return False
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    key = f"{path}:{st.st_mtime_ns}:{st.st_size}"
+
+    caps = _load_caps()
+    entry = caps.get(name)
+    if entry and entry.get('key') == key:
+        return entry.get('ok', False)
+
+    try:
+        subprocess.run([path] + list(version_args), capture_output=True, check=True, timeout=30)
+        ok = True
+    except Exception:
+        ok = False
+    caps[name] = {'key': key, 'ok': ok}
+    _save_caps()
+    return ok
+
+
+def module_available(module_name):
+    """التحقق من وجود الحزمة بدون استيرادها"""
+    try:
+        return importlib.util.find_spec(module_name) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+def ensure_module(module_name, pip_packages=None):
+    """تثبيت الحزمة فقط إذا لم تكن موجودة"""
+    if module_available(module_name):
+        return True
+    pip_packages = pip_packages or [module_name]
+    print(f"[*] تثبيت {' '.join(pip_packages)}...")
+    try:
+        subprocess.check_call([sys.executable, '-m', 'pip', 'install', '--quiet'] + list(pip_packages))
+    except Exception:
+        return False
+    importlib.invalidate_caches()
+    return module_available(module_name)
+
+
+def lazy_import(module_name, pip_packages=None):
+    """استيراد الحزمة عند أول استخدام (مع تثبيتها عند الحاجة)"""
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+    ensure_module(module_name, pip_packages)
+    return importlib.import_module(module_name)
+
+
+def make_soup(html):
+    """BeautifulSoup مع استيراد bs4 عند أول استخدام فقط"""
+    bs4 = lazy_import('bs4', ['beautifulsoup4'])
+    with tracing.span('parse_html', 'python', chars=len(html)):
+        return bs4.BeautifulSoup(html, 'html.parser')
@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+"""
+منسق لعدة أجهزة: المنسق يملك طابور الحلقات ويؤجرها عبر HTTP/JSON لعمال على أجهزة أخرى
+كل إيجار له نبضات ومدة صلاحية؛ الإيجار المنتهي يعود إلى الطابور، والعامل يرسل النتيجة ومكان الملف
+
+    python coordinator.py serve 8765 modablaj-terzi-episode-:1-30 [نمط:من-إلى ...]
+    python coordinator.py worker http://host:8765 [مجلد]
+    python coordinator.py --bench [1 2 4]
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import socket
+import threading
+import multiprocessing
+from collections import deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import requests
+
+import supervisor
+from scheduler import MAX_ATTEMPTS
+from metrics import record_episode, start_exporter
+
+LEASE_SECONDS = 120.0          # بدون نبضة خلال هذه المدة يعود الإيجار إلى الطابور
+HEARTBEAT_INTERVAL = 20.0
+POLL_INTERVAL = 5.0            # انتظار العامل عندما لا توجد مهمة متاحة الآن
+REQUEST_TIMEOUT = 15
+DEFAULT_PORT = 8765
+BASE_URL = "https://x.3seq.com/video"
+
+
+class Coordinator:
+    """حالة الطابور: queued -> leased -> done/failed (آمنة للخيوط)"""
+
+    def __init__(self, lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS, verbose=True):
+        self.lease_seconds = lease_seconds
+        self.verbose = verbose
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.queue = deque()
+        self.leases = {}       # lease_id -> {'job', 'worker', 'expires'}
+        self.expired = {}      # إيجارات منتهية قد تصل نتيجتها متأخرة
+        self.results = {}
+
+    def add_job(self, job):
+        """job: dict قابل للتحويل إلى JSON مع 'id' فريد"""
+        with self.lock:
+            if job['id'] in self.jobs:
+                return
+            self.jobs[job['id']] = dict(job, attempts=0)
+            self.queue.append(job['id'])
+
+    def add_result(self, job_id, success, message, artifact=None, worker=''):
+        with self.lock:
+            self.results[job_id] = {'success': success, 'message': message, 'artifact': artifact,
+                                    'worker': worker}
+
+    def _expire(self, now):
+        for lease_id, lease in list(self.leases.items()):
+            if lease['expires'] <= now:
+                self.expired[lease_id] = self.leases.pop(lease_id)
+                job_id = lease['job']
+                if job_id in self.results:
+                    continue
+                if self.jobs[job_id]['attempts'] >= self.max_attempts:
+                    # آخر محاولة: فشل نهائي (نجاح متأخر من نفس الإيجار يستبدله)
+                    print(f"[!] انتهى إيجار {job_id} ({lease['worker']}) - آخر محاولة")
+                    self.results[job_id] = {'success': False, 'message': "انتهى الإيجار", 'artifact': None,
+                                            'worker': lease['worker'], 'expired': True}
+                else:
+                    print(f"[*] انتهى إيجار {job_id} ({lease['worker']}) - إعادة إلى الطابور")
+                    self.queue.appendleft(job_id)
+
+    @property
+    def finished(self):
+        with self.lock:
+            return len(self.results) == len(self.jobs)
+
+    def lease(self, worker):
+        """(lease_id, job) أو (None, None) إذا لا توجد مهمة متاحة الآن"""
+        with self.lock:
+            self._expire(time.monotonic())
+            while self.queue:
+                job_id = self.queue.popleft()
+                if job_id in self.results:
+                    continue
+                job = self.jobs[job_id]
+                job['attempts'] += 1
+                lease_id = job['lease'] = uuid.uuid4().hex
+                self.leases[lease_id] = {'job': job_id, 'worker': worker,
+                                         'expires': time.monotonic() + self.lease_seconds}
+                return lease_id, dict(job)
+            return None, None
+
+    def heartbeat(self, lease_id):
+        with self.lock:
+            lease = self.leases.get(lease_id)
+            if not lease:
+                return False
+            lease['expires'] = time.monotonic() + self.lease_seconds
+            return True
+
+    def complete(self, lease_id, success, message, artifact=None):
+        """
+        نتيجة من عامل؛ نتيجة إيجار منتهٍ تُقبل إذا لم تُؤجر الحلقة لعامل آخر بعده (العمل لا يضيع)
+        الفشل يعيد الحلقة إلى آخر الطابور حتى حد المحاولات
+        """
+        with self.lock:
+            lease = self.leases.pop(lease_id, None)
+            expired = lease is None
+            if expired:
+                lease = self.expired.pop(lease_id, None)
+            job_id = lease and lease['job']
+            if not job_id:
+                return False
+            job = self.jobs[job_id]
+            if expired and job.get('lease') != lease_id:
+                # أُعيد تأجيرها: الإيجار الجديد يملك الحلقة
+                return False
+            previous = self.results.get(job_id)
+            if previous and not (success and previous.get('expired')):
+                return False
+            if success or job['attempts'] >= self.max_attempts:
+                self.results[job_id] = {'success': success, 'message': message, 'artifact': artifact,
+                                        'worker': lease['worker']}
+            elif not expired:
+                # الإيجار المنتهي أُعيد إلى الطابور عند انتهائه
+                self.queue.append(job_id)
+        if self.verbose:
+            mark = '✓' if success else '✗'
+            print(f"[{mark}] {job_id}: {message} ({lease['worker']})")
+        return True
+
+    def status(self):
+        with self.lock:
+            self._expire(time.monotonic())
+            return {
+                'total': len(self.jobs),
+                'queued': len(self.queue),
+                'leased': len(self.leases),
+                'done': sum(1 for r in self.results.values() if r['success']),
+                'failed': sum(1 for r in self.results.values() if not r['success']),
+                'finished': len(self.results) == len(self.jobs),
+                'results': dict(self.results),
+            }
+
+
+class CoordinatorHandler(BaseHTTPRequestHandler):
+    """POST /lease، /heartbeat، /result و GET /status (JSON)"""
+
+    coordinator = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, code, payload=None):
+        body = json.dumps(payload if payload is not None else {}, ensure_ascii=False).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            return json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            return {}
+
+    def do_GET(self):
+        if self.path == '/status':
+            self._send(200, self.coordinator.status())
+        else:
+            self._send(404)
+
+    def do_POST(self):
+        body = self._body()
+        coordinator = self.coordinator
+        if self.path == '/lease':
+            lease_id, job = coordinator.lease(body.get('worker', '?'))
+            if job:
+                self._send(200, {'lease': lease_id, 'job': job, 'heartbeat': HEARTBEAT_INTERVAL})
+            else:
+                self._send(200, {'lease': None, 'finished': coordinator.finished})
+        elif self.path == '/heartbeat':
+            ok = coordinator.heartbeat(body.get('lease'))
+            self._send(200 if ok else 410, {'ok': ok})
+        elif self.path == '/result':
+            ok = coordinator.complete(body.get('lease'), bool(body.get('success')), body.get('message', ''),
+                                      body.get('artifact'))
+            self._send(200, {'accepted': ok})
+        else:
+            self._send(404)
+
+
+class CoordinatorServer:
+    """with CoordinatorServer(coordinator, port) as server: ... (port=0 لمنفذ عشوائي)"""
+
+    def __init__(self, coordinator, port=DEFAULT_PORT, host='0.0.0.0'):
+        handler = type('Handler', (CoordinatorHandler,), {'coordinator': coordinator})
+        self.coordinator = coordinator
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+# ===== العامل =====
+
+def artifact(path):
+    """مكان الملف الناتج كما يراه المنسق (الجهاز والمسار)"""
+    if not path or not os.path.exists(path):
+        return None
+    return {'host': socket.gethostname(), 'path': os.path.abspath(path), 'size': os.path.getsize(path)}
+
+
+def heartbeat(url, lease, job_id, interval, stop):
+    """نبضات الإيجار حتى stop (جلسة خاصة: requests.Session لا تُشارك بين الخيوط)"""
+    with requests.Session() as session:
+        while not stop.wait(interval):
+            try:
+                if session.post(f"{url}/heartbeat", json={'lease': lease},
+                                timeout=REQUEST_TIMEOUT).status_code == 410:
+                    print(f"[!] {job_id}: انتهى الإيجار (سيُرسل الناتج على أي حال)")
+                    return
+            except requests.RequestException:
+                pass
+
+
+def run_worker(url, handler, name=None, poll=POLL_INTERVAL):
+    """
+    حلقة العامل: إيجار -> تنفيذ مع نبضات في الخلفية -> إرسال النتيجة، حتى ينتهي الطابور
+    handler(job) -> (نجاح، رسالة، مسار الملف أو None)
+    """
+    name = name or f"{socket.gethostname()}:{os.getpid()}"
+    session = requests.Session()
+    processed = 0
+    while True:
+        try:
+            reply = session.post(f"{url}/lease", json={'worker': name}, timeout=REQUEST_TIMEOUT).json()
+        except (requests.RequestException, ValueError) as e:
+            print(f"[!] تعذر الاتصال بالمنسق: {e}")
+            time.sleep(poll)
+            continue
+        if not reply.get('lease'):
+            if reply.get('finished'):
+                return processed
+            time.sleep(poll)
+            continue
+
+        lease, job = reply['lease'], reply['job']
+        stop = threading.Event()
+        beater = threading.Thread(target=heartbeat, daemon=True,
+                                  args=(url, lease, job['id'], reply.get('heartbeat', HEARTBEAT_INTERVAL), stop))
+        beater.start()
+        try:
+            success, message, path = handler(job)
+        except Exception as e:
+            success, message, path = False, f"خطأ: {str(e)[:50]}", None
+        finally:
+            stop.set()
+            beater.join()
+        for _ in range(3):
+            try:
+                session.post(f"{url}/result", json={'lease': lease, 'success': success, 'message': message,
+                                                    'artifact': artifact(path) if success else None},
+                             timeout=REQUEST_TIMEOUT)
+                break
+            except requests.RequestException:
+                time.sleep(poll)
+        processed += 1
+
+
+def series_jobs(spec, base_url=BASE_URL):
+    """'نمط:من-إلى' -> (مهام، حلقات غير موجودة)؛ الروابط من صفحة الموسم مرة واحدة على المنسق"""
+    from episodes import resolve_episode_urls
+    from source_cache import episode_key
+    pattern, _, episodes = spec.rpartition(':')
+    start, _, end = episodes.partition('-')
+    numbers = list(range(int(start), int(end or start) + 1))
+    urls, missing = resolve_episode_urls(base_url, pattern, numbers)
+    jobs = [{'id': episode_key(pattern, ep), 'base_url': base_url, 'series_pattern': pattern, 'episode': ep,
+             'episode_url': urls.get(ep)} for ep in numbers if ep not in missing]
+    return jobs, [episode_key(pattern, ep) for ep in missing]
+
+
+def serve(port, specs):
+    coordinator = Coordinator()
+    for spec in specs:
+        jobs, missing = series_jobs(spec)
+        for job in jobs:
+            coordinator.add_job(job)
+        for job_id in missing:
+            coordinator.add_job({'id': job_id})
+            coordinator.add_result(job_id, False, "غير موجودة")
+    with CoordinatorServer(coordinator, port):
+        print(f"[*] المنسق على المنفذ {port}: {len(coordinator.jobs)} حلقات")
+        print(f"[*] العمال: python coordinator.py worker http://<هذا الجهاز>:{port}")
+        while not coordinator.finished:
+            time.sleep(POLL_INTERVAL)
+        status = coordinator.status()
+    print(f"[*] الناجحة: {status['done']}/{status['total']}")
+    for job_id, result in sorted(status['results'].items()):
+        place = result['artifact'] and f"{result['artifact']['host']}:{result['artifact']['path']}"
+        print(f"    {job_id}: {place or result['message']}")
+    return status
+
+
+# ===== القياس على جهاز واحد =====
+
+def bench_handler(job):
+    """حلقة وهمية: عمل ثابت المدة بدلاً من تنزيل وضغط"""
+    time.sleep(job['seconds'])
+    return True, "تم", None
+
+
+def bench_worker(url, name):
+    run_worker(url, bench_handler, name, poll=0.05)
+
+
+def benchmark(sizes=(1, 2, 4), jobs=24, seconds=0.25):
+    """عمليات عاملة متعددة على localhost: الإنتاجية يجب أن تقترب من الخطية مع عدد العمال"""
+    print(f"[*] {jobs} مهمة × {seconds}ث")
+    base = None
+    results = {}
+    for size in sizes:
+        coordinator = Coordinator(verbose=False)
+        for index in range(jobs):
+            coordinator.add_job({'id': f"bench{index:03d}", 'seconds': seconds})
+        with CoordinatorServer(coordinator, 0, '127.0.0.1') as server:
+            start = time.monotonic()
+            processes = [multiprocessing.Process(target=bench_worker, args=(server.url, f"bench-{i}"))
+                         for i in range(size)]
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join()
+            elapsed = time.monotonic() - start
+        rate = jobs / elapsed
+        base = base or rate / size
+        results[size] = rate
+        print(f"  {size} عامل: {rate:.1f} مهمة/ث ({elapsed:.1f}ث، {rate / (base * size):.0%} من الخطي)")
+    return results
+
+
+def low2_handler(download_dir):
+    """تنفيذ حلقة بنفس مسار low2 (تخطيط، خوادم، تنزيل، ضغط) على هذا الجهاز"""
+    import low2
+
+    def handle(job):
+        started = time.monotonic()
+        success, message, path = low2.process_job(job, download_dir)
+        record_episode(time.monotonic() - started, success)
+        return success, message, path
+    return handle
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if args and args[0] == '--bench':
+        benchmark(tuple(int(a) for a in args[1:]) or (1, 2, 4))
+    elif len(args) >= 3 and args[0] == 'serve':
+        serve(int(args[1]), args[2:])
+    elif len(args) >= 2 and args[0] == 'worker':
+        download_dir = args[2] if len(args) > 2 else 'worker_output'
+        os.makedirs(download_dir, exist_ok=True)
+        supervisor.install()
+        start_exporter()
+        print(f"[*] عدد الحلقات المنفذة: {run_worker(args[1].rstrip('/'), low2_handler(download_dir))}")
+    else:
+        print(__doc__)
+        sys.exit(1)
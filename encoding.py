@@ -0,0 +1,486 @@
+#!/usr/bin/env python3
+"""
+ترميز متعدد الدقات: فك ترميز المصدر مرة واحدة وتقسيمه في filter graph إلى عدة دقات في تشغيل ffmpeg واحد
+ومخرجات MP4 قابلة للبث فور انتهاء الترميز (بدون إعادة كتابة faststart)
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import struct
+import resource
+import functools
+
+import supervisor
+from supervisor import run_ffmpeg
+
+# ملف الإعدادات: {"جزء من اسم المسلسل": [درجات...], "default": [...]}
+LADDERS_FILE = os.environ.get('FHRS_LADDERS') or os.path.join(
+    os.path.expanduser('~'), '.config', 'fhrs', 'ladders.json'
+)
+
+# درجة واحدة: height مع crf أو bitrate (مثل '400k')، وpreset وaudio وcodec اختيارية
+DEFAULT_LADDER = [
+    {'height': 240, 'crf': 30},
+]
+# نسخة للتليجرام + نسخة أرشيف (عندما لا يحدد المسلسل درجاته)
+ARCHIVE_LADDER = [
+    {'height': 240, 'crf': 30},
+    {'height': 480, 'crf': 26},
+]
+
+# ملف التشغيل في القناة: keyframe كل ثانيتين (بدء وتنقل سريع)، سقف VBV مناسب لشبكات الجوال،
+# وmoov في البداية - الإعداد الافتراضي لما يُرفع عبر upload_video_to_channel
+STREAMING_PROFILE = {
+    'height': 240,
+    'crf': 28,
+    'preset': 'veryfast',
+    'gop_seconds': 2,
+    'maxrate': '400k',
+    'bufsize': '800k',
+    'profile': 'main',
+    'audio': '64k',
+}
+
+DEFAULT_PRESET = 'veryfast'
+DEFAULT_AUDIO = '64k'
+
+# طريقة جعل MP4 قابلاً للبث:
+# reserved: حجز مساحة moov في بداية الملف (MP4 عادي، بدون تمرير ثانٍ)
+# fragmented: fMP4 (moov فارغ في البداية ثم أجزاء moof/mdat)
+# faststart: الطريقة القديمة - إعادة كتابة الملف كاملاً بعد الترميز
+MP4_MODE = os.environ.get('FHRS_MP4_MODE', 'reserved')
+# ما يُرفع إلى القناة: MP4 عادي بـ moov في البداية دائماً (تشغيل Telegram المتقطع لا يدعم fMP4)
+UPLOAD_MP4_MODE = 'reserved' if MP4_MODE == 'fragmented' else MP4_MODE
+MOOV_BYTES_PER_FRAME = 16      # stsz + ctts + stco/stss لكل إطار فيديو (تقدير متحفظ)
+AUDIO_FRAMES_PER_SECOND = 47   # AAC عند 48kHz
+MOOV_MARGIN = 1.5
+
+# محركات الترميز (FHRS_CODEC أو "codec" في درجات المسلسل):
+# presets معايرة على أسماء x264 - نفس الاسم يعطي سرعة ترميز متقاربة بين المحركات
+# crf في الإعدادات على مقياس المحرك نفسه (يُقص إلى crf_max)؛ rate_cap: طريقة سقف معدل البت
+CODECS = {
+    'x264': {
+        'encoder': 'libx264',
+        'presets': {},
+        'crf_max': 51,
+        'tunes': True,
+        'profile': True,
+        'rate_cap': 'vbv',
+        'args': [],
+        'compat': 'كل الأجهزة والمتصفحات',
+    },
+    'x265': {
+        'encoder': 'libx265',
+        'presets': {'ultrafast': 'ultrafast', 'superfast': 'ultrafast', 'veryfast': 'superfast',
+                    'faster': 'veryfast', 'fast': 'faster', 'medium': 'fast', 'slow': 'medium'},
+        'crf_max': 51,
+        'tunes': True,
+        'profile': True,
+        'rate_cap': 'vbv',
+        # hvc1 يلزم لتشغيل HEVC على أجهزة Apple
+        'args': ['-tag:v', 'hvc1', '-x265-params', 'log-level=error'],
+        'compat': 'أغلب الهواتف الحديثة؛ بعض متصفحات سطح المكتب لا',
+    },
+    'svtav1': {
+        'encoder': 'libsvtav1',
+        'presets': {'ultrafast': '12', 'superfast': '11', 'veryfast': '10', 'faster': '9', 'fast': '8',
+                    'medium': '7', 'slow': '6'},
+        'crf_max': 63,
+        'tunes': False,
+        'profile': False,
+        # SVT-AV1 لا يستخدم -maxrate/-bufsize مع CRF: السقف عبر mbr (kbps)
+        'rate_cap': 'mbr',
+        'args': [],
+        'compat': 'أجهزة حديثة فقط (فك ترميز برمجي بطيء على القديمة)',
+    },
+}
+CODEC = os.environ.get('FHRS_CODEC', 'x264')
+
+
+def normalize_rung(rung):
+    """إكمال الحقول الناقصة للدرجة"""
+    rung = dict(rung)
+    rung['height'] = int(rung['height'])
+    if not rung.get('bitrate') and rung.get('crf') is None:
+        rung['crf'] = 30
+    rung.setdefault('preset', DEFAULT_PRESET)
+    rung.setdefault('audio', DEFAULT_AUDIO)
+    rung.setdefault('suffix', f"{rung['height']}p")
+    rung.setdefault('codec', CODEC)
+    return rung
+
+
+@functools.lru_cache(maxsize=None)
+def available_encoders():
+    """أسماء مرمزات الفيديو في ffmpeg المثبت"""
+    result = supervisor.run(['ffmpeg', '-hide_banner', '-encoders'], timeout=30)
+    return frozenset(re.findall(r'^\s*V\S*\s+(\S+)', result.stdout, re.M))
+
+
+def codec_backend(name=None):
+    """(الاسم، المحرك) - x264 إذا كان المحرك غير معروف أو غير مبني في ffmpeg"""
+    name = name or CODEC
+    backend = CODECS.get(name)
+    if backend is None:
+        print(f"[!] محرك غير معروف: {name} - استخدام x264")
+        return 'x264', CODECS['x264']
+    if name != 'x264':
+        try:
+            found = backend['encoder'] in available_encoders()
+        except Exception:
+            found = False
+        if not found:
+            print(f"[!] {backend['encoder']} غير متوفر في ffmpeg - استخدام x264")
+            return 'x264', CODECS['x264']
+    return name, backend
+
+
+def codec_args(codec=None, crf=30, preset=DEFAULT_PRESET, tune=None):
+    """خيارات الفيديو لمحرك: المرمز وpreset المعاير وCRF"""
+    _, backend = codec_backend(codec)
+    args = ['-c:v', backend['encoder'], '-preset', backend['presets'].get(preset, preset)]
+    if crf is not None:
+        args += ['-crf', str(min(int(crf), backend['crf_max']))]
+    if tune and backend['tunes']:
+        args += ['-tune', tune]
+    return args + backend['args']
+
+
+def codec_for(series, default=None):
+    """محرك نسخة النشر للمسلسل (من درجاته في ladders.json)"""
+    return ladder_for(series, default)[0]['codec']
+
+
+def double_rate(rate):
+    """'400k' -> '800k' (bufsize = ضعف معدل البت)"""
+    match = re.match(r'^([\d.]+)([a-zA-Z]*)$', str(rate))
+    if not match:
+        return str(rate)
+    return f"{float(match.group(1)) * 2:g}{match.group(2)}"
+
+
+def rate_kbps(rate):
+    """'400k' أو '1.5M' أو '400000' (بت/ث كما في ffmpeg) -> 400 أو 1500 أو 400"""
+    match = re.match(r'^([\d.]+)([kKmM]?)$', str(rate))
+    if not match:
+        return 0
+    scale = {'': 0.001, 'k': 1, 'm': 1000}[match.group(2).lower()]
+    return int(float(match.group(1)) * scale)
+
+
+def rate_cap_args(backend, maxrate, bufsize=None):
+    """سقف معدل البت بطريقة المحرك (VBV لـ x264/x265، mbr لـ SVT-AV1)"""
+    if backend['rate_cap'] == 'mbr':
+        kbps = rate_kbps(maxrate)
+        return ['-svtav1-params', f'mbr={kbps}'] if kbps else []
+    return ['-maxrate', str(maxrate), '-bufsize', bufsize or double_rate(maxrate)]
+
+
+def probe_fps(source):
+    """معدل الإطارات (30 إذا تعذر)"""
+    try:
+        result = supervisor.run(
+            ['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-show_entries', 'stream=avg_frame_rate',
+             '-of', 'default=noprint_wrappers=1:nokey=1', source],
+            timeout=30
+        )
+        num, _, den = result.stdout.strip().partition('/')
+        fps = float(num) / float(den or 1)
+        return fps if fps > 0 else 30.0
+    except Exception:
+        return 30.0
+
+
+def moov_reserve(duration, fps=30.0):
+    """حجم moov المتوقع (بايت) مع هامش"""
+    samples = duration * (fps * MOOV_BYTES_PER_FRAME + AUDIO_FRAMES_PER_SECOND * 6)
+    return int(samples * MOOV_MARGIN) + 64 * 1024
+
+
+def streamable_args(mode=MP4_MODE, duration=0, fps=30.0):
+    """خيارات ffmpeg لمخرج MP4 قابل للبث"""
+    if mode == 'fragmented':
+        return ['-movflags', '+frag_keyframe+empty_moov+default_base_moof']
+    if mode == 'reserved' and duration > 0:
+        return ['-moov_size', str(moov_reserve(duration, fps))]
+    # بدون مدة معروفة لا يمكن تقدير moov
+    return ['-movflags', '+faststart']
+
+
+def moov_overflow(result):
+    """المساحة المحجوزة لم تكفِ (الملف بدون moov - يجب إعادة الترميز)"""
+    return 'reserved_moov_size is too small' in result.log.text()
+
+
+def insert_before_outputs(cmd, outputs, extra):
+    """إضافة خيارات قبل كل ملف مخرج في الأمر"""
+    cmd = list(cmd)
+    for path in outputs:
+        index = len(cmd) - 1 - cmd[::-1].index(path)
+        cmd[index:index] = extra
+    return cmd
+
+
+def run_streamable(cmd, duration=None, progress=None, mode=MP4_MODE, outputs=None):
+    """
+    تشغيل ffmpeg بمخرجات MP4 قابلة للبث (الملف الأخير في الأمر، أو outputs)
+    إذا لم تكفِ مساحة moov المحجوزة يُعاد الترميز بـ faststart
+    """
+    outputs = outputs or [cmd[-1]]
+    source = cmd[cmd.index('-i') + 1]
+    if duration is None:
+        duration = supervisor.probe_duration(source)
+    fps = probe_fps(source) if mode == 'reserved' else 30.0
+    result = run_ffmpeg(insert_before_outputs(cmd, outputs, streamable_args(mode, duration, fps)), duration,
+                        progress=progress)
+    if result.returncode != 0 and mode == 'reserved' and moov_overflow(result):
+        print("[!] مساحة moov المحجوزة لم تكفِ - إعادة الترميز مع faststart")
+        result = run_ffmpeg(insert_before_outputs(cmd, outputs, streamable_args('faststart')), duration,
+                            progress=progress)
+    return result
+
+
+def top_level_boxes(path, limit=16):
+    """أنواع صناديق MP4 في المستوى الأعلى بالترتيب"""
+    boxes = []
+    with open(path, 'rb') as f:
+        while len(boxes) < limit:
+            header = f.read(8)
+            if len(header) < 8:
+                break
+            size, kind = struct.unpack('>I4s', header)
+            if size == 1:
+                size = struct.unpack('>Q', f.read(8))[0]
+                f.seek(size - 16, 1)
+            elif size == 0:
+                boxes.append(kind.decode('latin-1'))
+                break
+            else:
+                f.seek(size - 8, 1)
+            boxes.append(kind.decode('latin-1'))
+    return boxes
+
+
+def is_streamable(path):
+    """moov قبل أول mdat (شرط التشغيل قبل اكتمال التنزيل)"""
+    boxes = top_level_boxes(path)
+    return 'moov' in boxes and ('mdat' not in boxes or boxes.index('moov') < boxes.index('mdat'))
+
+
+def load_ladders(path=LADDERS_FILE):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            ladders = json.load(f)
+        return ladders if isinstance(ladders, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+
+def ladder_for(series, default=None, path=LADDERS_FILE):
+    """
+    درجات المسلسل (أطول مفتاح يظهر في اسم/نمط المسلسل)، ثم 'default' في الملف، ثم default
+    مرتبة من الأصغر للأكبر: الدرجة الأولى هي نسخة النشر
+    """
+    ladders = load_ladders(path)
+    matches = [key for key in ladders if key != 'default' and key in (series or '')]
+    if matches:
+        ladder = ladders[max(matches, key=len)]
+    else:
+        ladder = ladders.get('default') or default or DEFAULT_LADDER
+    return sorted((normalize_rung(r) for r in ladder), key=lambda r: r['height'])
+
+
+def rendition_path(base_file, rung, primary=False):
+    """الدرجة الأولى تأخذ اسم الملف نفسه، والباقي لاحقة الدقة"""
+    if primary:
+        return base_file
+    name, ext = os.path.splitext(base_file)
+    return f"{name}_{rung['suffix']}{ext}"
+
+
+def ladder_outputs(base_file, ladder):
+    """[(درجة، ملف)] - الأصغر هو base_file"""
+    return [(rung, rendition_path(base_file, rung, index == 0)) for index, rung in enumerate(ladder)]
+
+
+def ladder_command(input_file, outputs, threads=0):
+    """أمر ffmpeg واحد: split إلى N فرع، scale لكل فرع، وإعدادات ترميز لكل مخرج"""
+    count = len(outputs)
+    if count == 1:
+        graph = f"[0:v]scale=-2:'min({outputs[0][0]['height']},ih)'[v0]"
+    else:
+        labels = ''.join(f"[s{i}]" for i in range(count))
+        # لا تكبير: المصدر الأصغر من الدرجة يبقى بدقته
+        scales = ';'.join(f"[s{i}]scale=-2:'min({rung['height']},ih)'[v{i}]" for i, (rung, _) in enumerate(outputs))
+        graph = f"[0:v]split={count}{labels};{scales}"
+
+    cmd = ['ffmpeg', '-i', input_file, '-filter_complex', graph]
+    for index, (rung, path) in enumerate(outputs):
+        codec, backend = codec_backend(rung.get('codec'))
+        cmd += ['-map', f'[v{index}]', '-map', '0:a?']
+        if rung.get('bitrate'):
+            bitrate = str(rung['bitrate'])
+            cmd += codec_args(codec, None, rung['preset']) + ['-b:v', bitrate]
+            cmd += rate_cap_args(backend, bitrate, rung.get('bufsize'))
+        else:
+            cmd += codec_args(codec, rung['crf'], rung['preset'])
+            if rung.get('maxrate'):
+                # CRF بسقف: الجودة ثابتة لكن بدون قمم تتجاوز سرعة الخط
+                cmd += rate_cap_args(backend, rung['maxrate'], rung.get('bufsize'))
+        if rung.get('gop_seconds'):
+            # أقصى مسافة بين keyframes بالثواني (مستقلة عن معدل الإطارات)
+            cmd += ['-force_key_frames', f"expr:gte(t,n_forced*{rung['gop_seconds']})"]
+        if rung.get('profile'):
+            if backend['profile']:
+                cmd += ['-profile:v', rung['profile']]
+            cmd += ['-pix_fmt', 'yuv420p']
+        cmd += ['-c:a', 'aac', '-b:a', rung['audio'], '-threads', str(threads), '-y', path]
+    return cmd
+
+
+def encode_ladder(input_file, outputs, progress=None, threads=0, mode=MP4_MODE):
+    """
+    ترميز كل الدقات بتشغيل ffmpeg واحد (فك ترميز واحد)، كلها قابلة للبث
+    outputs: [(درجة، ملف)]؛ يرجع True إذا نجح الترميز وكُتبت كل الملفات
+    """
+    if not os.path.exists(input_file):
+        print(f"[!] الملف غير موجود: {input_file}")
+        return False
+    names = ', '.join(rung['suffix'] for rung, _ in outputs)
+    print(f"[*] ترميز {len(outputs)} دقات بفك ترميز واحد: {names}")
+    result = run_streamable(ladder_command(input_file, outputs, threads), progress=progress, mode=mode,
+                            outputs=[path for _, path in outputs])
+    if result.returncode == 0 and all(os.path.exists(path) for _, path in outputs):
+        for rung, path in outputs:
+            print(f"    {rung['suffix']}: {os.path.getsize(path) / (1024 * 1024):.1f}MB")
+        return True
+    print(f"[!] فشل الترميز المتعدد: {result.log.tail()[:200]}")
+    return False
+
+
+def streaming_rung(rung=None):
+    """درجة النشر بإعدادات ملف التشغيل (إعدادات المسلسل تتقدم على الافتراضية)"""
+    return normalize_rung(dict(STREAMING_PROFILE, **(rung or {})))
+
+
+def encode_for_streaming(input_file, output_file, progress=None, rung=None):
+    """ترميز نسخة النشر بملف التشغيل (moov في البداية دائماً، وليس fMP4)"""
+    return encode_ladder(input_file, [(streaming_rung(rung), output_file)], progress=progress,
+                         mode=UPLOAD_MP4_MODE)
+
+
+def ensure_streamable(path):
+    """نقل moov إلى البداية بدون إعادة ترميز إذا لم يكن الملف قابلاً للبث"""
+    try:
+        if is_streamable(path):
+            return True
+    except OSError:
+        return False
+    temp = path + '.stream.mp4'
+    result = supervisor.run(['ffmpeg', '-i', path, '-c', 'copy', '-map', '0', '-movflags', '+faststart',
+                             '-y', '-loglevel', 'error', temp], role='download')
+    if result.returncode == 0 and os.path.exists(temp):
+        os.replace(temp, path)
+        return True
+    if os.path.exists(temp):
+        os.remove(temp)
+    return False
+
+
+# ===== BENCHMARK =====
+
+def child_io():
+    """(ثوانٍ، بايتات مكتوبة) لكل العمليات الفرعية المنتهية حتى الآن"""
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime, usage.ru_oublock * 512
+
+
+def benchmark_streamable(input_file, modes=('faststart', 'reserved', 'fragmented'), height=240, crf=30):
+    """
+    مقارنة طرق MP4 القابل للبث على نفس المصدر: الوقت، البايتات المكتوبة، وموقع moov
+    (faststart يكتب الملف مرتين، reserved/fragmented مرة واحدة)
+    """
+    duration = supervisor.probe_duration(input_file)
+    name, _ = os.path.splitext(input_file)
+    results = []
+    for mode in modes:
+        output = f"{name}_bench_{mode}.mp4"
+        cmd = ['ffmpeg', '-i', input_file, '-vf', f'scale=-2:{height}', '-c:v', 'libx264', '-preset', DEFAULT_PRESET,
+               '-crf', str(crf), '-c:a', 'aac', '-b:a', DEFAULT_AUDIO, '-y', output]
+        _, written_before = child_io()
+        start = time.time()
+        result = run_streamable(cmd, duration, mode=mode)
+        elapsed = time.time() - start
+        _, written_after = child_io()
+        ok = result.returncode == 0 and os.path.exists(output)
+        results.append({
+            'mode': mode,
+            'ok': ok,
+            'seconds': elapsed,
+            'written': written_after - written_before,
+            'size': os.path.getsize(output) if ok else 0,
+            'streamable': ok and (is_streamable(output) or 'moof' in top_level_boxes(output)),
+        })
+        if os.path.exists(output):
+            os.remove(output)
+
+    print(f"\n{'الطريقة':<12}{'الوقت':>10}{'مكتوب MB':>12}{'الحجم MB':>12}  بث")
+    for r in results:
+        print(f"{r['mode']:<12}{r['seconds']:>9.1f}ث{r['written'] / 1024 ** 2:>12.1f}{r['size'] / 1024 ** 2:>12.1f}  "
+              f"{'نعم' if r['streamable'] else 'لا'}")
+    return results
+
+
+def benchmark_codecs(input_file, codecs=tuple(CODECS), height=240, crf=28, preset=DEFAULT_PRESET):
+    """
+    مقارنة المحركات على نفس المصدر ونفس درجة النشر: سرعة الترميز (إطار/ث)، الحجم، والتوافق
+    الحجم يحدد وقت الرفع إلى Telegram ومساحة التخزين
+    """
+    duration = supervisor.probe_duration(input_file)
+    frames = duration * probe_fps(input_file)
+    name, _ = os.path.splitext(input_file)
+    results = []
+    for codec in codecs:
+        used, backend = codec_backend(codec)
+        if used != codec:
+            results.append({'codec': codec, 'ok': False, 'compat': backend['compat']})
+            continue
+        output = f"{name}_bench_{codec}.mp4"
+        rung = streaming_rung({'height': height, 'crf': crf, 'preset': preset, 'codec': codec})
+        start = time.time()
+        result = run_streamable(ladder_command(input_file, [(rung, output)]), duration)
+        elapsed = max(time.time() - start, 1e-3)
+        ok = result.returncode == 0 and os.path.exists(output)
+        results.append({
+            'codec': codec,
+            'ok': ok,
+            'fps': frames / elapsed if ok else 0.0,
+            'size': os.path.getsize(output) if ok else 0,
+            'compat': backend['compat'],
+        })
+        if os.path.exists(output):
+            os.remove(output)
+
+    base = next((r['size'] for r in results if r['ok'] and r['codec'] == 'x264'), 0)
+    print(f"\n{'المحرك':<10}{'إطار/ث':>10}{'الحجم MB':>12}{'مقابل x264':>12}  التوافق")
+    for r in results:
+        if not r['ok']:
+            print(f"{r['codec']:<10}{'غير متوفر':>10}{'':>12}{'':>12}  {r['compat']}")
+            continue
+        ratio = f"{r['size'] / base:.0%}" if base else '-'
+        print(f"{r['codec']:<10}{r['fps']:>10.0f}{r['size'] / 1024 ** 2:>12.1f}{ratio:>12}  {r['compat']}")
+    return results
+
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 3 and sys.argv[1] == '--bench':
+        benchmark_streamable(sys.argv[2])
+    elif len(sys.argv) >= 3 and sys.argv[1] == '--codecs':
+        benchmark_codecs(sys.argv[2], tuple(sys.argv[3:]) or tuple(CODECS))
+    else:
+        print("الاستخدام: python encoding.py --bench video.mp4")
+        print("           python encoding.py --codecs video.mp4 [x264 x265 svtav1]")
+        sys.exit(1)
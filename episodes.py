@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+استخراج روابط الحلقات من صفحة المسلسل مرة واحدة مع ذاكرة للحلقات غير الموجودة
+"""
+
+import os
+import re
+import time
+import json
+import threading
+import requests
+from urllib.parse import urljoin
+
+from metrics import RESOLVE_SECONDS
+
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
+HEADERS = {
+    'User-Agent': USER_AGENT,
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+    'Referer': 'https://3seq.com/'
+}
+
+CACHE_DIR = os.environ.get('FHRS_CACHE_DIR') or os.path.join(os.path.expanduser('~'), '.cache', 'fhrs')
+MISSING_CACHE_FILE = os.path.join(CACHE_DIR, 'missing_episodes.json')
+MISSING_TTL = 6 * 3600  # الحلقات الجديدة تُنشر باستمرار، لذلك لا نتذكر الغياب للأبد
+
+
+def episode_link_regex(series_pattern):
+    """نمط يطابق روابط حلقات المسلسل مع اللاحقة الديناميكية (مثل -cksi)"""
+    return re.compile(
+        r'href=["\']([^"\']*?' + re.escape(series_pattern) + r'(\d+)(?:-[a-z0-9]+)?/?)(?:\?[^"\']*)?["\']',
+        re.IGNORECASE
+    )
+
+
+def parse_episode_links(html, series_pattern, page_url):
+    """استخراج {رقم الحلقة: الرابط النهائي} من HTML"""
+    episodes = {}
+    for match in episode_link_regex(series_pattern).finditer(html):
+        href, number = match.group(1), int(match.group(2))
+        url = urljoin(page_url, href).rstrip('/')
+        # نفضل الرابط الذي يحتوي على اللاحقة الديناميكية
+        if number not in episodes or len(url) > len(episodes[number]):
+            episodes[number] = url
+    return episodes
+
+
+def enumerate_episodes(series_pattern, index_url, session=None):
+    """جلب صفحة المسلسل (أو أي صفحة حلقة) مرة واحدة واستخراج كل روابط الحلقات"""
+    session = session or requests.Session()
+    try:
+        with RESOLVE_SECONDS.time(hop='index'):
+            response = session.get(index_url, headers=HEADERS, timeout=15, allow_redirects=True)
+        if response.status_code != 200:
+            print(f"[!] فشل جلب صفحة المسلسل: {response.status_code}")
+            return {}
+    except Exception as e:
+        print(f"[!] خطأ في جلب صفحة المسلسل: {e}")
+        return {}
+
+    episodes = parse_episode_links(response.text, series_pattern, response.url)
+    # الصفحة نفسها قد تكون حلقة ولا تربط بنفسها
+    own = re.search(re.escape(series_pattern) + r'(\d+)(?:-[a-z0-9]+)?/?$', response.url.split('?')[0])
+    if own:
+        episodes.setdefault(int(own.group(1)), response.url.split('?')[0].rstrip('/'))
+    return episodes
+
+
+class MissingEpisodeCache:
+    """ذاكرة دائمة للحلقات المؤكد عدم وجودها"""
+
+    def __init__(self, path=MISSING_CACHE_FILE, ttl=MISSING_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.data = {}
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                self.data = json.load(f)
+        except (OSError, ValueError):
+            self.data = {}
+
+    def is_missing(self, series_pattern, episode_num):
+        stamp = self.data.get(series_pattern, {}).get(str(episode_num))
+        return stamp is not None and time.time() - stamp < self.ttl
+
+    def mark_missing(self, series_pattern, episode_num):
+        with self.lock:
+            self.data.setdefault(series_pattern, {})[str(episode_num)] = time.time()
+            self.save()
+
+    def clear(self, series_pattern, episode_num):
+        with self.lock:
+            if self.data.get(series_pattern, {}).pop(str(episode_num), None) is not None:
+                self.save()
+
+    def save(self):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(self.data, f)
+            os.replace(tmp, self.path)
+        except OSError:
+            pass
+
+
+def probe_episode(base_url, series_pattern, episode_num, session):
+    """فحص واحد سريع لحلقة غير موجودة في القائمة (بدون إعادة محاولات)"""
+    url = f"{base_url}/{series_pattern}{episode_num:02d}"
+    try:
+        with RESOLVE_SECONDS.time(hop='episode'):
+            response = session.get(url, headers=HEADERS, timeout=10, allow_redirects=True)
+    except Exception:
+        return None, False
+    if response.status_code == 404:
+        return None, True
+    if response.status_code != 200:
+        return None, False
+    found = parse_episode_links(response.text, series_pattern, response.url)
+    final_url = found.get(episode_num) or response.url.split('?')[0].rstrip('/')
+    return final_url, False
+
+
+def resolve_episode_urls(base_url, series_pattern, episode_numbers, index_url=None, cache=None):
+    """
+    إرجاع ({رقم: رابط نهائي}, [أرقام مفقودة]) باستخدام جلب واحد لصفحة القائمة
+    الحلقات التي لم تُحسم (خطأ شبكة) لا تظهر في أي من القائمتين
+    """
+    episode_numbers = list(episode_numbers)
+    cache = cache or MissingEpisodeCache()
+    session = requests.Session()
+    session.headers.update(HEADERS)
+
+    if not index_url and episode_numbers:
+        # صفحة أي حلقة تحتوي على قائمة حلقات الموسم
+        index_url = f"{base_url}/{series_pattern}{episode_numbers[0]:02d}"
+
+    print(f"[*] جلب قائمة الحلقات: {index_url}")
+    listing = enumerate_episodes(series_pattern, index_url, session) if index_url else {}
+    print(f"[*] تم العثور على {len(listing)} حلقة في القائمة")
+
+    urls = {}
+    missing = []
+    for num in episode_numbers:
+        if num in listing:
+            urls[num] = listing[num]
+            cache.clear(series_pattern, num)
+            continue
+        if cache.is_missing(series_pattern, num):
+            missing.append(num)
+            continue
+        final_url, confirmed_missing = probe_episode(base_url, series_pattern, num, session)
+        if final_url:
+            urls[num] = final_url
+        elif confirmed_missing:
+            cache.mark_missing(series_pattern, num)
+            missing.append(num)
+        # غير ذلك (خطأ شبكة): لا نحكم على الحلقة ونترك البحث العادي يتولاها
+
+    if missing:
+        print(f"[!] حلقات غير موجودة: {missing}")
+    return urls, missing
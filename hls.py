@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+قراءة قوائم HLS وتنزيل المقاطع بالتوازي مع طلبات احتياطية (hedging) للمقاطع البطيئة
+"""
+
+import re
+import math
+import time
+import threading
+import concurrent.futures
+from urllib.parse import urljoin
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from episodes import HEADERS
+from source_cache import segment_key
+from metrics import RESOLVE_SECONDS
+
+HEDGE_MIN_DELAY = 1.0     # لا نرسل طلباً مكرراً قبل هذه المدة
+HEDGE_DEFAULT_DELAY = 3.0  # قبل أن تتوفر قياسات كافية
+SEGMENT_TIMEOUT = 20
+MAX_POOL = 16              # أقصى عدد مقاطع متوازية لكل تنزيل
+CHUNK = 64 * 1024          # الطلب الخاسر يتوقف بين قطعة وأخرى
+
+
+class UnsupportedPlaylist(Exception):
+    """قائمة لا يمكن تنزيلها مقطعاً مقطعاً (مثل التشفير) - استخدم ffmpeg مباشرة"""
+
+
+def parse_attributes(line):
+    """تحليل BANDWIDTH=...,RESOLUTION=... إلى dict"""
+    attrs = {}
+    for key, value in re.findall(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)', line.split(':', 1)[-1]):
+        attrs[key] = value.strip('"')
+    return attrs
+
+
+def parse_master(text, base_url):
+    """قائمة الجودات من master playlist"""
+    variants = []
+    lines = text.splitlines()
+    for i, line in enumerate(lines):
+        if line.startswith('#EXT-X-STREAM-INF'):
+            attrs = parse_attributes(line)
+            uri = next((l.strip() for l in lines[i + 1:] if l.strip() and not l.startswith('#')), None)
+            if not uri:
+                continue
+            height = 0
+            if 'RESOLUTION' in attrs and 'x' in attrs['RESOLUTION']:
+                height = int(attrs['RESOLUTION'].split('x')[1] or 0)
+            variants.append({
+                'url': urljoin(base_url, uri),
+                'bandwidth': int(attrs.get('BANDWIDTH', 0) or 0),
+                'height': height,
+            })
+    return variants
+
+
+def parse_media(text, base_url):
+    """قائمة المقاطع ومدة كل مقطع من media playlist"""
+    playlist = {'segments': [], 'init': None, 'encrypted': False, 'duration': 0.0}
+    duration = 0.0
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith('#EXTINF:'):
+            try:
+                duration = float(line[8:].split(',')[0])
+            except ValueError:
+                duration = 0.0
+        elif line.startswith('#EXT-X-KEY'):
+            if parse_attributes(line).get('METHOD', 'NONE') != 'NONE':
+                playlist['encrypted'] = True
+        elif line.startswith('#EXT-X-MAP'):
+            uri = parse_attributes(line).get('URI')
+            if uri:
+                playlist['init'] = urljoin(base_url, uri)
+        elif line and not line.startswith('#'):
+            playlist['segments'].append({'url': urljoin(base_url, line), 'duration': duration})
+            playlist['duration'] += duration
+            duration = 0.0
+    return playlist
+
+
+def choose_variant(variants, max_height=240):
+    """أعلى جودة ضمن الحد، وإلا أقل جودة متاحة"""
+    if not variants:
+        return None
+    if max_height:
+        within = [v for v in variants if v['height'] and v['height'] <= max_height]
+        if within:
+            return max(within, key=lambda v: (v['height'], v['bandwidth']))
+    return min(variants, key=lambda v: (v['height'] or 0, v['bandwidth']))
+
+
+def load_playlist(url, session=None, max_height=240, timeout=10):
+    """
+    جلب القائمة (واتباع master إلى media عند الحاجة)
+    يرجع media playlist مع مفاتيح إضافية: url, variant
+    """
+    session = session or requests.Session()
+    with RESOLVE_SECONDS.time(hop='playlist'):
+        response = session.get(url, headers=HEADERS, timeout=timeout)
+    response.raise_for_status()
+    text, base = response.text, response.url
+    variant = None
+    if '#EXT-X-STREAM-INF' in text:
+        variant = choose_variant(parse_master(text, base), max_height)
+        if not variant:
+            raise UnsupportedPlaylist("master playlist بدون جودات")
+        with RESOLVE_SECONDS.time(hop='variant'):
+            response = session.get(variant['url'], headers=HEADERS, timeout=timeout)
+        response.raise_for_status()
+        text, base = response.text, response.url
+    playlist = parse_media(text, base)
+    playlist['url'] = base
+    playlist['variant'] = variant
+    return playlist
+
+
+# ===== HEDGED REQUESTS =====
+
+class Abandoned(Exception):
+    """الطلب الآخر فاز - لا حاجة لإكمال هذا"""
+
+
+def hedged_get(session, url, hedge_after, pool, headers=None, timeout=SEGMENT_TIMEOUT):
+    """
+    طلب GET؛ إذا لم يكتمل خلال hedge_after ثانية نرسل نسخة ثانية ونأخذ الأسرع
+    pool: مجمع خيوط خاص بالتنزيل (مقعدان لكل مقطع) حتى لا ينتظر الطلب الأول في طابور
+    ويُحسب انتظاره تأخراً - والطلب الخاسر يُقطع بدل أن يكمل تنزيل المقطع
+    يرجع (المحتوى، هل فاز الطلب الاحتياطي)
+    """
+    finished = threading.Event()
+
+    def get():
+        with session.get(url, headers=headers or HEADERS, timeout=timeout, stream=True) as response:
+            response.raise_for_status()
+            chunks = []
+            for chunk in response.iter_content(CHUNK):
+                if finished.is_set():
+                    raise Abandoned(url)
+                chunks.append(chunk)
+            return b''.join(chunks)
+
+    first = pool.submit(get)
+    try:
+        return first.result(timeout=hedge_after), False
+    except concurrent.futures.TimeoutError:
+        pass
+    except Exception:
+        # فشل الطلب الأول بسرعة - محاولة عادية واحدة
+        return get(), False
+
+    second = pool.submit(get)
+    pending = {first, second}
+    error = None
+    while pending:
+        done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            try:
+                content = future.result()
+            except Exception as e:
+                error = e
+                continue
+            finished.set()
+            for other in pending:
+                other.cancel()
+            return content, future is second
+    raise error
+
+
+class LatencyTracker:
+    """مدة جلب المقاطع الأخيرة لحساب موعد الطلب الاحتياطي (p90 × 1.5)"""
+
+    def __init__(self, window=50):
+        self.samples = []
+        self.window = window
+        self.lock = threading.Lock()
+
+    def add(self, seconds):
+        with self.lock:
+            self.samples.append(seconds)
+            if len(self.samples) > self.window:
+                self.samples.pop(0)
+
+    def hedge_delay(self):
+        with self.lock:
+            if len(self.samples) < 5:
+                return HEDGE_DEFAULT_DELAY
+            ordered = sorted(self.samples)
+            p90 = ordered[min(len(ordered) - 1, math.ceil(len(ordered) * 0.9) - 1)]
+        return max(HEDGE_MIN_DELAY, p90 * 1.5)
+
+
+def download_segments(playlist, sink, session=None, workers=4, stream=None, progress=None, workers_fn=None,
+                      cache=None, on_cached=None):
+    """
+    تنزيل المقاطع بالتوازي وكتابتها بالترتيب إلى sink (ملف أو stdin لـ ffmpeg)
+    stream: تدفق من bandwidth لتطبيق الميزانية، workers_fn: عدد العمال الحالي (AIMD)
+    cache: ذاكرة المصادر - المقاطع المخزنة لا تُطلب من الشبكة، والجديدة تُحفظ
+    on_cached(bytes): ما كُتب فعلاً في الذاكرة (مساحة قرص تستهلكها المهمة)
+    يرجع عدد البايتات المكتوبة
+    """
+    if playlist['encrypted']:
+        raise UnsupportedPlaylist("مقاطع مشفرة")
+
+    session = session or requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=MAX_POOL)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    tracker = LatencyTracker()
+    urls = ([playlist['init']] if playlist['init'] else []) + [s['url'] for s in playlist['segments']]
+
+    def fetch(url):
+        if cache:
+            content = cache.get(segment_key(url))
+            if content is not None:
+                return content, False
+        start = time.monotonic()
+        content, hedged = hedged_get(session, url, tracker.hedge_delay(), hedge_pool)
+        tracker.add(time.monotonic() - start)
+        if stream:
+            stream.throttle(len(content))
+        if cache:
+            stored = cache.put(segment_key(url), content)
+            if stored and on_cached:
+                on_cached(stored)
+        return content, hedged
+
+    # مقعدان لكل مقطع في النافذة (الطلب الأول والاحتياطي)
+    hedge_pool = concurrent.futures.ThreadPoolExecutor(max_workers=MAX_POOL * 2, thread_name_prefix='hedge')
+    with hedge_pool, concurrent.futures.ThreadPoolExecutor(max_workers=MAX_POOL) as pool:
+        pending = {}
+        state = {'next': 0, 'written': 0, 'hedges': 0}
+
+        def drain_one():
+            content, hedged = pending.pop(state['next']).result()
+            sink.write(content)
+            state['written'] += len(content)
+            state['hedges'] += hedged
+            state['next'] += 1
+            if progress:
+                progress(state['next'], len(urls), state['written'])
+
+        for index, url in enumerate(urls):
+            limit = max(1, min(MAX_POOL, workers_fn() if workers_fn else workers))
+            # نافذة محدودة: لا نسبق الكتابة بأكثر من limit مقاطع
+            while len(pending) >= limit:
+                drain_one()
+            pending[index] = pool.submit(fetch, url)
+        while pending:
+            drain_one()
+
+    if state['hedges']:
+        print(f"[*] طلبات احتياطية فازت: {state['hedges']}")
+    return state['written']
@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+"""
+كشف المقدمة والشارة المتكررة في حلقات المسلسل لتخطيها (تنزيلاً وترميزاً ورفعاً)
+بصمة صوتية على طريقة chromaprint/Haitsma-Kalker: طاقة نطاقات التردد لكل إطار من PCM (ffmpeg)،
+و32 بت لكل إطار من إشارة الفروق بين النطاقات المتجاورة والإطارات المتتالية
+المطابقة بين حلقتين: تصويت على الإزاحة من البصمات المتطابقة، ثم أطول مقطع متصل بفرق بتات صغير
+NumPy اختياري: بدونه لا يُكشف شيء ولا يُحذف شيء
+"""
+
+import os
+import sys
+import json
+import hashlib
+import tempfile
+import functools
+import threading
+from collections import Counter
+
+import supervisor
+from caps import module_available
+from source_cache import CACHE_DIR
+
+INTRO_DIR = os.path.join(CACHE_DIR, 'intros')
+# تخطي المقاطع المتكررة (FHRS_SKIP_RECURRING=1) - معطل افتراضياً
+SKIP_RECURRING = os.environ.get('FHRS_SKIP_RECURRING', '0') == '1'
+
+SAMPLE_RATE = 11025
+FRAME = 4096
+HOP = FRAME // 32                # ~11.6ms: التداخل الكبير يجعل البصمة لا تتأثر بإزاحة الإطارات
+CHUNK = 2048                     # إطارات لكل دفعة FFT (ذاكرة محدودة)
+BANDS = 33                       # 33 نطاقاً -> 32 بت
+MIN_FREQ, MAX_FREQ = 300, 2000
+INTRO_WINDOW = 240               # المقدمة تُبحث في أول 4 دقائق
+OUTRO_WINDOW = 240               # والشارة في آخر 4 دقائق
+MAX_BIT_ERRORS = 10              # من 32: بصمتان "متطابقتان" رغم اختلاف الترميز
+SMOOTH_FRAMES = SAMPLE_RATE // HOP   # ~1 ثانية
+MIN_SECONDS = 10.0               # أقصر مقطع متكرر يُعتبر مقدمة أو شارة
+MIN_VOTES = 5
+MAX_REPEATS = 16                 # بصمة تتكرر أكثر من هذا (صمت، نغمة ثابتة) لا تصوّت
+COMPARE_WITH = 4                 # عدد الحلقات السابقة التي تُقارن بها كل حلقة جديدة
+# مدى مشترك للمسلسل (يُطبق على حلقات لم تُنزل بعد) إذا اتفقت عليه هذه الحلقات بهذا الهامش
+MIN_EPISODES = 3
+TOLERANCE = 2.0
+
+_lock = threading.Lock()
+
+
+def available():
+    return module_available('numpy')
+
+
+# ===== البصمة =====
+
+def decode_pcm(source, start=0.0, duration=None, from_end=False):
+    """PCM أحادي 16 بت بمعدل SAMPLE_RATE عبر ffmpeg (من start، أو آخر duration ثانية)"""
+    import numpy as np
+    fd, pcm = tempfile.mkstemp(suffix='.pcm')
+    os.close(fd)
+    try:
+        cmd = ['ffmpeg', '-v', 'error']
+        if from_end:
+            cmd += ['-sseof', f'-{duration:.3f}']
+        elif start:
+            cmd += ['-ss', f'{start:.3f}']
+        cmd += ['-i', source]
+        if duration and not from_end:
+            cmd += ['-t', f'{duration:.3f}']
+        cmd += ['-vn', '-ac', '1', '-ar', str(SAMPLE_RATE), '-f', 's16le', '-y', pcm]
+        result = supervisor.run(cmd, role='download', timeout=300)
+        if result.returncode != 0:
+            return np.zeros(0, dtype=np.int16)
+        return np.fromfile(pcm, dtype=np.int16)
+    finally:
+        os.remove(pcm)
+
+
+def fingerprint(samples):
+    """بصمة uint32 لكل إطار (HOP عينة)"""
+    import numpy as np
+    samples = np.asarray(samples, dtype=np.float32)
+    if len(samples) < FRAME + HOP:
+        return np.zeros(0, dtype=np.uint32)
+    count = 1 + (len(samples) - FRAME) // HOP
+    frames = np.lib.stride_tricks.as_strided(
+        samples, shape=(count, FRAME), strides=(samples.strides[0] * HOP, samples.strides[0])
+    )
+    window = np.hanning(FRAME).astype(np.float32)
+    freqs = np.fft.rfftfreq(FRAME, 1.0 / SAMPLE_RATE)
+    bins = np.digitize(freqs, np.geomspace(MIN_FREQ, MAX_FREQ, BANDS + 1)) - 1
+    energy = np.zeros((count, BANDS), dtype=np.float64)
+    for start in range(0, count, CHUNK):
+        spectrum = np.abs(np.fft.rfft(frames[start:start + CHUNK] * window, axis=1)) ** 2
+        for band in range(BANDS):
+            energy[start:start + CHUNK, band] = spectrum[:, bins == band].sum(axis=1)
+    # فرق النطاقات المتجاورة، ثم فرقه عن الإطار السابق: إشارته هي البت
+    band_diff = energy[:, :-1] - energy[:, 1:]
+    bits = (band_diff[1:] - band_diff[:-1]) > 0
+    weights = (1 << np.arange(BANDS - 1, dtype=np.uint64)).astype(np.uint64)
+    return (bits.astype(np.uint64) * weights).sum(axis=1).astype(np.uint32)
+
+
+def frame_seconds(index):
+    return index * HOP / SAMPLE_RATE
+
+
+def bit_errors(a, b):
+    """عدد البتات المختلفة لكل زوج بصمات"""
+    import numpy as np
+    xor = np.bitwise_xor(a, b).view(np.uint8).reshape(-1, 4)
+    return np.unpackbits(xor, axis=1).sum(axis=1)
+
+
+def match(a, b, max_errors=MAX_BIT_ERRORS, min_seconds=MIN_SECONDS):
+    """
+    أطول مقطع مشترك بين بصمتين -> (بداية a، نهاية a، بداية b، نهاية b) بالثواني أو None
+    """
+    import numpy as np
+    if not len(a) or not len(b):
+        return None
+    index = {}
+    for position, value in enumerate(a.tolist()):
+        index.setdefault(value, []).append(position)
+    votes = Counter()
+    index = {value: positions for value, positions in index.items() if len(positions) <= MAX_REPEATS}
+    for position, value in enumerate(b.tolist()):
+        for other in index.get(value, ()):
+            votes[other - position] += 1
+
+    min_frames = int(min_seconds * SAMPLE_RATE / HOP)
+    best = None
+    for offset, count in votes.most_common(3):
+        if count < MIN_VOTES:
+            break
+        # a[i] يقابل b[i - offset]
+        start_a, start_b = max(0, offset), max(0, -offset)
+        length = min(len(a) - start_a, len(b) - start_b)
+        if length < min_frames:
+            continue
+        part_a, part_b = a[start_a:start_a + length], b[start_b:start_b + length]
+        errors = bit_errors(part_a, part_b)
+        # الصمت (بصمة 0) يتطابق دائماً: لا يُحسب مقطعاً مشتركاً
+        errors[(part_a == 0) | (part_b == 0)] = 32
+        smooth = np.convolve(errors, np.ones(SMOOTH_FRAMES) / SMOOTH_FRAMES, mode='same')
+        good = np.concatenate(([False], smooth <= max_errors, [False]))
+        edges = np.flatnonzero(np.diff(good.astype(np.int8)))
+        runs = edges.reshape(-1, 2)
+        if not len(runs):
+            continue
+        run_start, run_end = max(runs, key=lambda run: run[1] - run[0])
+        if run_end - run_start < min_frames or (best and run_end - run_start <= best[0]):
+            continue
+        best = (run_end - run_start, start_a + run_start, start_a + run_end, start_b + run_start, start_b + run_end)
+    if best is None:
+        return None
+    _, a0, a1, b0, b1 = best
+    return tuple(float(frame_seconds(frame)) for frame in (a0, a1, b0, b1))
+
+
+# ===== المخزن لكل مسلسل =====
+
+def series_dir(series_pattern):
+    return os.path.join(INTRO_DIR, hashlib.sha1(series_pattern.encode('utf-8')).hexdigest()[:16])
+
+
+def _load_ranges(series_pattern):
+    try:
+        with open(os.path.join(series_dir(series_pattern), 'ranges.json'), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'episodes': {}, 'series': {}}
+
+
+def _save_ranges(series_pattern, data):
+    directory = series_dir(series_pattern)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, 'ranges.json')
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, path)
+
+
+def episode_fingerprints(source):
+    """{'intro', 'outro', 'outro_start', 'duration'} لملف حلقة"""
+    duration = supervisor.probe_duration(source)
+    intro = fingerprint(decode_pcm(source, 0, min(INTRO_WINDOW, duration or INTRO_WINDOW)))
+    outro_start = max(0.0, duration - OUTRO_WINDOW)
+    outro = fingerprint(decode_pcm(source, outro_start, duration - outro_start)) if duration else intro[:0]
+    return {'intro': intro, 'outro': outro, 'outro_start': outro_start, 'duration': duration}
+
+
+def _save_fingerprints(series_pattern, episode_num, prints):
+    import numpy as np
+    directory = series_dir(series_pattern)
+    os.makedirs(directory, exist_ok=True)
+    np.savez(os.path.join(directory, f"ep{episode_num:03d}.npz"), intro=prints['intro'], outro=prints['outro'],
+             meta=np.array([prints['outro_start'], prints['duration']]))
+
+
+def _load_fingerprints(series_pattern):
+    import numpy as np
+    directory = series_dir(series_pattern)
+    found = {}
+    for name in sorted(os.listdir(directory)) if os.path.isdir(directory) else []:
+        if name.startswith('ep') and name.endswith('.npz'):
+            with np.load(os.path.join(directory, name)) as data:
+                outro_start, duration = data['meta'].tolist()
+                found[int(name[2:-4])] = {'intro': data['intro'], 'outro': data['outro'],
+                                          'outro_start': outro_start, 'duration': duration}
+    return found
+
+
+def _widest(current, candidate):
+    if not current or candidate[1] - candidate[0] > current[1] - current[0]:
+        return [round(candidate[0], 2), round(candidate[1], 2)]
+    return current
+
+
+def _series_ranges(episodes):
+    """المدى المشترك: فقط إذا اتفقت عليه MIN_EPISODES حلقات (التقاطع، لا الاتحاد)"""
+    series = {}
+    for kind, key in (('intro', 'intro'), ('outro', 'outro_from_end')):
+        spans = []
+        for entry in episodes.values():
+            if entry.get(kind):
+                start, end = entry[kind]
+                if kind == 'outro':
+                    # الشارة نسبةً لنهاية الحلقة (أطوال الحلقات تختلف)
+                    start, end = entry['duration'] - end, entry['duration'] - start
+                spans.append((start, end))
+        if len(spans) < MIN_EPISODES:
+            continue
+        starts, ends = [s for s, _ in spans], [e for _, e in spans]
+        if max(starts) - min(starts) > TOLERANCE or max(ends) - min(ends) > TOLERANCE:
+            continue
+        low, high = max(starts), min(ends)
+        if high - low >= MIN_SECONDS / 2:
+            series[key] = [round(low, 2), round(high, 2)]
+    return series
+
+
+def learn(series_pattern, episode_num, source):
+    """
+    بصمة الحلقة ومقارنتها بآخر الحلقات المعروفة من المسلسل؛ يحدث المديات المحفوظة
+    يرجع مديات الحلقة {'intro': [بداية، نهاية], 'outro': [...]} (بالثواني من بداية الحلقة)
+    """
+    if not available() or not os.path.exists(source):
+        return {}
+    prints = episode_fingerprints(source)
+    if not len(prints['intro']):
+        return {}
+    with _lock:
+        known = _load_fingerprints(series_pattern)
+        known.pop(episode_num, None)
+        _save_fingerprints(series_pattern, episode_num, prints)
+        data = _load_ranges(series_pattern)
+        episodes = data['episodes']
+        mine = episodes.setdefault(str(episode_num), {})
+        mine['duration'] = prints['duration']
+        for other_num in sorted(known, key=lambda n: abs(n - episode_num))[:COMPARE_WITH]:
+            other = known[other_num]
+            theirs = episodes.setdefault(str(other_num), {'duration': other['duration']})
+            found = match(prints['intro'], other['intro'])
+            if found:
+                mine['intro'] = _widest(mine.get('intro'), found[:2])
+                theirs['intro'] = _widest(theirs.get('intro'), found[2:])
+            found = match(prints['outro'], other['outro'])
+            if found:
+                mine['outro'] = _widest(mine.get('outro'), (prints['outro_start'] + found[0],
+                                                            prints['outro_start'] + found[1]))
+                theirs['outro'] = _widest(theirs.get('outro'), (other['outro_start'] + found[2],
+                                                                other['outro_start'] + found[3]))
+        data['series'] = _series_ranges(episodes)
+        _save_ranges(series_pattern, data)
+    ranges = {kind: mine[kind] for kind in ('intro', 'outro') if kind in mine}
+    if ranges:
+        print(f"[*] الحلقة {episode_num:02d}: مقاطع متكررة " +
+              ', '.join(f"{kind} {start:.0f}-{end:.0f}ث" for kind, (start, end) in ranges.items()))
+    return ranges
+
+
+# ===== الاستخدام في التنزيل والترميز =====
+
+def episode_ranges(series_pattern, episode_num):
+    """المديات المكتشفة لحلقة معروفة (مصدرها في الذاكرة): [(بداية، نهاية)]"""
+    entry = _load_ranges(series_pattern)['episodes'].get(str(episode_num), {})
+    return [tuple(entry[kind]) for kind in ('intro', 'outro') if entry.get(kind)]
+
+
+def series_ranges(series_pattern, duration):
+    """المدى المشترك للمسلسل لحلقة جديدة مدتها duration: [(بداية، نهاية)]"""
+    series = _load_ranges(series_pattern)['series']
+    ranges = []
+    if series.get('intro'):
+        ranges.append(tuple(series['intro']))
+    if series.get('outro_from_end') and duration:
+        near, far = series['outro_from_end']
+        ranges.append((max(0.0, duration - far), max(0.0, duration - near)))
+    return [(start, end) for start, end in ranges if end > start]
+
+
+def series_drop(series_pattern):
+    """
+    series_ranges مؤجلة حتى تُعرف المدة الفعلية للحلقة (الشارة تُقاس من النهاية، وتقدير التخطيط
+    قد يكون من الحجم) - None إذا لم يتفق المسلسل على مدى بعد
+    """
+    series = _load_ranges(series_pattern)['series']
+    if not series.get('intro') and not series.get('outro_from_end'):
+        return None
+    return functools.partial(series_ranges, series_pattern)
+
+
+def resolve_drop(drop, duration):
+    """drop: مديات أو دالة (مدة -> مديات) من series_drop"""
+    return drop(duration) if callable(drop) else drop
+
+
+def drop_segments(segments, ranges):
+    """مقاطع HLS بدون تلك الواقعة كلها داخل أحد المديات (المقطع الجزئي يبقى) -> (المتبقية، المحذوفة)"""
+    kept, dropped, offset = [], 0, 0.0
+    for segment in segments:
+        start, end = offset, offset + segment['duration']
+        offset = end
+        if any(low <= start and end <= high for low, high in ranges):
+            dropped += 1
+        else:
+            kept.append(segment)
+    return kept, dropped
+
+
+def drop_filters(ranges):
+    """(مرشح فيديو، مرشح صوت) يحذفان المديات من ملف ويعيدان ترقيم الوقت"""
+    condition = '+'.join(f"between(t,{start:.3f},{end:.3f})" for start, end in ranges)
+    return (f"select='not({condition})',setpts=N/FRAME_RATE/TB",
+            f"aselect='not({condition})',asetpts=N/SR/TB")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 4:
+        print("الاستخدام: python intro_detect.py series-pattern- 1=ep01.mp4 2=ep02.mp4 [...]")
+        sys.exit(1)
+    if not available():
+        print("[!] NumPy غير مثبت: pip install numpy")
+        sys.exit(1)
+    series = sys.argv[1]
+    for arg in sys.argv[2:]:
+        number, _, path = arg.partition('=')
+        learn(series, int(number), path)
+    print(json.dumps(_load_ranges(series)['series'], ensure_ascii=False))
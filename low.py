@@ -5,47 +5,75 @@ Handles dynamic URLs, quality selection (240p/480p), and compression
 """
 
 import os
-import sys
 import re
 import time
 import json
 import requests
 import subprocess
 from urllib.parse import urljoin, urlparse
-from bs4 import BeautifulSoup
+from episodes import resolve_episode_urls
+from caps import tool_available, module_available, ensure_module, make_soup
+from ytdl_engine import get_engine
+from bandwidth import get_manager
+from mirrors import collect_stream_candidates, race_mirrors, RateWatch
+import supervisor
+from supervisor import probe_duration
+from source_cache import get_cache, episode_key
+from encoding import ladder_for, ladder_outputs, encode_ladder, run_streamable, codec_args, codec_for, ARCHIVE_LADDER
+from metrics import start_exporter
+import tracing
+from tracing import traced
+from storage import get_storage
 
 # ===== CONFIGURATION =====
 USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36"
 HEADERS = {'User-Agent': USER_AGENT}
 
+# Shared in-process yt-dlp (yt_dlp itself is imported on first download)
+# Rate limit and fragment count come from the process-wide bandwidth manager
+YTDL = get_engine('low', {
+    'http_headers': HEADERS,
+    'retries': 10,
+    'fragment_retries': 10,
+    'skip_unavailable_fragments': True,
+    'nopart': True,
+})
+
+# Map quality to maximum height (low.py always takes the smallest match)
+QUALITY_HEIGHTS = {
+    '144p': 144,
+    '240p': 240,
+    '360p': 360,
+    '480p': 480,
+    '720p': 720,
+    'best': None
+}
+
 # ===== UTILITY FUNCTIONS =====
 def install_requirements():
-    """Install required packages"""
+    """Install required packages (checks are cached, nothing is spawned on warm starts)"""
     print("[*] Checking system requirements...")
     
-    # Check Python packages
-    packages = ['requests', 'beautifulsoup4']
-    for pkg in packages:
-        try:
-            __import__(pkg.replace('-', '_'))
+    # Check Python packages without importing them
+    packages = {'requests': 'requests', 'bs4': 'beautifulsoup4'}
+    for module, pkg in packages.items():
+        if module_available(module):
             print(f"  ✓ {pkg}")
-        except ImportError:
+        else:
             print(f"  ✗ Installing {pkg}...")
-            subprocess.check_call([sys.executable, '-m', 'pip', 'install', pkg])
+            ensure_module(module, [pkg])
     
     # Check yt-dlp
-    try:
-        subprocess.run(['yt-dlp', '--version'], capture_output=True, check=True)
+    if module_available('yt_dlp'):
         print("  ✓ yt-dlp")
-    except:
+    else:
         print("  ✗ Installing yt-dlp...")
-        subprocess.run(['pip', 'install', 'yt-dlp'], check=True)
+        ensure_module('yt_dlp', ['yt-dlp'])
     
     # Check ffmpeg
-    try:
-        subprocess.run(['ffmpeg', '-version'], capture_output=True, check=True)
+    if tool_available('ffmpeg'):
         print("  ✓ ffmpeg")
-    except:
+    else:
         print("  ✗ Installing ffmpeg...")
         subprocess.run(['sudo', 'apt', 'install', '-y', 'ffmpeg'], check=True)
 
@@ -56,6 +84,7 @@ def clean_filename(name):
     return cleaned.strip()
 
 # ===== URL DISCOVERY FUNCTIONS =====
+@traced()
 def discover_final_url(initial_url, max_retries=5):
     """
     Discover the final URL after dynamic transformation
@@ -79,7 +108,7 @@ def discover_final_url(initial_url, max_retries=5):
                 initial_url = current_url
             
             # Parse HTML for clues
-            soup = BeautifulSoup(response.text, 'html.parser')
+            soup = make_soup(response.text)
             
             # Check for meta refresh
             meta_refresh = soup.find('meta', attrs={'http-equiv': 'refresh'})
@@ -123,22 +152,24 @@ def discover_final_url(initial_url, max_retries=5):
             # Wait and retry
             if attempt < max_retries - 1:
                 print(f"[*] Waiting for dynamic content... (Attempt {attempt + 1}/{max_retries})")
-                time.sleep(2)
+                with tracing.span('retry_wait', attempt=attempt + 1):
+                    time.sleep(2)
                 
         except Exception as e:
             print(f"[!] Error discovering URL: {e}")
             if attempt < max_retries - 1:
-                time.sleep(3)
+                with tracing.span('retry_wait', attempt=attempt + 1):
+                    time.sleep(3)
     
     print(f"[!] Could not discover final URL, using original")
     return initial_url
 
-def extract_video_embed_url(page_url):
-    """Extract video embed URL from watch page"""
-    print(f"[*] Extracting video from: {page_url}")
+@traced()
+def extract_video_candidates(page_url):
+    """Extract every mirror (m3u8, iframes, server links) from the watch page"""
+    print(f"[*] Collecting video mirrors from: {page_url}")
     
     try:
-        # Add ?do=watch if not present
         if '?do=watch' not in page_url:
             if not page_url.endswith('/'):
                 page_url += '/'
@@ -149,193 +180,92 @@ def extract_video_embed_url(page_url):
         response = requests.get(watch_url, headers=HEADERS, timeout=15)
         response.raise_for_status()
         
-        # Save for debugging if needed
-        # with open(f'debug_page_{int(time.time())}.html', 'w', encoding='utf-8') as f:
-        #     f.write(response.text)
-        
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        # Method 1: Direct m3u8 in page
-        m3u8_pattern = r'(https?://[^\s"\']+\.m3u8[^\s"\']*)'
-        m3u8_matches = re.findall(m3u8_pattern, response.text)
-        for match in m3u8_matches:
-            if 'cdn-vids.xyz' in match or 'm3u8' in match.lower():
-                print(f"[*] Found direct m3u8: {match}")
-                return match
-        
-        # Method 2: Iframe src
-        iframe = soup.find('iframe', {'src': re.compile(r'vidsp\.net|embed')})
-        if iframe:
-            iframe_src = iframe.get('src')
-            if iframe_src:
-                print(f"[*] Found iframe: {iframe_src}")
-                return iframe_src
-        
-        # Method 3: JavaScript variables
-        script_tags = soup.find_all('script')
-        for script in script_tags:
-            if script.string:
-                # Look for JW Player or similar
-                patterns = [
-                    r'file["\']?\s*:\s*["\']([^"\']+\.m3u8[^"\']*)["\']',
-                    r'sources?\s*:\s*\[[^\]]*["\']([^"\']+\.m3u8[^"\']*)["\']',
-                    r'embed-([a-z0-9]+)\.html'
-                ]
-                for pattern in patterns:
-                    matches = re.findall(pattern, script.string, re.IGNORECASE)
-                    if matches:
-                        for match in matches:
-                            if 'embed-' in match:
-                                return f"https://v.vidsp.net/{match}" if not match.startswith('http') else match
-                            elif 'm3u8' in match:
-                                return match
-        
-        # Method 4: Try to find video server URL
-        server_links = soup.find_all('a', {'class': re.compile(r'server|watch')})
-        for link in server_links:
-            href = link.get('href')
-            if href and ('vidsp.net' in href or 'embed' in href):
-                full_url = urljoin(watch_url, href)
-                print(f"[*] Found server link: {full_url}")
-                return full_url
-        
-        print("[!] Could not extract video URL")
-        return None
+        candidates = collect_stream_candidates(response.text, watch_url)
+        print(f"[*] Found {len(candidates)} mirror(s)")
+        return candidates
         
     except Exception as e:
-        print(f"[!] Error extracting video: {e}")
-        return None
-
-def get_m3u8_from_embed(embed_url):
-    """Get m3u8 URL from embed page"""
-    print(f"[*] Getting m3u8 from embed: {embed_url}")
-    
-    try:
-        response = requests.get(embed_url, headers=HEADERS, timeout=15)
-        
-        # Look for m3u8 in embed page
-        patterns = [
-            r'src["\']?\s*:\s*["\']([^"\']+\.m3u8[^"\']*)["\']',
-            r'file["\']?\s*:\s*["\']([^"\']+\.m3u8[^"\']*)["\']',
-            r'(https?://[^\s"\']+\.m3u8[^\s"\']*)'
-        ]
-        
-        for pattern in patterns:
-            matches = re.findall(pattern, response.text)
-            for match in matches:
-                if 'm3u8' in match and 'cdn-vids.xyz' in match:
-                    print(f"[*] Found m3u8 in embed: {match}")
-                    return match
-        
-        # If not found, return embed URL for yt-dlp to handle
-        print("[*] No direct m3u8 found, using embed URL")
-        return embed_url
-        
-    except Exception as e:
-        print(f"[!] Error processing embed: {e}")
-        return embed_url
+        print(f"[!] Error extracting mirrors: {e}")
+        return []
 
 # ===== DOWNLOAD FUNCTIONS =====
-def download_with_ytdlp(video_url, output_file, quality='240p'):
-    """Download video using yt-dlp with specified quality"""
-    
-    # Map quality to yt-dlp format selector
-    quality_map = {
-        '144p': 'worstvideo[height<=144]+worstaudio/worst[height<=144]',
-        '240p': 'worstvideo[height<=240]+worstaudio/worst[height<=240]',
-        '360p': 'worstvideo[height<=360]+worstaudio/worst[height<=360]',
-        '480p': 'worstvideo[height<=480]+worstaudio/worst[height<=480]',
-        '720p': 'worstvideo[height<=720]+worstaudio/worst[height<=720]',
-        'best': 'best'
-    }
+@traced('download')
+def download_with_ytdlp(video_url, output_file, quality='240p', watch=None, max_height=None, prefer=None):
+    """
+    Download video using the shared in-process yt-dlp engine (one extraction)
+    Returns the chosen format ('fits' is False if it is above the requested height) or None
+    max_height/prefer override the quality selector (e.g. the top rung of an encode ladder)
+    """
     
-    format_selector = quality_map.get(quality, 'worstvideo[height<=240]+worstaudio/worst[height<=240]')
+    if max_height is None:
+        max_height = QUALITY_HEIGHTS.get(quality, 240)
+    if prefer is None:
+        prefer = 'best' if quality == 'best' else 'worst'
     
     print(f"[*] Downloading with quality: {quality}")
     print(f"[*] Output: {output_file}")
     
-    # Build command
-    cmd = [
-        'yt-dlp',
-        '-f', format_selector,
-        '--merge-output-format', 'mp4',
-        '--no-part',
-        '--concurrent-fragments', '4',
-        '--limit-rate', '2M',
-        '--retries', '10',
-        '--fragment-retries', '10',
-        '--skip-unavailable-fragments',
-        '--quiet',
-        '--no-warnings',
-        '-o', output_file,
-        video_url
-    ]
+    last_progress = [""]
     
-    try:
-        # Run yt-dlp
-        process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            universal_newlines=True
-        )
-        
+    def progress_hook(status):
         # Monitor progress
-        last_progress = ""
-        for line in process.stdout:
-            if '[download]' in line:
-                if 'ETA' in line or '%' in line:
-                    progress = line.strip()
-                    if progress != last_progress:
-                        print(f"    {progress}", end='\r')
-                        last_progress = progress
-        
-        process.wait()
-        
-        if process.returncode == 0:
-            if os.path.exists(output_file):
-                size_mb = os.path.getsize(output_file) / (1024*1024)
-                print(f"\n[✓] Download complete: {size_mb:.1f} MB")
-                return True
-            else:
-                print("\n[!] Download completed but file not found")
-                return False
-        else:
-            print(f"\n[!] yt-dlp failed with code: {process.returncode}")
-            return False
-            
-    except Exception as e:
-        print(f"\n[!] Download error: {e}")
-        return False
+        if status.get('status') == 'downloading':
+            progress = f"[download] {status.get('_percent_str', '').strip()} ETA {status.get('_eta_str', '').strip()}"
+            if progress != last_progress[0]:
+                print(f"    {progress}", end='\r')
+                last_progress[0] = progress
+    
+    bandwidth = get_manager()
+    stream = bandwidth.open_stream('download', video_url)
+    try:
+        if watch:
+            # Abort (and let the caller fail over) when the mirror is too slow
+            progress_hook = watch.ytdl_hook(progress_hook)
+        # Pause while the disk is nearly full instead of letting the write fail mid-file
+        progress_hook = get_storage(os.path.dirname(output_file)).ytdl_hook(
+            progress_hook, watch.reset if watch else None)
+        fmt = YTDL.download(video_url, output_file, max_height, prefer,
+                            progress_hook=bandwidth.ytdl_hook(stream, progress_hook),
+                            options=bandwidth.ytdl_options(stream))
+        if not fmt:
+            stream.error()
+    finally:
+        stream.close()
+    
+    if fmt:
+        size_mb = os.path.getsize(output_file) / (1024*1024)
+        print(f"\n[✓] Download complete: {size_mb:.1f} MB ({fmt.get('height') or '?'}p)")
+        return fmt
+    
+    print(f"\n[!] yt-dlp download failed")
+    return None
 
-def compress_to_240p(input_file, output_file):
+def compress_to_240p(input_file, output_file, codec=None):
     """Compress video to 240p using ffmpeg"""
+    return compress_to_height(input_file, output_file, 240, codec)
+
+@traced('compress')
+def compress_to_height(input_file, output_file, height, codec=None):
+    """Compress video down to the given height using ffmpeg (codec: x264/x265/svtav1, default FHRS_CODEC)"""
     if not os.path.exists(input_file):
         return False
     
-    print(f"[*] Compressing to 240p: {input_file}")
+    print(f"[*] Compressing to {height}p: {input_file}")
     
     # Get original duration for progress
-    try:
-        cmd = ['ffprobe', '-v', 'error', '-show_entries', 'format=duration', 
-               '-of', 'default=noprint_wrappers=1:nokey=1', input_file]
-        duration = float(subprocess.check_output(cmd).decode().strip())
-    except:
-        duration = 0
+    duration = probe_duration(input_file)
     
     # Compression command
     cmd = [
         'ffmpeg',
         '-i', input_file,
-        '-vf', 'scale=-2:240',
-        '-c:v', 'libx264',
-        '-preset', 'slow',        # Better compression
-        '-crf', '30',             # Higher CRF = smaller file (18-28 is normal, 30-32 is high compression)
+        '-vf', f'scale=-2:{height}',
+        # slow = better compression; CRF 30 (for x264 18-28 is normal, 30-32 is high compression)
+        *codec_args(codec, 30, 'slow'),
         '-c:a', 'aac',
         '-b:a', '64k',            # Lower audio bitrate
         '-ac', '2',               # Stereo
         '-ar', '44100',           # Audio sample rate
-        '-movflags', '+faststart',
         '-y',                     # Overwrite output
         output_file
     ]
@@ -345,30 +275,18 @@ def compress_to_240p(input_file, output_file):
         if duration > 0:
             print(f"[*] Original duration: {duration:.1f} seconds")
         
-        # Run with progress
-        process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            universal_newlines=True
-        )
+        def show_progress(seconds, total):
+            if total > 0:
+                percent = (seconds / total) * 100
+                print(f"    Progress: {percent:.1f}%", end='\r')
         
-        # Parse ffmpeg output for progress
-        for line in process.stderr:
-            if 'time=' in line and 'bitrate=' in line:
-                # Extract time
-                time_match = re.search(r'time=(\d+:\d+:\d+\.\d+)', line)
-                if time_match and duration > 0:
-                    # Convert time to seconds
-                    t = time_match.group(1)
-                    h, m, s = t.split(':')
-                    seconds = int(h)*3600 + int(m)*60 + float(s)
-                    percent = (seconds / duration) * 100
-                    print(f"    Progress: {percent:.1f}%", end='\r')
+        # Progress comes from -progress on stdout; stderr goes to a bounded log
+        # (the old unread stdout PIPE could fill up and deadlock ffmpeg)
+        # Streamable as soon as the encode ends: moov space is reserved up front
+        # instead of the +faststart pass that rewrote the whole file
+        result = run_streamable(cmd, duration, progress=show_progress)
         
-        process.wait()
-        
-        if process.returncode == 0:
+        if result.returncode == 0:
             if os.path.exists(output_file):
                 orig_size = os.path.getsize(input_file) / (1024*1024)
                 new_size = os.path.getsize(output_file) / (1024*1024)
@@ -378,7 +296,7 @@ def compress_to_240p(input_file, output_file):
                 print(f"    Reduction: {((orig_size - new_size)/orig_size*100):.1f}%")
                 return True
         else:
-            print(f"\n[!] Compression failed")
+            print(f"\n[!] Compression failed: {result.log.tail()[:200]}")
             return False
             
     except Exception as e:
@@ -386,65 +304,176 @@ def compress_to_240p(input_file, output_file):
         return False
 
 # ===== MAIN PROCESS =====
-def process_episode(base_url, series_pattern, episode_num, quality, download_dir, compress=False):
-    """Process a single episode"""
+def encode_ladder_from(source_file, final_file, ladder, episode_num):
+    """All renditions of the ladder from one decode of source_file"""
+    outputs = ladder_outputs(final_file, ladder)
+    if encode_ladder(source_file, outputs):
+        print(f"[✓] Episode {episode_num}: {', '.join(rung['suffix'] for rung in ladder)}")
+        return True
+    return False
+
+@traced()
+def encode_from_cache(source_key, temp_file, final_file, quality, episode_num, ladder=None, codec=None):
+    """Build the requested quality from a previously downloaded source (no network at all)"""
+    cache = get_cache()
+    sources = cache.sources(source_key)
+    if not sources:
+        return False
+    
+    if ladder:
+        # Highest cached source covers every rung
+        if sources[0]['height'] and sources[0]['height'] < ladder[-1]['height']:
+            return False
+        if not cache.materialize(sources[0], temp_file):
+            return False
+        try:
+            return encode_ladder_from(temp_file, final_file, ladder, episode_num)
+        finally:
+            os.remove(temp_file)
+    
+    max_height = QUALITY_HEIGHTS.get(quality, 240)
+    if max_height is None:
+        # 'best' is only known for a source that was itself downloaded as best
+        best = [v for v in sources if v.get('quality') == 'best']
+        if not best:
+            return False
+        if not cache.materialize(best[0], final_file):
+            return False
+        print(f"[✓] Episode {episode_num} from source cache (best)")
+        return True
+    
+    within = [v for v in sources if 0 < v['height'] <= max_height]
+    if within:
+        # Same choice as a fresh download: the smallest match
+        variant = min(within, key=lambda v: v['height'])
+        if not cache.materialize(variant, final_file):
+            return False
+        print(f"[✓] Episode {episode_num} from source cache ({variant['height']}p)")
+        return True
+    
+    # Only larger sources are cached: re-encode locally instead of downloading again
+    variant = sources[-1]
+    print(f"[*] Re-encoding cached {variant['height'] or '?'}p source to {quality}...")
+    if not cache.materialize(variant, temp_file):
+        return False
+    try:
+        if compress_to_height(temp_file, final_file, max_height, codec):
+            print(f"[✓] Episode {episode_num} encoded to {quality} from source cache")
+            return True
+    finally:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+    return False
+
+@traced()
+def download_episode_stream(video_url, temp_file, final_file, quality, episode_num, watch=None, source_key=None,
+                            ladder=None, codec=None):
+    """Download one stream at the requested quality (compressing to 240p if needed)"""
+    if ladder:
+        # One download at the top rung, then every rendition from a single decode
+        fmt = download_with_ytdlp(video_url, temp_file, quality, watch, max_height=ladder[-1]['height'], prefer='best')
+        if not fmt:
+            return False
+        if source_key:
+            # temp_file is deleted right after the encode: safe to hard-link
+            get_cache().add_source(source_key, temp_file, fmt.get('height') or 0, quality, link=True)
+        try:
+            return encode_ladder_from(temp_file, final_file, ladder, episode_num)
+        finally:
+            os.remove(temp_file)
+    
+    if quality == '240p':
+        # One extraction: 240p if listed, otherwise the lowest quality
+        fmt = download_with_ytdlp(video_url, temp_file, '240p', watch)
+        if fmt and source_key:
+            # Keep the source so other qualities and retries need no download
+            # (copied: temp_file may become the delivered file)
+            get_cache().add_source(source_key, temp_file, fmt.get('height') or 0, quality)
+        if fmt and fmt['fits']:
+            # Rename to final
+            os.rename(temp_file, final_file)
+            print(f"[✓] Episode {episode_num} downloaded at 240p")
+            return True
+        elif fmt:
+            # Fallback: lowest quality was downloaded, compress it
+            print(f"[*] 240p not available, compressing lowest quality...")
+            if compress_to_240p(temp_file, final_file, codec):
+                os.remove(temp_file)
+                print(f"[✓] Episode {episode_num} compressed to 240p")
+                return True
+    else:
+        # Download at requested quality
+        fmt = download_with_ytdlp(video_url, final_file, quality, watch)
+        if fmt:
+            if source_key:
+                get_cache().add_source(source_key, final_file, fmt.get('height') or 0, quality)
+            print(f"[✓] Episode {episode_num} downloaded at {quality}")
+            return True
+    return False
+
+@traced('episode')
+def process_episode(base_url, series_pattern, episode_num, quality, download_dir, compress=False, episode_url=None):
+    """Process a single episode (episode_url skips URL discovery when already known)"""
     print(f"\n{'='*60}")
     print(f"[*] EPISODE {episode_num:02d}")
     print('='*60)
     
     try:
-        # Step 1: Build initial URL
         episode_str = f"{episode_num:02d}"
-        initial_url = f"{base_url}/{series_pattern}{episode_str}"
-        print(f"[*] Initial URL: {initial_url}")
+        temp_file = f"{download_dir}/temp_ep{episode_str}.mp4"
+        final_file = f"{download_dir}/الحلقة_{episode_str}.mp4"
+        
+        # 240p for Telegram plus archive renditions, configurable per series
+        ladder = ladder_for(series_pattern, ARCHIVE_LADDER) if quality == 'ladder' else None
+        # Encoder backend (x264/x265/SVT-AV1) for this series, from its ladder config
+        codec = codec_for(series_pattern)
+        
+        # A source downloaded on an earlier run (any quality) avoids the network entirely
+        source_key = episode_key(series_pattern, episode_num)
+        if encode_from_cache(source_key, temp_file, final_file, quality, episode_num, ladder, codec):
+            return True
         
-        # Step 2: Discover final URL
-        final_url = discover_final_url(initial_url)
+        if episode_url:
+            # Exact URL from the series listing, no probing needed
+            final_url = episode_url
+        else:
+            # Step 1: Build initial URL
+            initial_url = f"{base_url}/{series_pattern}{episode_str}"
+            print(f"[*] Initial URL: {initial_url}")
+            
+            # Step 2: Discover final URL
+            final_url = discover_final_url(initial_url)
         print(f"[*] Final URL: {final_url}")
         
-        # Step 3: Extract video embed URL
-        embed_url = extract_video_embed_url(final_url)
-        if not embed_url:
+        # Step 3: Collect every mirror on the watch page
+        candidates = extract_video_candidates(final_url)
+        if not candidates:
             print(f"[!] Failed to extract video URL")
             return False
         
-        # Step 4: Get m3u8 URL
-        video_url = get_m3u8_from_embed(embed_url)
-        if not video_url:
+        # Step 4: Probe all mirrors in parallel, fastest first
+        mirrors = race_mirrors(candidates)
+        if not mirrors:
             print(f"[!] Failed to get video stream URL")
             return False
         
-        print(f"[*] Video stream: {video_url[:80]}...")
-        
         # Step 5: Download
-        temp_file = f"{download_dir}/temp_ep{episode_str}.mp4"
-        final_file = f"{download_dir}/الحلقة_{episode_str}.mp4"
-        
-        # Remove temp file if exists
-        if os.path.exists(temp_file):
-            os.remove(temp_file)
-        
-        # Download with desired quality
-        if quality == '240p':
-            # Try to download 240p directly
-            if download_with_ytdlp(video_url, temp_file, '240p'):
-                # Rename to final
-                os.rename(temp_file, final_file)
-                print(f"[✓] Episode {episode_num} downloaded at 240p")
-                return True
-            else:
-                # Fallback: download lowest quality then compress
-                print(f"[*] 240p not available, downloading lowest quality...")
-                if download_with_ytdlp(video_url, temp_file, 'worst'):
-                    if compress_to_240p(temp_file, final_file):
-                        os.remove(temp_file)
-                        print(f"[✓] Episode {episode_num} compressed to 240p")
-                        return True
-        else:
-            # Download at requested quality
-            if download_with_ytdlp(video_url, final_file, quality):
-                print(f"[✓] Episode {episode_num} downloaded at {quality}")
+        for index, mirror in enumerate(mirrors):
+            video_url = mirror['url']
+            print(f"[*] Video stream: {video_url[:80]}...")
+            
+            # Remove temp file if exists
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+            
+            # Only fail over on slow throughput when another mirror is left
+            watch = RateWatch() if index < len(mirrors) - 1 else None
+            if download_episode_stream(video_url, temp_file, final_file, quality, episode_num, watch, source_key,
+                                       ladder, codec):
                 return True
+            
+            if watch:
+                print(f"[*] Failing over to the next mirror...")
         
         print(f"[!] All download attempts failed for episode {episode_num}")
         return False
@@ -455,12 +484,14 @@ def process_episode(base_url, series_pattern, episode_num, quality, download_dir
 
 def main():
     """Main function"""
+    supervisor.install()
     print("="*60)
     print("3SEQ VIDEO DOWNLOADER - Complete Solution")
     print("="*60)
     
     # Install requirements
     install_requirements()
+    start_exporter()
     
     # Get user input
     print("\n[*] Enter download parameters:")
@@ -472,6 +503,8 @@ def main():
     if not series:
         series = "modablaj-the-protector-episode-s01e"
     
+    index_url = input("Series/season listing URL [auto]: ").strip() or None
+    
     try:
         start_ep = int(input("Start episode [1]: ").strip() or "1")
         end_ep = int(input("End episode [10]: ").strip() or "10")
@@ -484,9 +517,10 @@ def main():
     print("    2. 480p (Standard quality)")
     print("    3. 720p (HD)")
     print("    4. Best available")
+    print("    5. 240p + archive copies (one download, one decode; ladder from ladders.json)")
     
     quality_choice = input("Select quality [1]: ").strip()
-    qualities = {'1': '240p', '2': '480p', '3': '720p', '4': 'best'}
+    qualities = {'1': '240p', '2': '480p', '3': '720p', '4': 'best', '5': 'ladder'}
     quality = qualities.get(quality_choice, '240p')
     
     # Create download directory
@@ -502,12 +536,20 @@ def main():
     print(f"    Output: {download_dir}/")
     print('='*60)
     
+    # Enumerate all episode URLs from the listing in one pass (cached episodes don't need it)
+    cache = get_cache()
+    wanted = [ep for ep in range(start_ep, end_ep + 1) if not cache.sources(episode_key(series, ep), count=False)]
+    episode_urls, missing = resolve_episode_urls(base_url, series, wanted, index_url) if wanted else ({}, [])
+    
     # Process episodes
     successful = 0
-    failed = []
+    failed = list(missing)
     
     for ep in range(start_ep, end_ep + 1):
-        if process_episode(base_url, series, ep, quality, download_dir, compress=True):
+        if ep in missing:
+            continue
+        if process_episode(base_url, series, ep, quality, download_dir, compress=True,
+                           episode_url=episode_urls.get(ep)):
             successful += 1
         else:
             failed.append(ep)
@@ -541,4 +583,5 @@ def main():
     print('='*60)
 
 if __name__ == "__main__":
+    tracing.from_argv()
     main()
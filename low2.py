@@ -4,18 +4,29 @@ Ultra Fast Video Downloader for 3seq.com - Fixed Compression
 """
 
 import os
-import sys
-import re
 import time
 import json
 import requests
 import subprocess
 import shutil
-import threading
 import concurrent.futures
-from queue import Queue
 from urllib.parse import urljoin, parse_qs, urlparse, unquote
-from bs4 import BeautifulSoup
+from episodes import resolve_episode_urls
+from caps import tool_available, module_available, ensure_module
+from ytdl_engine import get_engine
+from bandwidth import get_manager
+from hls import load_playlist, download_segments, UnsupportedPlaylist
+from mirrors import collect_stream_candidates, race_mirrors, RateWatch, SlowMirror
+from source_cache import get_cache, episode_key
+from encoding import codec_args, codec_for
+from planner import plan_episode, plan_jobs, probe_job, plan_is_stale, print_plan, Admission, PLAN_TTL
+from scheduler import Scheduler
+from storage import get_storage, current_reservation
+import intro_detect
+from metrics import RESOLVE_SECONDS, record_episode, start_exporter
+from tracing import traced, from_argv
+import supervisor
+from supervisor import run_resumable, probe_duration, STALL_TIMEOUT, MAX_RESUMES
 
 # ===== CONFIGURATION =====
 USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
@@ -30,8 +41,17 @@ HEADERS = {
     'Referer': 'https://3seq.com/'
 }
 MAX_WORKERS = 5
-DOWNLOAD_TIMEOUT = 300
-COMPRESS_TIMEOUT = 600  # زيادة المهلة إلى 10 دقائق
+# لا توجد مهلة كلية: العمليات تُراقب حسب التقدم (supervisor) وتُوقف فقط إذا توقفت فعلاً
+
+# yt-dlp داخل العملية (مشترك بين العمال، يُستورد عند أول تنزيل)
+# حد السرعة وعدد الأجزاء يحددهما مدير عرض النطاق المشترك بدلاً من 16 جزءاً لكل عامل
+YTDL = get_engine('low2', {
+    'http_headers': HEADERS,
+    'retries': 3,
+    'fragment_retries': 3,
+    'nocheckcertificate': True,
+    'nopart': True,
+})
 
 def clean_directory(directory):
     """تنظيف الملفات غير المرغوب فيها بسرعة"""
@@ -52,31 +72,28 @@ def install_requirements():
     """تثبيت سريع للحزم المطلوبة"""
     print("[*] فحص سريع للمتطلبات...")
     
-    try:
-        import requests
+    # الفحوصات محفوظة في الذاكرة - لا يتم تشغيل أي عملية عند الإقلاع المتكرر
+    if module_available('requests'):
         print("  ✓ requests")
-    except:
+    else:
         print("  ✗ تثبيت requests...")
-        subprocess.run([sys.executable, '-m', 'pip', 'install', 'requests', '--quiet'], check=True)
+        ensure_module('requests')
     
-    try:
-        import bs4
+    if module_available('bs4'):
         print("  ✓ beautifulsoup4")
-    except:
+    else:
         print("  ✗ تثبيت beautifulsoup4...")
-        subprocess.run([sys.executable, '-m', 'pip', 'install', 'beautifulsoup4', '--quiet'], check=True)
+        ensure_module('bs4', ['beautifulsoup4'])
     
-    try:
-        subprocess.run(['yt-dlp', '--version'], capture_output=True, check=True)
+    if module_available('yt_dlp'):
         print("  ✓ yt-dlp")
-    except:
+    else:
         print("  ✗ تثبيت yt-dlp...")
-        subprocess.run(['pip', 'install', 'yt-dlp', '--quiet'], check=True)
+        ensure_module('yt_dlp', ['yt-dlp'])
     
-    try:
-        subprocess.run(['ffmpeg', '-version'], capture_output=True, check=True)
+    if tool_available('ffmpeg'):
         print("  ✓ ffmpeg")
-    except:
+    else:
         print("  ✗ تثبيت ffmpeg...")
         subprocess.run(['sudo', 'apt', 'install', '-y', 'ffmpeg', '--quiet'], check=True)
 
@@ -89,13 +106,14 @@ def get_final_episode_url_fast(base_url, series_pattern, episode_num):
     session.headers.update(HEADERS)
     
     try:
-        response = session.get(initial_url, timeout=5, allow_redirects=True)
+        with RESOLVE_SECONDS.time(hop='episode'):
+            response = session.get(initial_url, timeout=5, allow_redirects=True)
         return response.url
     except:
         return initial_url
 
-def extract_m3u8_fast(episode_url):
-    """استخراج سريع لرابط m3u8"""
+def extract_stream_candidates_fast(episode_url):
+    """استخراج سريع لكل خوادم الفيديو في صفحة المشاهدة"""
     try:
         if '?do=watch' not in episode_url:
             if not episode_url.endswith('/'):
@@ -104,29 +122,85 @@ def extract_m3u8_fast(episode_url):
         else:
             watch_url = episode_url
         
-        response = requests.get(watch_url, headers=HEADERS, timeout=8)
+        with RESOLVE_SECONDS.time(hop='watch'):
+            response = requests.get(watch_url, headers=HEADERS, timeout=8)
         
-        # البحث السريع عن iframe
-        iframe_match = re.search(r'<iframe[^>]+src="([^"]+)"', response.text)
-        if iframe_match:
-            iframe_url = iframe_match.group(1)
-            if iframe_url.startswith('//'):
-                iframe_url = 'https:' + iframe_url
+        # كل الخوادم (m3u8 مباشر، iframes، أزرار الخوادم) بدلاً من أول نتيجة فقط
+        return collect_stream_candidates(response.text, watch_url)
+    except:
+        return []
+
+def pipe_hls_to_ffmpeg(m3u8_url, output_args, output_file, kind='copy', watch=None, drop=None):
+    """
+    تنزيل مقاطع HLS بالتوازي (مع طلبات احتياطية) وتمريرها بالترتيب إلى ffmpeg عبر stdin
+    إذا توقف ffmpeg يُستأنف من المقطع الذي توقف عنده بدلاً من إعادة التنزيل كاملاً
+    drop: مديات متكررة (مقدمة/شارة) لا تُنزل مقاطعها أصلاً - الترميز فقط (output_args يعيد ترقيم الوقت)
+    """
+    playlist = load_playlist(m3u8_url, max_height=240)
+    if playlist['encrypted']:
+        raise UnsupportedPlaylist("مقاطع مشفرة")
+    # مدة القائمة (EXTINF) هي المدة الفعلية للحلقة
+    drop = intro_detect.resolve_drop(drop, playlist['duration'])
+    if drop and kind == 'encode':
+        segments, dropped = intro_detect.drop_segments(playlist['segments'], drop)
+        if dropped:
+            print(f"[*] تخطي {dropped} مقطع متكرر (مقدمة/شارة)")
+            playlist = dict(playlist, segments=segments, duration=sum(s['duration'] for s in segments))
+    
+    stream = get_manager().open_stream('download', m3u8_url)
+    storage = get_storage(os.path.dirname(output_file))
+    # نسخ كامل: المصدر المجمع يُحفظ في الذاكرة (download_hls_ultrafast) فلا تُحفظ مقاطعه أيضاً
+    cache = get_cache() if kind == 'encode' else None
+    # المقاطع المحفوظة في ذاكرة المصادر على نفس القرص تُحسب ضمن حجز الحلقة
+    reservation = current_reservation()
+    on_cached = reservation.add if reservation and cache and cache.enabled and storage.contains(cache.root) else None
+    
+    def build(start_seconds, part_file):
+        # أول مقطع يبدأ قبل نقطة التوقف (الجزء السابق يُقص عند بدايته عند الدمج)
+        segments = playlist['segments']
+        skip, offset = 0, 0.0
+        while skip < len(segments) - 1 and offset + segments[skip]['duration'] <= start_seconds:
+            offset += segments[skip]['duration']
+            skip += 1
+        part = dict(playlist, segments=segments[skip:])
+        
+        def feed(stdin, job):
+            def progress(done, total, written):
+                # القرص شبه ممتلئ: التوقف قبل أن يفشل ffmpeg في الكتابة ويفسد الملف
+                # (ffmpeg ينتظر المدخلات أثناء الإيقاف - مراقب التوقف لا يقتله)
+                if storage.wait_for_space(os.path.basename(output_file), job.paused()) and watch:
+                    watch.reset()
+                if watch:
+                    watch.feed(written)
             
-            # استخراج m3u8 من iframe
-            iframe_response = requests.get(iframe_url, headers=HEADERS, timeout=8)
-            m3u8_match = re.search(r'https?://[^\s"\']+\.m3u8[^\s"\']*', iframe_response.text)
-            if m3u8_match:
-                return m3u8_match.group(0)
+            # عدد المقاطع المتوازية يحدده متحكم AIMD لهذا الخادم
+            download_segments(part, stdin, stream=stream, progress=progress, workers_fn=stream.fragments,
+                              cache=cache, on_cached=on_cached)
         
-        # البحث المباشر عن m3u8
-        m3u8_match = re.search(r'https?://[^\s"\']+\.m3u8[^\s"\']*', response.text)
-        if m3u8_match:
-            return m3u8_match.group(0)
-        
-        return None
-    except:
-        return None
+        return ['ffmpeg', '-i', 'pipe:0'] + list(output_args) + [part_file], feed, offset
+    
+    try:
+        return run_resumable(build, output_file, playlist['duration'], kind)
+    except BaseException:
+        stream.error()
+        raise
+    finally:
+        stream.close()
+
+def run_ffmpeg_supervised(source, output_args, output_file, kind='encode', duration=None, resumable=True):
+    """
+    ffmpeg على ملف أو رابط تحت مراقبة التقدم؛ الاستئناف بعد التوقف عبر -ss
+    resumable=False: مرشحات تعيد ترقيم الوقت (حذف المقدمة/الشارة) - وقت المخرج لا يساوي وقت المدخل
+    فالاستئناف من out_time يكرر محتوى ويزيح المديات المحذوفة
+    """
+    if duration is None:
+        duration = probe_duration(source)
+    
+    def build(start_seconds, part_file):
+        seek = ['-ss', f'{start_seconds:.3f}'] if start_seconds else []
+        return ['ffmpeg'] + seek + ['-i', source] + list(output_args) + [part_file], None, start_seconds
+    
+    return run_resumable(build, output_file, duration, kind, max_resumes=MAX_RESUMES if resumable else 0)
 
 def check_video_resolution(input_file):
     """فحص دقة الفيديو"""
@@ -140,7 +214,7 @@ def check_video_resolution(input_file):
             input_file
         ]
         
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=10)
+        result = supervisor.run(cmd, timeout=10)
         if result.returncode == 0 and result.stdout:
             height = int(result.stdout.strip().split(',')[1])
             return height
@@ -148,8 +222,9 @@ def check_video_resolution(input_file):
         pass
     return 0
 
-def download_hls_ultrafast(m3u8_url, output_file):
-    """تنزيل HLS بأقصى سرعة"""
+@traced('download_hls')
+def download_hls_ultrafast(m3u8_url, output_file, watch=None, source_key=None, codec=None):
+    """تنزيل HLS بأقصى سرعة (source_key: حفظ المصدر قبل الضغط في ذاكرة المصادر)"""
     try:
         print(f"[*] تنزيل سريع باستخدام ffmpeg...")
         
@@ -166,49 +241,71 @@ def download_hls_ultrafast(m3u8_url, output_file):
         ]
         
         start_time = time.time()
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=DOWNLOAD_TIMEOUT)
+        try:
+            ok = pipe_hls_to_ffmpeg(m3u8_url, cmd[3:-1], output_file, 'copy', watch)
+        except UnsupportedPlaylist:
+            # ffmpeg يقرأ القائمة بنفسه؛ لا يقبل حد سرعة لكنه يُحسب ضمن التدفقات النشطة
+            stream = get_manager().open_stream('download', m3u8_url)
+            try:
+                ok = run_ffmpeg_supervised(m3u8_url, cmd[3:-1], output_file, 'copy')
+            finally:
+                stream.close()
         
-        if result.returncode == 0 and os.path.exists(output_file):
+        if ok and os.path.exists(output_file):
             elapsed = time.time() - start_time
             file_size = os.path.getsize(output_file) / (1024*1024)
             print(f"[✓] {elapsed:.1f} ثانية - {file_size:.1f} MB")
             
             # فحص الدقة - إذا كانت 240p أو أقل، لا داعي للضغط
             height = check_video_resolution(output_file)
+            if source_key:
+                get_cache().add_source(source_key, output_file, height)
             if height > 0 and height <= 240:
                 print(f"[*] الفيديو بالفعل {height}p - لا حاجة للضغط")
                 return True
             
             # ضغط سريع إذا كان الحجم كبيراً
             if file_size > 50:  # إذا كان أكبر من 50MB
-                return fast_compress_to_240p(output_file)
+                return fast_compress_to_240p(output_file, codec)
             return True
         return False
         
+    except SlowMirror:
+        raise
     except Exception as e:
         print(f"[!] خطأ في التنزيل السريع: {e}")
         return False
 
-def fast_compress_to_240p(input_file):
-    """ضغط سريع جداً إلى 240p"""
+@traced('compress')
+def fast_compress_to_240p(input_file, codec=None, drop=None):
+    """ضغط سريع جداً إلى 240p (codec: x264/x265/svtav1، الافتراضي FHRS_CODEC؛ drop: مديات تُحذف أثناء الترميز)"""
     try:
+        # المدة الفعلية للملف: للمهلة ولمدى الشارة من نهاية الحلقة
+        duration = probe_duration(input_file)
+        drop = intro_detect.resolve_drop(drop, duration)
+        
         # فحص الدقة أولاً
         height = check_video_resolution(input_file)
-        if height > 0 and height <= 240:
+        small = 0 < height <= 240
+        if small and not drop:
             print(f"[*] الفيديو بالفعل {height}p - تخطي الضغط")
             return True
+        if small:
+            print(f"[*] الفيديو بالفعل {height}p - حذف المقدمة/الشارة فقط")
         
         temp_file = input_file.replace('.mp4', '_fast.mp4')
+        # الوسيط (_fast) مسجل في حجز الحلقة: يخرج منه بعد نقله فوق المدخل أو حذفه
+        reservation = current_reservation()
+        video_filter, audio_filter = intro_detect.drop_filters(drop) if drop else ('', '')
         
         # إعدادات ffmpeg للسرعة القصوى مع تحسينات
         cmd = [
             'ffmpeg',
             '-i', input_file,
-            '-vf', 'scale=-2:240',
-            '-c:v', 'libx264',
-            '-preset', 'superfast',  # superfast أسرع في بعض الحالات من ultrafast
-            '-tune', 'fastdecode',
-            '-crf', '34',            # زيادة CRF لتقليل وقت الضغط
+            '-vf', ','.join(f for f in (video_filter, '' if small else 'scale=-2:240') if f),
+            *(['-af', audio_filter] if drop else []),
+            # superfast أسرع في بعض الحالات من ultrafast، وCRF 34 لتقليل وقت الضغط
+            *codec_args(codec, 34, 'superfast', 'fastdecode'),
             '-c:a', 'aac',
             '-b:a', '32k',           # تقليل جودة الصوت أكثر
             '-ac', '1',
@@ -221,13 +318,18 @@ def fast_compress_to_240p(input_file):
         
         print("[*] ضغط سريع...")
         start_time = time.time()
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=COMPRESS_TIMEOUT)
+        # المهلة تُحسب من مدة الفيديو وسرعة الترميز المقاسة، والإيقاف فقط عند التوقف الفعلي
+        if drop:
+            duration = max(0.0, duration - sum(end - start for start, end in drop))
+        ok = run_ffmpeg_supervised(input_file, cmd[3:-1], temp_file, 'encode', duration, resumable=not drop)
         compress_time = time.time() - start_time
         
-        if result.returncode == 0 and os.path.exists(temp_file):
+        if ok and os.path.exists(temp_file):
             original_size = os.path.getsize(input_file) / (1024*1024) if os.path.exists(input_file) else 0
             os.remove(input_file)
             shutil.move(temp_file, input_file)
+            if reservation:
+                reservation.commit(input_file, temp_file)
             
             final_size = os.path.getsize(input_file) / (1024*1024)
             reduction = ((original_size - final_size) / original_size * 100) if original_size > 0 else 0
@@ -236,75 +338,60 @@ def fast_compress_to_240p(input_file):
             print(f"[*] {original_size:.1f}MB → {final_size:.1f}MB ({reduction:.1f}%)")
             return True
         else:
-            print(f"[!] فشل الضغط: {result.stderr[:200] if result.stderr else 'لا يوجد تفاصيل'}")
+            print("[!] فشل الضغط")
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+            if reservation:
+                reservation.commit(input_file, temp_file)
             return False
         
-    except subprocess.TimeoutExpired:
-        print("[!] انتهت مهلة الضغط - استخدام الملف الأصلي")
-        # حذف الملف المؤقت إذا كان موجوداً
-        temp_file = input_file.replace('.mp4', '_fast.mp4')
-        if os.path.exists(temp_file):
-            os.remove(temp_file)
-        return True  # نعتبره نجاحاً لأن الفيديو الأصلي موجود
     except Exception as e:
         print(f"[!] خطأ في الضغط السريع: {e}")
-        return True  # نعتبره نجاحاً لتجنب إعادة المحاولة
+        return False
 
-def download_direct_ultrafast(video_url, output_file):
-    """تنزيل مباشر بأقصى سرعة"""
+@traced('download_direct')
+def download_direct_ultrafast(video_url, output_file, watch=None, source_key=None, codec=None):
+    """تنزيل مباشر بأقصى سرعة (استخراج واحد واختيار الصيغة محلياً)"""
     try:
-        # استخدام yt-dlp مع إعدادات السرعة القصوى
-        # البحث أولاً عن 240p مباشرة
-        cmd = [
-            'yt-dlp',
-            '-f', 'best[height<=240]',  # أفضل جودة حتى 240p
-            '--concurrent-fragments', '16',
-            '--limit-rate', '0',
-            '--retries', '3',
-            '--fragment-retries', '3',
-            '--no-check-certificates',
-            '--no-part',
-            '--quiet',
-            '--progress',
-            '--merge-output-format', 'mp4',
-            '-o', output_file,
-            video_url
-        ]
-        
+        # 240p إذا كانت موجودة في قائمة الصيغ، وإلا أقل جودة - بدون استخراج ثانٍ
         start_time = time.time()
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=DOWNLOAD_TIMEOUT)
-        
-        if result.returncode == 0 and os.path.exists(output_file):
+        bandwidth = get_manager()
+        stream = bandwidth.open_stream('download', video_url)
+        storage = get_storage(os.path.dirname(output_file))
+        try:
+            hook = storage.ytdl_hook(watch.ytdl_hook() if watch else None, watch.reset if watch else None)
+            fmt = YTDL.download(video_url, output_file, max_height=240, prefer='best',
+                                stall_timeout=STALL_TIMEOUT,
+                                progress_hook=bandwidth.ytdl_hook(stream, hook),
+                                options=bandwidth.ytdl_options(stream))
+            if not fmt:
+                stream.error()
+        finally:
+            stream.close()
+        
+        if fmt and os.path.exists(output_file):
             elapsed = time.time() - start_time
             file_size = os.path.getsize(output_file) / (1024*1024)
             print(f"[✓] {elapsed:.1f} ثانية - {file_size:.1f} MB")
+            if source_key:
+                get_cache().add_source(source_key, output_file, fmt.get('height') or 0)
             
-            # فحص الدقة - إذا كانت 240p أو أقل، لا داعي للضغط
-            height = check_video_resolution(output_file)
-            if height > 0 and height <= 240:
-                print(f"[*] الفيديو بالفعل {height}p - لا حاجة للضغط")
+            if fmt['fits']:
+                # فحص الدقة - إذا كانت 240p أو أقل، لا داعي للضغط
+                height = fmt.get('height') or check_video_resolution(output_file)
+                if height > 0 and height <= 240:
+                    print(f"[*] الفيديو بالفعل {height}p - لا حاجة للضغط")
+                    return True
+                
+                # ضغط سريع فقط إذا كان الحجم كبيراً
+                if file_size > 50:
+                    return fast_compress_to_240p(output_file, codec)
                 return True
             
-            # ضغط سريع فقط إذا كان الحجم كبيراً
-            if file_size > 50:
-                return fast_compress_to_240p(output_file)
-            return True
-        
-        # إذا فشل الحصول على 240p، جرب أقل جودة
-        print("[*] لم أجد 240p، جرب أقل جودة...")
-        cmd[2] = 'worst'  # تغيير الفلتر إلى أسوأ جودة
-        
-        start_time = time.time()
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=DOWNLOAD_TIMEOUT)
-        
-        if result.returncode == 0 and os.path.exists(output_file):
-            elapsed = time.time() - start_time
-            file_size = os.path.getsize(output_file) / (1024*1024)
-            print(f"[✓] {elapsed:.1f} ثانية - {file_size:.1f} MB")
-            
+            print("[*] لم أجد 240p، تم تنزيل أقل جودة")
             # ضغط سريع إذا كان الحجم كبيراً
             if file_size > 30:
-                return fast_compress_to_240p(output_file)
+                return fast_compress_to_240p(output_file, codec)
             return True
         
         return False
@@ -313,19 +400,20 @@ def download_direct_ultrafast(video_url, output_file):
         print(f"[!] خطأ في التنزيل المباشر: {e}")
         return False
 
-def download_hls_direct_to_240p(m3u8_url, output_file):
-    """تنزيل HLS وتحويل مباشر إلى 240p"""
+@traced('download_encode_240p')
+def download_hls_direct_to_240p(m3u8_url, output_file, watch=None, codec=None, drop=None):
+    """تنزيل HLS وتحويل مباشر إلى 240p (drop: مديات المقدمة/الشارة المتكررة لا تُنزل ولا تُرمز)"""
     try:
         print(f"[*] تنزيل وتحويل مباشر إلى 240p...")
         
         # استخدام ffmpeg لتنزيل وتحويل في خطوة واحدة
+        # بعد حذف مقاطع يُعاد ترقيم الوقت حتى لا تبقى فجوة في الملف
         cmd = [
             'ffmpeg',
             '-i', m3u8_url,
-            '-vf', 'scale=-2:240',
-            '-c:v', 'libx264',
-            '-preset', 'superfast',
-            '-crf', '34',
+            '-vf', 'setpts=N/FRAME_RATE/TB,scale=-2:240' if drop else 'scale=-2:240',
+            *(['-af', 'asetpts=N/SR/TB'] if drop else []),
+            *codec_args(codec, 34, 'superfast'),
             '-c:a', 'aac',
             '-b:a', '32k',
             '-ac', '1',
@@ -336,105 +424,206 @@ def download_hls_direct_to_240p(m3u8_url, output_file):
         ]
         
         start_time = time.time()
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=DOWNLOAD_TIMEOUT + COMPRESS_TIMEOUT)
+        try:
+            # المقاطع تُنزّل بالتوازي وتُمرر مباشرة للترميز - تنزيل وتحويل في خطوة واحدة
+            ok = pipe_hls_to_ffmpeg(m3u8_url, cmd[3:-1], output_file, 'encode', watch, drop)
+        except UnsupportedPlaylist:
+            duration = probe_duration(m3u8_url)
+            drop = intro_detect.resolve_drop(drop, duration)
+            if drop:
+                # ffmpeg يقرأ القائمة بنفسه: الحذف أثناء الترميز فقط (التنزيل كامل)
+                video_filter, audio_filter = intro_detect.drop_filters(drop)
+                cmd[cmd.index('-vf') + 1] = f"{video_filter},scale=-2:240"
+                cmd[cmd.index('-af') + 1] = audio_filter
+            stream = get_manager().open_stream('download', m3u8_url)
+            try:
+                ok = run_ffmpeg_supervised(m3u8_url, cmd[3:-1], output_file, 'encode', duration,
+                                           resumable=not drop)
+            finally:
+                stream.close()
         
-        if result.returncode == 0 and os.path.exists(output_file):
+        if ok and os.path.exists(output_file):
             elapsed = time.time() - start_time
             file_size = os.path.getsize(output_file) / (1024*1024)
             print(f"[✓] {elapsed:.1f} ثانية - {file_size:.1f} MB")
             return True
         return False
         
+    except SlowMirror:
+        raise
     except Exception as e:
         print(f"[!] خطأ في التنزيل المباشر إلى 240p: {e}")
         return False
 
-def parallel_download_worker(task_queue, results_queue):
-    """عامل للتنزيل المتوازي"""
-    while True:
-        try:
-            task = task_queue.get_nowait()
-        except:
-            break
-        
-        episode_num, base_url, series_pattern, download_dir = task
-        episode_str = f"{episode_num:02d}"
-        
+@traced('episode')
+def process_planned_episode(job, base_url, series_pattern, download_dir, episode_url):
+    """حلقة واحدة من خطة الموسم (الخوادم مفحوصة مسبقاً أثناء التخطيط) -> (رقم الحلقة، نجاح، رسالة)"""
+    episode_num = job['episode']
+    episode_str = f"{episode_num:02d}"
+    output_file = episode_output_path(download_dir, episode_num)
+    
+    # مصدر منزل سابقاً (إعادة ترميز أو إعادة محاولة) - بدون أي طلب شبكة
+    key = episode_key(series_pattern, episode_num)
+    # محرك الترميز للمسلسل (ladders.json)
+    codec = codec_for(series_pattern)
+    cached = get_cache().sources(key)
+    # المقدمة والشارة المتكررة (FHRS_SKIP_RECURRING=1): مدى الحلقة إذا كُشف، وإلا مدى المسلسل المتفق عليه
+    skip = intro_detect.SKIP_RECURRING and intro_detect.available()
+    if cached:
+        print(f"[*] الحلقة {episode_str}: من ذاكرة المصادر ({cached[0]['height'] or '?'}p)")
+        drop = intro_detect.episode_ranges(series_pattern, episode_num) if skip else None
+        if get_cache().materialize(cached[0], output_file) and fast_compress_to_240p(output_file, codec, drop):
+            return episode_num, True, "نجح (من الذاكرة)"
+    
+    mirrors = job['mirrors']
+    if mirrors is None:
+        mirrors = discover_mirrors(base_url, series_pattern, episode_num, episode_url)
+    
+    if not mirrors:
+        return episode_num, False, "فشل استخراج الرابط"
+    
+    print(f"[*] الحلقة {episode_str}: جاري التنزيل...")
+    # مدى المسلسل يُحسب بمدة الحلقة الفعلية عند الترميز (تقدير التخطيط قد يكون من الحجم)
+    drop = intro_detect.series_drop(series_pattern) if skip else None
+    
+    # محاولة التنزيل السريع
+    success = False
+    
+    for index, mirror in enumerate(mirrors):
+        m3u8_url = mirror['url']
+        # التبديل عند البطء فقط إذا بقي خادم آخر
+        watch = RateWatch() if index < len(mirrors) - 1 else None
         try:
-            output_file = os.path.join(download_dir, f"الحلقة_{episode_str}.mp4")
-            
-            # تخطي إذا كان الملف موجوداً
-            if os.path.exists(output_file):
-                size = os.path.getsize(output_file) / (1024*1024)
-                results_queue.put((episode_num, True, f"موجود ({size:.1f}MB)"))
-                task_queue.task_done()
-                continue
-            
-            # استخراج سريع للرابط
-            episode_url = get_final_episode_url_fast(base_url, series_pattern, episode_num)
-            m3u8_url = extract_m3u8_fast(episode_url)
-            
-            if not m3u8_url:
-                results_queue.put((episode_num, False, "فشل استخراج الرابط"))
-                task_queue.task_done()
-                continue
-            
-            print(f"[*] الحلقة {episode_str}: جاري التنزيل...")
-            
-            # محاولة التنزيل السريع
-            success = False
-            
-            if m3u8_url and '.m3u8' in m3u8_url:
+            if '.m3u8' in m3u8_url:
                 # المحاولة 1: تحميل وتحويل مباشر إلى 240p
-                success = download_hls_direct_to_240p(m3u8_url, output_file)
+                success = download_hls_direct_to_240p(m3u8_url, output_file, watch, codec, drop)
                 
                 # المحاولة 2: إذا فشلت، جرب الطريقة العادية
                 if not success:
-                    success = download_hls_ultrafast(m3u8_url, output_file)
-            else:
-                success = download_direct_ultrafast(m3u8_url, output_file)
-            
-            if success:
-                results_queue.put((episode_num, True, "نجح"))
+                    success = download_hls_ultrafast(m3u8_url, output_file, watch, key, codec)
             else:
-                results_queue.put((episode_num, False, "فشل التنزيل"))
-            
-        except Exception as e:
-            results_queue.put((episode_num, False, f"خطأ: {str(e)[:50]}"))
+                success = download_direct_ultrafast(m3u8_url, output_file, watch, key, codec)
+        except SlowMirror as e:
+            print(f"[*] الحلقة {episode_str}: {e} - التبديل إلى خادم آخر")
+            success = False
         
-        task_queue.task_done()
+        if success:
+            break
+    
+    if success:
+        if skip and not drop:
+            # الحلقة كاملة: بصمتها تكشف المقدمة والشارة للحلقات التالية
+            try:
+                intro_detect.learn(series_pattern, episode_num, output_file)
+            except Exception as e:
+                print(f"[!] تعذر كشف المقدمة والشارة: {e}")
+        return episode_num, True, "نجح"
+    return episode_num, False, "فشل التنزيل"
+
+def episode_output_path(download_dir, episode_num):
+    return os.path.join(download_dir, f"الحلقة_{episode_num:02d}.mp4")
+
+def process_job(job, download_dir):
+    """
+    مهمة مؤجرة من المنسق (coordinator.py) على هذا الجهاز -> (نجاح، رسالة، مسار الملف)
+    job: {'series_pattern', 'episode', 'base_url', 'episode_url'}
+    """
+    base_url, series_pattern, episode_url = job['base_url'], job['series_pattern'], job.get('episode_url')
+    cached = get_cache().sources(episode_key(series_pattern, job['episode']), count=False)
+    planned = plan_episode(
+        job['episode'],
+        lambda ep: discover_mirrors(base_url, series_pattern, ep, episode_url),
+        cached[0] if cached else None,
+    )
+    _, success, message = process_planned_episode(planned, base_url, series_pattern, download_dir, episode_url)
+    return success, message, episode_output_path(download_dir, job['episode'])
+
+@traced('resolve')
+def discover_mirrors(base_url, series_pattern, episode_num, episode_url=None):
+    """خوادم الحلقة مرتبة من الأسرع"""
+    # استخراج سريع للرابط (إذا لم يكن معروفاً من قائمة الحلقات)
+    if not episode_url:
+        episode_url = get_final_episode_url_fast(base_url, series_pattern, episode_num)
+    # فحص كل الخوادم بالتوازي
+    return race_mirrors(extract_stream_candidates_fast(episode_url))
 
-def process_episodes_parallel_fast(base_url, series_pattern, start_ep, end_ep, download_dir, num_workers):
+def process_episodes_parallel_fast(base_url, series_pattern, start_ep, end_ep, download_dir, num_workers, index_url=None):
     """معالجة الحلقات بشكل متوازي بأقصى سرعة"""
-    print(f"\n[*] بدء التنزيل المتوازي ({num_workers} تنزيلات متزامنة)")
-    
-    # إنشاء قائمة المهام
-    task_queue = Queue()
-    results_queue = Queue()
-    
+    # جلب روابط كل الحلقات من صفحة القائمة مرة واحدة (الموجودة في ذاكرة المصادر لا تحتاجها)
+    cache = get_cache()
+    cached = {}
     for ep in range(start_ep, end_ep + 1):
-        task_queue.put((ep, base_url, series_pattern, download_dir))
+        sources = cache.sources(episode_key(series_pattern, ep), count=False)
+        if sources:
+            cached[ep] = sources[0]
+    wanted = [ep for ep in range(start_ep, end_ep + 1) if ep not in cached]
+    episode_urls, missing = resolve_episode_urls(base_url, series_pattern, wanted, index_url) if wanted else ({}, [])
     
-    # إنشاء العمال
-    workers = []
-    for _ in range(min(num_workers, task_queue.qsize())):
-        worker = threading.Thread(target=parallel_download_worker, args=(task_queue, results_queue))
-        worker.start()
-        workers.append(worker)
+    # نتائج معروفة قبل البدء (غير موجودة أو منزلة مسبقاً)
+    results = [(ep, False, "غير موجودة") for ep in missing]
     
-    # انتظار انتهاء جميع المهام
-    task_queue.join()
-    
-    # جمع النتائج
-    results = []
-    while not results_queue.empty():
-        results.append(results_queue.get())
+    # تخطي الحلقات الموجودة مسبقاً قبل التخطيط
+    planned = []
+    for ep in range(start_ep, end_ep + 1):
+        if ep in missing:
+            continue
+        output_file = episode_output_path(download_dir, ep)
+        if os.path.exists(output_file):
+            size = os.path.getsize(output_file) / (1024*1024)
+            results.append((ep, True, f"موجود ({size:.1f}MB)"))
+        else:
+            planned.append(ep)
+    
+    # تخطيط: الحلقات المخزنة بمدتها أولاً (الأطول)، والبقية تُفحص خوادمها عند بدئها
+    print(f"\n[*] تخطيط {len(planned)} حلقات...")
+    jobs = plan_jobs(planned, cached)
+    print_plan(jobs, num_workers, download_dir)
+    admission = Admission(download_dir)
+    
+    def discover(ep):
+        return discover_mirrors(base_url, series_pattern, ep, episode_urls.get(ep))
+    
+    def handle(job):
+        if job['source'] != 'cache' and (job['mirrors'] is None or job.get('attempts')):
+            # فحص الخوادم الآن (وليس للموسم كله مقدماً): روابط حديثة وتقدير حقيقي لحجز القرص والخط
+            # إعادة المحاولة تفحص من جديد (الخوادم السابقة قد تكون سبب الفشل)
+            probe_job(job, discover)
+        with admission.admit(job) as reservation:
+            if job['mirrors'] and plan_is_stale(job):
+                # خطة قديمة (موسم طويل أو انتظار للمساحة): روابطها الموقعة وسرعاتها قد لا تصلح
+                print(f"[*] الحلقة {job['episode']:02d}: الخوادم فُحصت منذ أكثر من "
+                      f"{PLAN_TTL // 60} دقائق - فحص جديد")
+                job['mirrors'] = None
+            output_file = episode_output_path(download_dir, job['episode'])
+            # ما تكتبه الحلقة يُخصم من حجزها، والوسيط (_fast) يُحذف فور اكتمال الضغط
+            reservation.track(output_file, output_file.replace('.mp4', '_fast.mp4'))
+            started = time.monotonic()
+            _, success, message = process_planned_episode(
+                job, base_url, series_pattern, download_dir, episode_urls.get(job['episode'])
+            )
+            record_episode(time.monotonic() - started, success)
+        return success, message
+    
+    for ep_num, success, message in sorted(results):
+        report_result(ep_num, success, message)
+    
+    scheduler = Scheduler(handle, num_workers)
+    print(f"\n[*] بدء التنزيل المتوازي ({num_workers} تنزيلات متزامنة)")
+    if scheduler.install_signals():
+        print(f"[*] لتغيير عدد العمال أثناء التشغيل: kill -USR1 {os.getpid()} (زيادة) أو -USR2 (نقص)")
     
-    # انتظار انتهاء جميع العمال
-    for worker in workers:
-        worker.join()
+    # النتائج فور انتهاء كل حلقة (الفاشلة تُعاد تلقائياً قبل أن تُعتبر فاشلة)
+    for job, success, message in scheduler.run(jobs):
+        report_result(job['episode'], success, message)
+        results.append((job['episode'], success, message))
     
-    return results
+    return sorted(results)
+
+def report_result(ep_num, success, message):
+    if success:
+        print(f"[✓] الحلقة {ep_num:02d}: {message}")
+    else:
+        print(f"[✗] الحلقة {ep_num:02d}: {message}")
 
 def main_lightning_speed():
     """الوظيفة الرئيسية للسرعة القصوى"""
@@ -444,6 +633,7 @@ def main_lightning_speed():
     
     # تثبيت سريع
     install_requirements()
+    start_exporter()
     
     # إدخال سريع
     print("\n[*] أدخل المعلومات بسرعة:")
@@ -458,6 +648,8 @@ def main_lightning_speed():
     if not series_pattern.endswith('-'):
         series_pattern += '-'
     
+    index_url = input("رابط صفحة المسلسل/الموسم [تلقائي]: ").strip() or None
+    
     # استخراج اسم المسلسل
     if '-episode-' in series_pattern:
         series_name = series_pattern.split('-episode-')[0]
@@ -503,12 +695,12 @@ def main_lightning_speed():
     print(f"    الحلقات: {start_ep:02d} إلى {end_ep:02d}")
     print(f"    التنزيلات المتوازية: {num_workers}")
     print(f"    الضغط التلقائي: عند الحاجة فقط")
-    print(f"    مهلة الضغط: {COMPRESS_TIMEOUT//60} دقائق")
+    print(f"    المهلة: حسب التقدم (إيقاف بعد {STALL_TIMEOUT} ثانية بدون تقدم)")
     print('='*60)
     
     # بدء التنزيل المتوازي
     start_time = time.time()
-    results = process_episodes_parallel_fast(base_url, series_pattern, start_ep, end_ep, download_dir, num_workers)
+    results = process_episodes_parallel_fast(base_url, series_pattern, start_ep, end_ep, download_dir, num_workers, index_url)
     
     # تحليل النتائج
     successful = 0
@@ -517,10 +709,8 @@ def main_lightning_speed():
     for ep_num, success, message in results:
         if success:
             successful += 1
-            print(f"[✓] الحلقة {ep_num:02d}: {message}")
         else:
             failed.append(ep_num)
-            print(f"[✗] الحلقة {ep_num:02d}: {message}")
     
     # النتائج النهائية
     total_time = time.time() - start_time
@@ -575,6 +765,8 @@ def main_lightning_speed():
     print("[*] اكتمل العمل!")
 
 if __name__ == "__main__":
+    from_argv()
+    supervisor.install()
     print("="*60)
     print("تنزيل فيديو - إصلاح الضغط والسرعة")
     print("="*60)
@@ -13,15 +13,37 @@ import subprocess
 import shutil
 import asyncio
 import math
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from episodes import resolve_episode_urls
+from caps import tool_available, module_available, ensure_module
+from ytdl_engine import get_engine
+from bandwidth import get_manager
+from mirrors import collect_stream_candidates, race_mirrors, RateWatch
+import supervisor
+from source_cache import get_cache, episode_key
+from tg_upload import UploadPool, PublishedLog, UPLOAD_SESSIONS, MEDIA_GROUP_SIZE
+from tg_resume import ResumableUploader, pending_upload
+from metrics import RESOLVE_SECONDS, FLOODWAIT_SECONDS, record_episode, start_exporter
+import tracing
+from tracing import traced
+from storage import get_storage, commit
+from encoding import (ladder_for, ladder_outputs, encode_ladder, run_streamable, ladder_command, streaming_rung,
+                      ensure_streamable, CODEC, UPLOAD_MP4_MODE)
 
-# ===== إضافة Pyrogram بعد التثبيت =====
-try:
-    from pyrogram import Client
-    from pyrogram.errors import FloodWait, AuthKeyUnregistered, SessionPasswordNeeded
-    PYROGRAM_INSTALLED = True
-except ImportError:
-    print("[*] تثبيت pyrogram...")
-    subprocess.check_call([sys.executable, "-m", "pip", "install", "pyrogram", "tgcrypto"])
+# ===== Pyrogram يُستورد عند أول استخدام فقط =====
+Client = None
+FloodWait = AuthKeyUnregistered = SessionPasswordNeeded = None
+PYROGRAM_INSTALLED = False
+
+def load_pyrogram():
+    """استيراد Pyrogram (وتثبيته عند الحاجة) عند أول اتصال بـ Telegram"""
+    global Client, FloodWait, AuthKeyUnregistered, SessionPasswordNeeded, PYROGRAM_INSTALLED
+    if PYROGRAM_INSTALLED:
+        return
+    if not module_available('pyrogram'):
+        print("[*] تثبيت pyrogram...")
+        ensure_module('pyrogram', ['pyrogram', 'tgcrypto'])
     from pyrogram import Client
     from pyrogram.errors import FloodWait, AuthKeyUnregistered, SessionPasswordNeeded
     PYROGRAM_INSTALLED = True
@@ -45,8 +67,35 @@ TELEGRAM_API_HASH = "4779bdfbeddb85accd6fdbe199625ac5"
 TELEGRAM_PHONE = "+201121087915"
 TELEGRAM_CHANNEL = "@shoofFilm"
 
+# yt-dlp داخل العملية (يُستورد عند أول تنزيل)
+YTDL = get_engine('lowg', {
+    'quiet': False,
+    'no_warnings': False,
+    'noprogress': False,
+    'user_agent': USER_AGENT,
+    'referer': 'https://v.vidsp.net/',
+    'http_headers': HEADERS,
+})
+
 # جلسة Pyrogram
 app = None
+# مجمع الرفع (FHRS_UPLOAD_SESSIONS > 1): عدة جلسات ترفع معاً والنشر بالترتيب
+upload_pool = None
+
+# عدد الحلقات قيد المعالجة معاً (تنزيل حلقة أثناء ضغط/رفع السابقة)
+EPISODES_IN_FLIGHT = max(1, int(os.environ.get('FHRS_EPISODES_IN_FLIGHT', '2')))
+# الضغط يستخدم كل الأنوية: ترميز واحد في كل مرة، والباقي في خيوط asyncio الافتراضية
+ENCODE_POOL = ThreadPoolExecutor(max_workers=1, thread_name_prefix='encode')
+
+
+async def run_blocking(func, *args, pool=None, **kwargs):
+    """تشغيل مرحلة حاجزة (شبكة، yt-dlp، ffmpeg) خارج حلقة الأحداث حتى يبقى اتصال Telegram حياً"""
+    if pool is None:
+        return await asyncio.to_thread(func, *args, **kwargs)
+    loop = asyncio.get_running_loop()
+    # run_in_executor لا ينقل السياق (بخلاف to_thread) - التتبع يحتاج مسار الحلقة ومقطعها الأب
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(pool, lambda: context.run(func, *args, **kwargs))
 
 # ===== TELEGRAM SETUP =====
 
@@ -58,6 +107,8 @@ async def setup_telegram():
     print("إعداد Telegram")
     print("="*50)
     
+    load_pyrogram()
+    
     try:
         print(f"[*] API_ID: {TELEGRAM_API_ID}")
         print(f"[*] Phone: {TELEGRAM_PHONE}")
@@ -104,34 +155,36 @@ async def setup_telegram():
 
 # ===== VIDEO DOWNLOAD =====
 
-def download_video(url, output_path):
-    """تنزيل فيديو باستخدام yt-dlp"""
+@traced('download')
+def download_video(url, output_path, watch=None):
+    """
+    تنزيل فيديو باستخدام yt-dlp (محرك مشترك، استخراج واحد واختيار الصيغة محلياً)
+    يرجع الصيغة المنزلة (أو True إذا لم تُعرف) عند النجاح
+    """
     try:
-        import yt_dlp
-        
-        ydl_opts = {
-            'format': 'best[height<=720]/best',
-            'outtmpl': output_path,
-            'quiet': False,
-            'no_warnings': False,
-            'user_agent': USER_AGENT,
-            'referer': 'https://v.vidsp.net/',
-            'http_headers': HEADERS,
-        }
-        
         print(f"[*] جاري تنزيل الفيديو...")
         start = time.time()
         
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            ydl.download([url])
+        bandwidth = get_manager()
+        stream = bandwidth.open_stream('download', url)
+        storage = get_storage(os.path.dirname(output_path))
+        try:
+            hook = storage.ytdl_hook(watch.ytdl_hook() if watch else None, watch.reset if watch else None)
+            fmt = YTDL.download(url, output_path, max_height=720, prefer='best',
+                                progress_hook=bandwidth.ytdl_hook(stream, hook),
+                                options=bandwidth.ytdl_options(stream))
+            if not fmt:
+                stream.error()
+        finally:
+            stream.close()
         
         elapsed = time.time() - start
         
         # التحقق من وجود الملف
-        if os.path.exists(output_path):
+        if fmt and os.path.exists(output_path):
             size = os.path.getsize(output_path) / (1024*1024)
             print(f"[+] تم التنزيل خلال {elapsed:.1f}ث ({size:.1f}MB)")
-            return True
+            return fmt
         else:
             # البحث عن ملف آخر
             base = os.path.splitext(output_path)[0]
@@ -162,7 +215,7 @@ def get_video_dimensions(input_file):
             input_file
         ]
         
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        result = supervisor.run(cmd, timeout=30)
         if result.returncode == 0:
             dimensions = result.stdout.strip().split(',')
             if len(dimensions) == 2:
@@ -176,8 +229,9 @@ def get_video_dimensions(input_file):
 
 # ===== COMPRESSION TO 240P - SIMPLE =====
 
-def compress_video_240p_simple(input_file, output_file, crf=28):
-    """ضغط الفيديو إلى 240p بشكل بسيط"""
+@traced('compress')
+def compress_video_240p_simple(input_file, output_file, crf=28, codec=None):
+    """ضغط الفيديو إلى 240p بشكل بسيط (codec: x264/x265/svtav1، الافتراضي FHRS_CODEC)"""
     if not os.path.exists(input_file):
         print(f"[!] الملف غير موجود: {input_file}")
         return False
@@ -186,9 +240,10 @@ def compress_video_240p_simple(input_file, output_file, crf=28):
     
     print(f"[*] جاري ضغط الفيديو إلى 240p...")
     print(f"[*] الحجم الأصلي: {original_size:.1f}MB")
-    print(f"[*] CRF: {crf}")
+    print(f"[*] CRF: {crf} ({codec or CODEC})")
     
     # الحصول على مدة الفيديو
+    duration = 0
     try:
         cmd_info = [
             'ffprobe',
@@ -198,7 +253,7 @@ def compress_video_240p_simple(input_file, output_file, crf=28):
             input_file
         ]
         
-        result = subprocess.run(cmd_info, capture_output=True, text=True)
+        result = supervisor.run(cmd_info, timeout=30)
         if result.returncode == 0:
             info = json.loads(result.stdout)
             duration = float(info['format'].get('duration', 0))
@@ -207,74 +262,39 @@ def compress_video_240p_simple(input_file, output_file, crf=28):
     except:
         duration = 0
     
-    # ===== إعدادات بسيطة تعمل دائمًا =====
-    cmd = [
-        'ffmpeg',
-        '-i', input_file,
-        '-vf', 'scale=-2:240',          # تحويل إلى 240p مع الحفاظ على النسبة
-        '-c:v', 'libx264',
-        '-crf', str(crf),
-        '-preset', 'veryfast',
-        '-c:a', 'aac',
-        '-b:a', '64k',
-        '-progress', 'pipe:1',
-        '-y',
-        output_file
-    ]
+    # ===== ملف التشغيل في القناة =====
+    # 240p، keyframe كل ثانيتين، سقف VBV لشبكات الجوال (انظر STREAMING_PROFILE)
+    cmd = ladder_command(input_file, [(streaming_rung({'crf': crf, 'codec': codec or CODEC}), output_file)])
     
     print(f"[*] جاري بدء الضغط...")
     print(f"[ ] 0%", end='', flush=True)
     
     start_time = time.time()
-    process = subprocess.Popen(
-        cmd,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        universal_newlines=True,
-        bufsize=1
-    )
-    
-    # متغيرات لتتبع التقدم
-    progress_data = {}
-    
-    # قراءة الإخراج سطراً سطراً
-    for line in process.stdout:
-        line = line.strip()
-        
-        # تحليل خطوط التقدم
-        if '=' in line:
-            key, value = line.split('=', 1)
-            progress_data[key.strip()] = value.strip()
-        
-        # عرض التقدم بناءً على الوقت
-        if 'out_time_ms' in progress_data:
-            try:
-                current_time_ms = int(progress_data['out_time_ms'])
-                current_time = current_time_ms / 1000000.0  # تحويل إلى ثواني
-                
-                if duration > 0:
-                    progress_percent = min(100, (current_time / duration) * 100)
-                    
-                    # عرض شريط تقدم
-                    bar_length = 30
-                    filled_length = int(bar_length * progress_percent // 100)
-                    bar = '█' * filled_length + '░' * (bar_length - filled_length)
-                    
-                    elapsed = time.time() - start_time
-                    if progress_percent > 0:
-                        remaining = (elapsed / progress_percent) * (100 - progress_percent)
-                        print(f"\r[+] {progress_percent:.1f}% |{bar}| الوقت المتبقي: {remaining:.0f}ث", end='', flush=True)
-                    else:
-                        print(f"\r[+] {progress_percent:.1f}% |{bar}|", end='', flush=True)
-            except:
-                pass
     
-    # الانتظار حتى انتهاء العملية
-    process.wait()
+    def show_progress(current_time, total):
+        if total <= 0:
+            return
+        progress_percent = min(100, (current_time / total) * 100)
+        
+        # عرض شريط تقدم
+        bar_length = 30
+        filled_length = int(bar_length * progress_percent // 100)
+        bar = '█' * filled_length + '░' * (bar_length - filled_length)
+        
+        elapsed = time.time() - start_time
+        if progress_percent > 0:
+            remaining = (elapsed / progress_percent) * (100 - progress_percent)
+            print(f"\r[+] {progress_percent:.1f}% |{bar}| الوقت المتبقي: {remaining:.0f}ث", end='', flush=True)
+        else:
+            print(f"\r[+] {progress_percent:.1f}% |{bar}|", end='', flush=True)
+    
+    # التقدم من -progress، وstderr في سجل محدود (بدون دمجه مع stdout)، وأولوية منخفضة
+    # الملف قابل للبث (supports_streaming) فور انتهاء الترميز: moov محجوز في البداية (ليس fMP4)
+    result = run_streamable(cmd, duration, progress=show_progress, mode='reserved')
     
     print()  # سطر جديد بعد انتهاء الشريط
     
-    if process.returncode == 0 and os.path.exists(output_file):
+    if result.returncode == 0 and os.path.exists(output_file):
         new_size = os.path.getsize(output_file) / (1024 * 1024)
         total_time = time.time() - start_time
         reduction = ((original_size - new_size) / original_size) * 100
@@ -288,11 +308,12 @@ def compress_video_240p_simple(input_file, output_file, crf=28):
         # الحصول على تفاصيل الخطأ
         if os.path.exists(output_file):
             os.remove(output_file)
-        print(f"[!] فشل الضغط (رمز الخروج: {process.returncode})")
+        print(f"[!] فشل الضغط (رمز الخروج: {result.returncode}): {result.log.tail()[:200]}")
         return False
 
 # ===== CREATE THUMBNAIL 16:9 =====
 
+@traced('thumbnail')
 def create_thumbnail_16_9(input_file, thumbnail_path):
     """إنشاء صورة مصغرة للفيديو بنسبة 16:9"""
     try:
@@ -320,7 +341,7 @@ def create_thumbnail_16_9(input_file, thumbnail_path):
             thumbnail_path
         ]
         
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
+        result = supervisor.run(cmd, timeout=30)
         
         if result.returncode == 0 and os.path.exists(thumbnail_path):
             size = os.path.getsize(thumbnail_path) / 1024  # KB
@@ -335,7 +356,7 @@ def create_thumbnail_16_9(input_file, thumbnail_path):
                     '-y',
                     thumbnail_path + '.tmp'
                 ]
-                subprocess.run(optimize_cmd, capture_output=True, text=True)
+                supervisor.run(optimize_cmd, timeout=30)
                 if os.path.exists(thumbnail_path + '.tmp'):
                     shutil.move(thumbnail_path + '.tmp', thumbnail_path)
             
@@ -363,7 +384,7 @@ def get_video_duration(input_file):
             input_file
         ]
         
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        result = supervisor.run(cmd, timeout=30)
         if result.returncode == 0:
             return int(float(result.stdout.strip()))
     except:
@@ -373,38 +394,52 @@ def get_video_duration(input_file):
 
 # ===== UPLOAD TO TELEGRAM WITH STREAMING SUPPORT =====
 
-async def upload_video_to_channel(file_path, caption, thumbnail_path=None):
-    """رفع الفيديو إلى القناة مع دعم التشغيل المتقطع"""
+@traced('upload')
+async def upload_video_to_channel(file_path, caption, thumbnail_path=None, turn=None):
+    """
+    رفع الفيديو إلى القناة مع دعم التشغيل المتقطع
+    turn: حدث ينتظره النشر (مع المجمع يبدأ الرفع فوراً وينتظر النشر فقط)
+    """
     try:
         if not app or not os.path.exists(file_path):
             return False
+        if upload_pool is None and turn is not None:
+            await turn.wait()
         
         filename = os.path.basename(file_path)
+        
+        # moov في البداية لكل ما يُرفع (مثلاً الملف الأصلي عند فشل الضغط) - نقل بدون إعادة ترميز
+        if not await run_blocking(ensure_streamable, file_path):
+            print("[!] تعذر نقل moov إلى بداية الملف - قد يتأخر التشغيل")
         file_size = os.path.getsize(file_path) / (1024*1024)
         
         print(f"[*] جاري رفع: {filename}")
         print(f"[*] الحجم: {file_size:.1f}MB")
         
         # الحصول على أبعاد الفيديو
-        width, height = get_video_dimensions(file_path)
+        width, height = await run_blocking(get_video_dimensions, file_path)
         
         # الحصول على مدة الفيديو
-        duration = get_video_duration(file_path)
+        duration = await run_blocking(get_video_duration, file_path)
         
         start_time = time.time()
         last_update = 0
+        uploader = None
         
-        def progress_callback(current, total):
+        async def progress_callback(current, total):
             nonlocal last_update
+            # current يشمل الأجزاء المرفوعة في تشغيل سابق: السرعة وحصة الخط بما أُرسل الآن فقط
+            sent = current - (uploader.resumed_bytes if uploader else 0)
+            await upload_stream.throttle_total_async(sent)
             percentage = (current / total) * 100
             
             # تحديث كل 2% أو كل ثانية
             now = time.time()
             if now - last_update > 1 or percentage - last_update >= 2:
                 elapsed = now - start_time
-                if current > 0 and elapsed > 0:
-                    speed = current / elapsed / 1024  # KB/s
-                    remaining = ((total - current) / current) * elapsed if current > 0 else 0
+                if sent > 0 and elapsed > 0:
+                    speed = sent / elapsed / 1024  # KB/s
+                    remaining = ((total - current) / sent) * elapsed
                     
                     bar_length = 25
                     filled = int(bar_length * current // total)
@@ -430,34 +465,53 @@ async def upload_video_to_channel(file_path, caption, thumbnail_path=None):
         if thumbnail_path and os.path.exists(thumbnail_path):
             upload_params['thumb'] = thumbnail_path
         
-        # رفع الفيديو
+        # الرفع يأخذ نصيبه من ميزانية الخط حتى لا يخنقه التنزيل (أو العكس)
+        upload_stream = get_manager().open_stream('upload', TELEGRAM_CHANNEL)
         try:
-            await app.send_video(**upload_params)
-            
-            elapsed = time.time() - start_time
-            print(f"\n[+] تم الرفع خلال {elapsed:.1f}ثانية")
-            print(f"[+] الفيديو يدعم التشغيل المتقطع (يتوقف عند الخروج)")
-            return True
-            
-        except FloodWait as e:
-            print(f"\n[*] انتظر {e.value} ثانية...")
-            await asyncio.sleep(e.value)
-            return await upload_video_to_channel(file_path, caption, thumbnail_path)
-            
-        except Exception as e:
-            print(f"\n[!] خطأ في الرفع: {e}")
+            if upload_pool is not None:
+                await upload_pool.publish(file_path, caption, thumb=upload_params.get('thumb'),
+                                          progress=progress_callback, turn=turn, supports_streaming=True,
+                                          width=width, height=height, duration=duration)
+                print(f"\n[+] تم الرفع خلال {time.time() - start_time:.1f}ثانية ({upload_pool.size} جلسات)")
+                return True
             
-            # محاولة بدون progress callback ولكن مع نفس الإعدادات
+            # رفع الفيديو بالأجزاء: الأجزاء المكتملة محفوظة محلياً، فإعادة التشغيل ترسل الناقص فقط
+            uploader = ResumableUploader(app)
             try:
-                print("[*] جاري محاولة رفع بدون تتبع التقدم...")
-                upload_params.pop('progress', None)
-                await app.send_video(**upload_params)
-                print("[+] تم الرفع")
-                print("[+] الفيديو يدعم التشغيل المتقطع (يتوقف عند الخروج)")
+                await uploader.send_video(TELEGRAM_CHANNEL, file_path, caption, thumb=upload_params.get('thumb'),
+                                          progress=progress_callback, width=width, height=height,
+                                          duration=duration)
+                
+                elapsed = time.time() - start_time
+                print(f"\n[+] تم الرفع خلال {elapsed:.1f}ثانية")
+                print(f"[+] الفيديو يدعم التشغيل المتقطع (يتوقف عند الخروج)")
                 return True
-            except Exception as e2:
-                print(f"[!] فشل الرفع مرة أخرى: {e2}")
-                return False
+                
+            except FloodWait as e:
+                print(f"\n[*] انتظر {e.value} ثانية...")
+                FLOODWAIT_SECONDS.inc(e.value)
+                # المحاولة التالية تفتح حصتها من جديد
+                upload_stream.close()
+                with tracing.span('floodwait', seconds=e.value):
+                    await asyncio.sleep(e.value)
+                return await upload_video_to_channel(file_path, caption, thumbnail_path, turn)
+                
+            except Exception as e:
+                print(f"\n[!] خطأ في الرفع: {e}")
+                
+                # محاولة بدون progress callback ولكن مع نفس الإعدادات
+                try:
+                    print("[*] جاري محاولة رفع بدون تتبع التقدم...")
+                    await uploader.send_video(TELEGRAM_CHANNEL, file_path, caption, thumb=upload_params.get('thumb'),
+                                              width=width, height=height, duration=duration)
+                    print("[+] تم الرفع")
+                    print("[+] الفيديو يدعم التشغيل المتقطع (يتوقف عند الخروج)")
+                    return True
+                except Exception as e2:
+                    print(f"[!] فشل الرفع مرة أخرى: {e2}")
+                    return False
+        finally:
+            upload_stream.close()
         
     except Exception as e:
         print(f"[!] خطأ غير متوقع في الرفع: {e}")
@@ -465,47 +519,58 @@ async def upload_video_to_channel(file_path, caption, thumbnail_path=None):
 
 # ===== EXTRACT VIDEO URL =====
 
-def extract_video_url(episode_num, series_name, season_num):
-    """استخراج رابط الفيديو"""
+def episode_series_pattern(series_name, season_num):
+    """نمط رابط حلقات الموسم (بدون رقم الحلقة)"""
+    if season_num > 1:
+        return f"modablaj-{series_name}-episode-s{season_num:02d}e"
+    return f"modablaj-{series_name}-episode-"
+
+@traced('resolve')
+def extract_video_url(episode_num, series_name, season_num, episode_url=None):
+    """استخراج روابط الفيديو من كل الخوادم مرتبة من الأسرع"""
     try:
-        # بناء الرابط
-        if season_num > 1:
-            base_url = f"https://x.3seq.com/video/modablaj-{series_name}-episode-s{season_num:02d}e{episode_num:02d}"
+        if episode_url:
+            # الرابط النهائي معروف من قائمة الحلقات - مباشرة إلى صفحة watch
+            watch_url = episode_url.rstrip('/') + '/?do=watch'
+            print(f"[*] الرابط: {episode_url}")
         else:
-            base_url = f"https://x.3seq.com/video/modablaj-{series_name}-episode-{episode_num:02d}"
-        
-        print(f"[*] الرابط: {base_url}")
-        
-        # جلب الصفحة
-        response = requests.get(base_url, headers=HEADERS, timeout=20)
-        if response.status_code != 200:
-            return None, f"فشل جلب الصفحة: {response.status_code}"
-        
-        # استخراج رابط watch
-        watch_match = re.search(r'href=["\']([^"\']+episode[^"\']+\?do=watch)["\']', response.text)
-        if watch_match:
-            watch_url = watch_match.group(1)
-            if watch_url.startswith('//'):
-                watch_url = 'https:' + watch_url
-            elif watch_url.startswith('/'):
-                watch_url = 'https://x.3seq.com' + watch_url
-        else:
-            watch_url = f"{base_url}-yvra/?do=watch"
+            # بناء الرابط
+            base_url = f"https://x.3seq.com/video/{episode_series_pattern(series_name, season_num)}{episode_num:02d}"
+            
+            print(f"[*] الرابط: {base_url}")
+            
+            # جلب الصفحة
+            with RESOLVE_SECONDS.time(hop='episode'):
+                response = requests.get(base_url, headers=HEADERS, timeout=20)
+            if response.status_code != 200:
+                return None, f"فشل جلب الصفحة: {response.status_code}"
+            
+            # استخراج رابط watch
+            watch_match = re.search(r'href=["\']([^"\']+episode[^"\']+\?do=watch)["\']', response.text)
+            if watch_match:
+                watch_url = watch_match.group(1)
+                if watch_url.startswith('//'):
+                    watch_url = 'https:' + watch_url
+                elif watch_url.startswith('/'):
+                    watch_url = 'https://x.3seq.com' + watch_url
+            else:
+                # الرابط النهائي بعد التحويل بدلاً من تخمين اللاحقة
+                watch_url = response.url.split('?')[0].rstrip('/') + '/?do=watch'
         
         # جلب صفحة watch
-        response = requests.get(watch_url, headers=HEADERS, timeout=20)
-        iframe_match = re.search(r'<iframe[^>]+src="([^"]+)"', response.text)
+        with RESOLVE_SECONDS.time(hop='watch'):
+            response = requests.get(watch_url, headers=HEADERS, timeout=20)
+        candidates = collect_stream_candidates(response.text, watch_url)
         
-        if not iframe_match:
+        if not candidates:
             return None, "لم يتم العثور على رابط الفيديو"
         
-        video_url = iframe_match.group(1)
-        if video_url.startswith('//'):
-            video_url = 'https:' + video_url
-        elif video_url.startswith('/'):
-            video_url = 'https://v.vidsp.net' + video_url
+        # فحص كل الخوادم بالتوازي وترتيبها حسب السرعة
+        mirrors = race_mirrors(candidates)
+        if not mirrors:
+            return None, "كل الخوادم لا تستجيب"
         
-        return video_url, "تم استخراج الرابط"
+        return [m['url'] for m in mirrors], f"تم استخراج {len(mirrors)} خادم"
         
     except requests.exceptions.Timeout:
         return None, "انتهت مهلة الاتصال"
@@ -514,8 +579,14 @@ def extract_video_url(episode_num, series_name, season_num):
 
 # ===== PROCESS EPISODE =====
 
-async def process_episode(episode_num, series_name, series_name_arabic, season_num, download_dir):
-    """معالجة حلقة واحدة"""
+@traced('episode')
+async def process_episode(episode_num, series_name, series_name_arabic, season_num, download_dir, episode_url=None,
+                          upload_turn=None, batch=None):
+    """
+    معالجة حلقة واحدة (كل المراحل الحاجزة في خيوط، لا تُجمد حلقة الأحداث)
+    upload_turn: حدث ينتظره الرفع حتى تُنشر الحلقات بالترتيب رغم معالجتها معاً
+    batch: قائمة لنشر الموسم دفعة واحدة - تُضاف إليها الحلقة بدلاً من رفعها الآن
+    """
     print(f"\n{'-'*50}")
     print(f"الحلقة {episode_num:02d}")
     print('-'*50)
@@ -523,45 +594,95 @@ async def process_episode(episode_num, series_name, series_name_arabic, season_n
     temp_file = os.path.join(download_dir, f"temp_{episode_num:02d}.mp4")
     final_file = os.path.join(download_dir, f"{series_name_arabic}_S{season_num:02d}_E{episode_num:02d}.mp4")
     thumbnail_file = os.path.join(download_dir, f"thumb_{episode_num:02d}.jpg")
+    caption = f"{series_name_arabic} الموسم {season_num} الحلقة {episode_num}"
+    
+    if batch is not None and PublishedLog().has(TELEGRAM_CHANNEL, caption):
+        # نُشرت مع مجموعة سابقة قبل فشل بقية الموسم - لا تنزيل ولا نشر مرة أخرى
+        return True, "منشورة سابقاً مع الموسم"
+    
+    # رفع سابق لم يكتمل لهذا الملف بعينه: الاحتفاظ به - إعادة تنزيله وضغطه تغير الملف فتبطل الأجزاء المرفوعة
+    resume_upload = batch is None and await run_blocking(pending_upload, final_file)
     
     # تنظيف الملفات القديمة
-    for f in [temp_file, final_file, thumbnail_file]:
+    for f in [temp_file] if resume_upload else [temp_file, final_file, thumbnail_file]:
         if os.path.exists(f):
             os.remove(f)
     
     try:
-        # 1. استخراج رابط الفيديو
-        print("[*] جاري استخراج رابط الفيديو...")
-        video_url, message = extract_video_url(episode_num, series_name, season_num)
-        
-        if not video_url:
-            return False, message
-        
-        print(f"[+] {message}")
-        
-        # 2. تنزيل الفيديو
-        print("[*] بدء تنزيل الفيديو...")
-        if not download_video(video_url, temp_file):
-            return False, "فشل تنزيل الفيديو"
-        
-        # 3. إنشاء صورة مصغرة 16:9 من الفيديو الأصلي
-        print("[*] إنشاء صورة مصغرة 16:9...")
-        create_thumbnail_16_9(temp_file, thumbnail_file)
-        
-        # 4. ضغط الفيديو إلى 240p
-        print("\n[*] بدء ضغط الفيديو إلى 240p...")
-        if not compress_video_240p_simple(temp_file, final_file, crf=28):
-            # إذا فشل الضغط، استخدم الملف الأصلي
-            print("[!] فشل الضغط، استخدام الملف الأصلي")
-            shutil.copy2(temp_file, final_file)
+        if resume_upload:
+            print(f"[*] رفع سابق لم يكتمل ({resume_upload} جزء) - استئنافه بدون تنزيل أو ضغط")
+            if not os.path.exists(thumbnail_file):
+                await run_blocking(create_thumbnail_16_9, final_file, thumbnail_file)
+        else:
+            source_key = episode_key(episode_series_pattern(series_name, season_num), episode_num)
+            cached = get_cache().sources(source_key)
+            if cached:
+                # المصدر منزل سابقاً (إعادة ترميز أو إعادة محاولة) - بدون أي طلب شبكة
+                print(f"[*] المصدر من الذاكرة ({cached[0]['height'] or '?'}p)")
+                if not await run_blocking(get_cache().materialize, cached[0], temp_file):
+                    cached = []
+            if not cached:
+                # 1. استخراج رابط الفيديو
+                print("[*] جاري استخراج رابط الفيديو...")
+                video_urls, message = await run_blocking(extract_video_url, episode_num, series_name, season_num,
+                                                         episode_url)
+                
+                if not video_urls:
+                    return False, message
+                
+                print(f"[+] {message}")
+                
+                # 2. تنزيل الفيديو من الأسرع، مع التبديل للخادم التالي عند البطء
+                print("[*] بدء تنزيل الفيديو...")
+                fmt = None
+                for index, video_url in enumerate(video_urls):
+                    watch = RateWatch() if index < len(video_urls) - 1 else None
+                    fmt = await run_blocking(download_video, video_url, temp_file, watch)
+                    if fmt:
+                        break
+                    print("[*] التبديل إلى الخادم التالي...")
+                if not fmt:
+                    return False, "فشل تنزيل الفيديو"
+                
+                # حفظ المصدر قبل حذف temp_file (رابط صلب، بدون نسخ)
+                height = fmt.get('height') if isinstance(fmt, dict) else None
+                if not height:
+                    height = (await run_blocking(get_video_dimensions, temp_file))[1]
+                await run_blocking(get_cache().add_source, source_key, temp_file, height, link=True)
+            
+            # 3. إنشاء صورة مصغرة 16:9 من الفيديو الأصلي
+            print("[*] إنشاء صورة مصغرة 16:9...")
+            await run_blocking(create_thumbnail_16_9, temp_file, thumbnail_file)
+            
+            # 4. ضغط الفيديو إلى 240p (مع نسخ أرشيف إذا حدد المسلسل عدة دقات - فك ترميز واحد للكل)
+            print("\n[*] بدء ضغط الفيديو إلى 240p...")
+            ladder = ladder_for(episode_series_pattern(series_name, season_num))
+            if len(ladder) > 1:
+                # النسخة المرفوعة بملف التشغيل، ونسخ الأرشيف كما حددها المسلسل
+                # (كل المخرجات MP4 عادي: FHRS_MP4_MODE=fragmented لا يصلح للنسخة المرفوعة)
+                ladder[0] = streaming_rung(ladder[0])
+                compressed = await run_blocking(encode_ladder, temp_file, ladder_outputs(final_file, ladder),
+                                                mode=UPLOAD_MP4_MODE, pool=ENCODE_POOL)
+            else:
+                compressed = await run_blocking(compress_video_240p_simple, temp_file, final_file, crf=28,
+                                                codec=ladder[0]['codec'], pool=ENCODE_POOL)
+            if not compressed:
+                # إذا فشل الضغط، استخدم الملف الأصلي
+                print("[!] فشل الضغط، استخدام الملف الأصلي")
+                await run_blocking(shutil.copy2, temp_file, final_file)
+            # المصدر لم يعد مطلوباً (الصورة المصغرة والنسخة جاهزتان): حذفه الآن بدلاً من بعد الرفع
+            await run_blocking(commit, final_file, temp_file)
         
         # 5. رفع الفيديو - تعليق بسيط بدون رموز
-        caption = f"{series_name_arabic} الموسم {season_num} الحلقة {episode_num}"
-        
         # استخدام الصورة المصغرة إذا كانت موجودة
         thumb_to_use = thumbnail_file if os.path.exists(thumbnail_file) else None
         
-        if await upload_video_to_channel(final_file, caption, thumb_to_use):
+        if batch is not None:
+            # الصورة المصغرة تبقى حتى النشر
+            batch.append({'episode': episode_num, 'file_path': final_file, 'caption': caption, 'thumb': thumb_to_use})
+            return True, "جاهزة للنشر مع الموسم"
+        
+        if await upload_video_to_channel(final_file, caption, thumb_to_use, upload_turn):
             return True, "تم الرفع بنجاح مع دعم التشغيل المتقطع"
         else:
             return True, "تم التنزيل فقط (فشل الرفع)"
@@ -576,16 +697,67 @@ async def process_episode(episode_num, series_name, series_name_arabic, season_n
                 os.remove(temp_file)
             except:
                 pass
-        if os.path.exists(thumbnail_file):
+        if batch is None and os.path.exists(thumbnail_file):
             try:
                 os.remove(thumbnail_file)
             except:
                 pass
 
+# ===== BATCH PUBLISH =====
+
+@traced('publish_season')
+async def publish_season(items):
+    """
+    نشر حلقات جاهزة دفعة واحدة: رفع كل الملفات بالتوازي ثم مجموعة وسائط لكل 10 حلقات بالترتيب
+    (استدعاء نشر واحد لكل 10 بدلاً من send_video لكل حلقة - ضغط أقل على حدود FloodWait)
+    """
+    items = sorted(items, key=lambda item: item['episode'])
+    if not app or not items:
+        return False
+    pool = upload_pool or await UploadPool.open(app, TELEGRAM_CHANNEL, 1, flood_wait=FloodWait)
+    published = PublishedLog()
+    bandwidth = get_manager()
+    streams = []
+    entries = []
+    try:
+        for item in items:
+            path = item['file_path']
+            if not await run_blocking(ensure_streamable, path):
+                print(f"[!] تعذر نقل moov إلى بداية {os.path.basename(path)} - قد يتأخر التشغيل")
+            width, height = await run_blocking(get_video_dimensions, path)
+            stream = bandwidth.open_stream('upload', TELEGRAM_CHANNEL)
+            streams.append(stream)
+            entries.append({
+                'file_path': path, 'caption': item['caption'], 'thumb': item['thumb'],
+                'progress': lambda current, total, stream=stream: stream.throttle_total_async(current),
+                'supports_streaming': True, 'width': width, 'height': height,
+                'duration': await run_blocking(get_video_duration, path),
+            })
+        total = sum(os.path.getsize(item['file_path']) for item in items) / (1024 * 1024)
+        groups = -(-len(items) // MEDIA_GROUP_SIZE)
+        print(f"\n[*] نشر {len(items)} حلقات ({total:.1f}MB) في {groups} مجموعات عبر {pool.size} جلسات...")
+        start_time = time.time()
+        await pool.publish_group(entries, published=published)
+        print(f"[+] تم النشر خلال {time.time() - start_time:.1f}ثانية")
+        return True
+    except Exception as e:
+        posted = sum(published.has(TELEGRAM_CHANNEL, item['caption']) for item in items)
+        print(f"[!] فشل نشر الموسم: {e} (نُشرت {posted}/{len(items)} حلقات، إعادة التشغيل تكمل الباقي فقط)")
+        return False
+    finally:
+        for stream in streams:
+            stream.close()
+        if pool is not upload_pool:
+            await pool.close()
+        for item in items:
+            if item['thumb'] and os.path.exists(item['thumb']):
+                os.remove(item['thumb'])
+
 # ===== MAIN FUNCTION =====
 
 async def main():
     """الدالة الرئيسية"""
+    supervisor.install()
     print("="*50)
     print("Telegram Video Downloader & Uploader - Working Version")
     print("="*50)
@@ -593,11 +765,10 @@ async def main():
     # التحقق من التبعيات
     print("\n[*] التحقق من التبعيات...")
     
-    # FFmpeg
-    try:
-        subprocess.run(['ffmpeg', '-version'], capture_output=True, check=True)
+    # FFmpeg (فحص محفوظ في الذاكرة)
+    if tool_available('ffmpeg'):
         print("  [+] ffmpeg")
-    except:
+    else:
         print("  [!] ffmpeg غير مثبت")
         print("  [*] جاري التثبيت...")
         try:
@@ -607,20 +778,26 @@ async def main():
             print("  [!] فشل التثبيت، يرجى تثبيته يدوياً")
             return
     
-    # yt-dlp
-    try:
-        import yt_dlp
+    # yt-dlp (بدون استيراده الآن)
+    if module_available('yt_dlp'):
         print("  [+] yt-dlp")
-    except:
+    else:
         print("  [*] تثبيت yt-dlp...")
-        subprocess.run([sys.executable, '-m', 'pip', 'install', 'yt-dlp', '-q'], check=True)
+        ensure_module('yt_dlp', ['yt-dlp'])
         print("  [+] تم التثبيت")
     
+    start_exporter()
+    
     # إعداد Telegram
     if not await setup_telegram():
         print("[!] فشل إعداد Telegram")
         return
     
+    global upload_pool
+    if UPLOAD_SESSIONS > 1:
+        upload_pool = await UploadPool.open(app, TELEGRAM_CHANNEL, UPLOAD_SESSIONS, flood_wait=FloodWait)
+        print(f"[+] جلسات الرفع: {upload_pool.size}")
+    
     # إدخال المعلومات
     print("\n" + "="*50)
     print("معلومات المسلسل")
@@ -637,6 +814,9 @@ async def main():
         print("[!] أرقام غير صالحة")
         return
     
+    # نشر الموسم كاملاً بعد اكتماله: مجموعات وسائط من 10 حلقات
+    batch = [] if input("نشر الموسم دفعة واحدة بعد اكتماله؟ [y/N]: ").strip().lower() in ('y', 'yes', 'ن', 'نعم') else None
+    
     if start_ep > end_ep:
         print("[!] الحلقة الأولى يجب أن تكون أصغر من الأخيرة")
         return
@@ -654,36 +834,72 @@ async def main():
     print(f"المجلد: {download_dir}")
     print("[*] سيتم رفع الفيديوهات مع دعم التشغيل المتقطع (يتوقف عند الخروج)")
     
-    # معالجة الحلقات
+    # جلب روابط كل الحلقات من صفحة الموسم مرة واحدة (الموجودة في ذاكرة المصادر لا تحتاجها)
+    series_pattern = episode_series_pattern(series_name, season_num)
+    cache = get_cache()
+    wanted = [ep for ep in range(start_ep, end_ep + 1) if not cache.sources(episode_key(series_pattern, ep), count=False)]
+    episode_urls, missing = resolve_episode_urls(
+        "https://x.3seq.com/video", series_pattern, wanted
+    ) if wanted else ({}, [])
+    
+    # معالجة الحلقات: عدة حلقات معاً، والرفع بترتيب الحلقات
     successful = 0
-    failed = []
+    failed = list(missing)
     total = end_ep - start_ep + 1
+    slots = asyncio.Semaphore(EPISODES_IN_FLIGHT)
+    print(f"[*] حلقات قيد المعالجة معاً: {EPISODES_IN_FLIGHT}")
     
+    async def run_episode(episode_num, current, upload_turn, uploaded):
+        nonlocal successful
+        try:
+            print(f"\n[{current}/{total}] الحلقة {episode_num:02d}")
+            print("-" * 40)
+            
+            start_time = time.time()
+            with tracing.track(f"الحلقة {episode_num:02d}"):
+                success, message = await process_episode(
+                    episode_num, series_name, series_name_arabic, season_num, download_dir,
+                    episode_urls.get(episode_num), upload_turn, batch
+                )
+            
+            elapsed = time.time() - start_time
+            record_episode(elapsed, success)
+            
+            if success:
+                successful += 1
+                print(f"[+] {episode_num:02d}: {message} ({elapsed/60:.1f} دقيقة)")
+            else:
+                failed.append(episode_num)
+                print(f"[!] {episode_num:02d}: {message}")
+        finally:
+            # الحلقة التالية ترفع بعد هذه حتى لو فشلت
+            uploaded.set()
+            slots.release()
+    
+    tasks = []
+    upload_turn = None
     for episode_num in range(start_ep, end_ep + 1):
         current = episode_num - start_ep + 1
+        if episode_num in missing:
+            print(f"[!] {episode_num:02d}: الحلقة غير موجودة")
+            continue
         
-        print(f"\n[{current}/{total}] الحلقة {episode_num:02d}")
-        print("-" * 40)
-        
-        start_time = time.time()
-        success, message = await process_episode(
-            episode_num, series_name, series_name_arabic, season_num, download_dir
-        )
-        
-        elapsed = time.time() - start_time
-        
-        if success:
-            successful += 1
-            print(f"[+] {episode_num:02d}: {message} ({elapsed/60:.1f} دقيقة)")
-        else:
-            failed.append(episode_num)
-            print(f"[!] {episode_num:02d}: {message}")
-        
-        # انتظار بين الحلقات
-        if episode_num < end_ep:
+        await slots.acquire()
+        if tasks:
+            # انتظار بين بدء الحلقات
             wait = 3
             print(f"[*] انتظار {wait} ثواني...")
             await asyncio.sleep(wait)
+        uploaded = asyncio.Event()
+        tasks.append(asyncio.create_task(run_episode(episode_num, current, upload_turn, uploaded)))
+        upload_turn = uploaded
+    
+    await asyncio.gather(*tasks)
+    failed.sort()
+    
+    if batch:
+        if not await publish_season(batch):
+            print("[!] الحلقات جاهزة في المجلد ولم تُنشر")
     
     # النتائج
     print(f"\n{'='*50}")
@@ -700,10 +916,13 @@ async def main():
     print("انتهى العمل")
     
     # إغلاق التطبيق
+    if upload_pool is not None:
+        await upload_pool.close()
     if app:
         await app.stop()
 
 if __name__ == "__main__":
+    tracing.from_argv()
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+"""
+مقاييس العملية (عدادات، مقاييس لحظية، توزيعات) بصيغة Prometheus النصية
+للتخطيط للسعة: زمن كل خطوة في استخراج الروابط، بايتات وسرعة التنزيل والرفع، fps وسرعة الترميز،
+انتظار FloodWait، نسبة إصابة الذاكرة، وأطوال الطوابير
+التصدير إلى ملف (FHRS_METRICS_FILE، مثل textfile collector في node_exporter) أو /metrics محلي (FHRS_METRICS_PORT)
+"""
+
+import os
+import sys
+import math
+import time
+import atexit
+import threading
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+def parse_port(value):
+    """'9100' -> 9100 (فارغ أو غير صالح أو خارج 1..65535 -> 0 = بدون خادم /metrics)"""
+    try:
+        port = int(value or 0)
+    except (TypeError, ValueError):
+        port = -1
+    if not 0 <= port <= 65535:
+        print(f"[!] FHRS_METRICS_PORT غير صالح: {value} - بدون خادم /metrics", file=sys.stderr)
+        return 0
+    return port
+
+
+METRICS_FILE = os.environ.get('FHRS_METRICS_FILE', '')
+METRICS_PORT = parse_port(os.environ.get('FHRS_METRICS_PORT'))
+WRITE_INTERVAL = 15        # ثوانٍ بين كل كتابة للملف
+PREFIX = 'fhrs_'
+
+# حدود التوزيعات
+SECONDS_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+MBPS_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 25, 50, 100)
+FPS_BUCKETS = (5, 10, 25, 50, 100, 200, 400, 800, 1600)
+SPEED_BUCKETS = (0.25, 0.5, 1, 2, 4, 8, 16, 32, 64, 128)
+
+
+def _number(value):
+    if value == math.inf:
+        return '+Inf'
+    if value == -math.inf:
+        return '-Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"') for _, value in pairs)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + '}'
+
+
+class Metric:
+    """مقياس واحد بقيم منفصلة لكل مجموعة تسميات (labels)"""
+
+    kind = 'untyped'
+
+    def __init__(self, name, help_text):
+        self.name = PREFIX + name
+        self.help = help_text
+        self.values = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _key(labels):
+        return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def samples(self):
+        """[(الاسم، التسميات، القيمة)]"""
+        with self.lock:
+            return [(self.name, key, value) for key, value in sorted(self.values.items())]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines += [f"{name}{_labels(key)} {_number(value)}" for name, key, value in self.samples()]
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        if amount < 0:
+            raise ValueError("العداد لا ينقص")
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self.lock:
+            return self.values.get(self._key(labels), 0)
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels):
+        with self.lock:
+            return self.values.get(self._key(labels), 0)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, buckets=SECONDS_BUCKETS):
+        super().__init__(name, help_text)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state['counts'][index] += 1
+                    break
+            state['sum'] += value
+            state['count'] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """with HISTOGRAM.time(hop='embed'): ... (المدة تُسجل حتى عند الخطأ)"""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - start, **labels)
+
+    def samples(self):
+        with self.lock:
+            items = sorted((key, dict(state, counts=list(state['counts']))) for key, state in self.values.items())
+        samples = []
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state['counts']):
+                cumulative += count
+                samples.append((self.name + '_bucket', key + (('le', _number(bound)),), cumulative))
+            samples.append((self.name + '_sum', key, state['sum']))
+            samples.append((self.name + '_count', key, state['count']))
+        return samples
+
+    def count(self, **labels):
+        with self.lock:
+            state = self.values.get(self._key(labels))
+            return state['count'] if state else 0
+
+
+class Registry:
+    """كل مقاييس العملية؛ نفس الاسم يرجع نفس المقياس"""
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _get(self, cls, name, *args):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, *args)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"المقياس {name} مسجل بنوع آخر")
+            return metric
+
+    def counter(self, name, help_text):
+        return self._get(Counter, name, help_text)
+
+    def gauge(self, name, help_text):
+        return self._get(Gauge, name, help_text)
+
+    def histogram(self, name, help_text, buckets=SECONDS_BUCKETS):
+        return self._get(Histogram, name, help_text, buckets)
+
+    def render(self):
+        with self.lock:
+            metrics = [self.metrics[name] for name in sorted(self.metrics)]
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """السجل المشترك للعملية"""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = Registry()
+        return _registry
+
+
+# ===== مقاييس الأداة =====
+
+RESOLVE_SECONDS = get_registry().histogram(
+    'resolve_seconds', 'Latency of each hop from series page to media playlist')
+TRANSFER_BYTES = get_registry().counter(
+    'transfer_bytes_total', 'Bytes moved through the shared bandwidth budget')
+TRANSFER_MBPS = get_registry().histogram(
+    'transfer_mbps', 'Average MB/s of each finished download or upload stream', MBPS_BUCKETS)
+ACTIVE_STREAMS = get_registry().gauge(
+    'active_streams', 'Open download and upload streams')
+FFMPEG_SECONDS = get_registry().histogram(
+    'ffmpeg_seconds', 'Wall time of supervised ffmpeg runs')
+ENCODE_FPS = get_registry().histogram(
+    'encode_fps', 'Average frames per second of finished ffmpeg runs', FPS_BUCKETS)
+ENCODE_SPEED = get_registry().histogram(
+    'encode_speed_ratio', 'Seconds of video processed per wall-clock second', SPEED_BUCKETS)
+FLOODWAIT_SECONDS = get_registry().counter(
+    'floodwait_seconds_total', 'Seconds spent waiting on Telegram FloodWait')
+UPLOAD_PARTS = get_registry().counter(
+    'upload_parts_total', 'Telegram file parts sent or skipped on resume')
+CACHE_REQUESTS = get_registry().counter(
+    'cache_requests_total', 'Source cache lookups by kind and result')
+QUEUE_DEPTH = get_registry().gauge(
+    'queue_depth', 'Jobs waiting in each queue')
+EPISODE_SECONDS = get_registry().histogram(
+    'episode_seconds', 'Wall time per finished episode')
+EPISODES = get_registry().counter(
+    'episodes_total', 'Finished episodes by result')
+
+
+def record_episode(seconds, success):
+    result = 'success' if success else 'failure'
+    EPISODES.inc(result=result)
+    EPISODE_SECONDS.observe(seconds, result=result)
+
+
+# ===== التصدير =====
+
+def write_textfile(path, registry=None):
+    """كتابة ذرية (القارئ لا يرى ملفاً نصف مكتوب)"""
+    registry = registry or get_registry()
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(registry.render())
+    os.replace(tmp, path)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """GET /metrics"""
+
+    registry = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+        body = (self.registry or get_registry()).render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class MetricsServer:
+    """with MetricsServer(port) as server: server.url (المنفذ 0 = أي منفذ متاح)"""
+
+    def __init__(self, port=METRICS_PORT, host='127.0.0.1', registry=None):
+        handler = type('Handler', (MetricsHandler,), {'registry': registry})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.url = f"http://{host}:{self.server.server_address[1]}/metrics"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True, name='metrics-http').start()
+        return self
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+_exporter = None
+
+
+def start_exporter(path=METRICS_FILE, port=METRICS_PORT):
+    """تشغيل التصدير المضبوط في البيئة (مرة واحدة للعملية؛ لا شيء إذا لم يُضبط)"""
+    global _exporter
+    if _exporter is not None or not (path or port):
+        return _exporter
+    _exporter = {'path': path, 'server': None}
+    if port:
+        try:
+            _exporter['server'] = MetricsServer(port, os.environ.get('FHRS_METRICS_HOST', '127.0.0.1')).start()
+            print(f"[*] المقاييس: {_exporter['server'].url}")
+        except OSError as e:
+            print(f"[!] تعذر فتح منفذ المقاييس {port}: {e}")
+    if path:
+        def write():
+            try:
+                write_textfile(path)
+            except OSError as e:
+                print(f"[!] تعذر كتابة المقاييس: {e}")
+
+        def loop():
+            while True:
+                time.sleep(WRITE_INTERVAL)
+                write()
+
+        threading.Thread(target=loop, daemon=True, name='metrics-file').start()
+        atexit.register(write)
+        print(f"[*] المقاييس: {path} (كل {WRITE_INTERVAL}ث)")
+    return _exporter
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == '--example':
+        with MetricsServer(0) as server:
+            RESOLVE_SECONDS.observe(0.3, hop='watch')
+            TRANSFER_BYTES.inc(5 * 1024 * 1024, direction='download')
+            CACHE_REQUESTS.inc(kind='segment', result='hit')
+            import urllib.request
+            print(urllib.request.urlopen(server.url).read().decode('utf-8'))
+    else:
+        print("FHRS_METRICS_FILE=/path/fhrs.prom أو FHRS_METRICS_PORT=9464 ثم تشغيل أي أداة")
+        print("الاستخدام: python metrics.py --example")
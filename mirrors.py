@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+جمع كل خوادم الفيديو في صفحة المشاهدة، فحصها بالتوازي، واختيار الأسرع مع التبديل عند البطء
+"""
+
+import re
+import time
+import concurrent.futures
+from urllib.parse import urljoin
+
+import requests
+
+from episodes import HEADERS
+from hls import load_playlist
+from metrics import RESOLVE_SECONDS
+from tracing import traced
+
+MIN_MIRROR_RATE = 100 * 1024  # أقل سرعة مقبولة (بايت/ثانية) قبل التبديل لخادم آخر
+SLOW_GRACE = 20               # ثوانٍ قبل الحكم على الخادم بالبطء
+PROBE_BYTES = 256 * 1024      # حجم طلب Range لقياس السرعة
+PROBE_TIMEOUT = 8
+
+M3U8_RE = re.compile(r'https?://[^\s"\'<>]+\.m3u8[^\s"\'<>]*')
+EMBED_ID_RE = re.compile(r'embed-([a-z0-9]+)\.html', re.IGNORECASE)
+SERVER_ATTR_RE = re.compile(
+    r'<(?:a|li|button|div|span)[^>]*class=["\'][^"\']*(?:server|watch)[^"\']*["\'][^>]*>',
+    re.IGNORECASE
+)
+URL_ATTR_RE = re.compile(r'(?:href|data-url|data-src|data-embed|data-link)=["\']([^"\']+)["\']', re.IGNORECASE)
+IFRAME_RE = re.compile(r'<iframe[^>]+?(?:data-)?src=["\']([^"\']+)["\']', re.IGNORECASE)
+
+
+class SlowMirror(Exception):
+    """الخادم أبطأ من الحد الأدنى - يجب التبديل"""
+
+
+def normalize_url(url, page_url):
+    url = url.strip()
+    if url.startswith('//'):
+        return 'https:' + url
+    return urljoin(page_url, url)
+
+
+def collect_stream_candidates(html, page_url):
+    """كل روابط البث المرشحة بالترتيب: m3u8 مباشر، iframes، روابط embed في JS، أزرار الخوادم"""
+    candidates = []
+
+    def add(url):
+        url = normalize_url(url, page_url)
+        if url.startswith('http') and url not in candidates:
+            candidates.append(url)
+
+    for match in M3U8_RE.findall(html):
+        add(match)
+    for src in IFRAME_RE.findall(html):
+        if 'vidsp.net' in src or 'embed' in src or '.m3u8' in src:
+            add(src)
+    for embed_id in EMBED_ID_RE.findall(html):
+        add(f"https://v.vidsp.net/embed-{embed_id}.html")
+    for tag in SERVER_ATTR_RE.findall(html):
+        for href in URL_ATTR_RE.findall(tag):
+            if 'vidsp.net' in href or 'embed' in href or '.m3u8' in href:
+                add(href)
+    return candidates
+
+
+def resolve_stream_url(candidate, session, timeout=PROBE_TIMEOUT):
+    """رابط m3u8 من صفحة embed (أو الرابط نفسه ليتولاه yt-dlp)"""
+    if '.m3u8' in candidate:
+        return candidate
+    with RESOLVE_SECONDS.time(hop='embed'):
+        response = session.get(candidate, headers=HEADERS, timeout=timeout)
+    match = M3U8_RE.search(response.text)
+    return match.group(0) if match else candidate
+
+
+def probe_mirror(candidate, session=None):
+    """قياس زمن الاستجابة والسرعة بطلب قائمة التشغيل وجزء صغير من أول مقطع"""
+    session = session or requests.Session()
+    result = {'candidate': candidate, 'url': candidate, 'ok': False, 'latency': None, 'throughput': 0.0}
+    start = time.monotonic()
+    try:
+        url = resolve_stream_url(candidate, session)
+        result['url'] = url
+        if '.m3u8' not in url:
+            # صفحة embed بدون m3u8 (yt-dlp سيتولاها) - نقيس زمن الاستجابة فقط
+            result['latency'] = time.monotonic() - start
+            result['ok'] = True
+            return result
+
+        playlist = load_playlist(url, session, timeout=PROBE_TIMEOUT)
+        result['playlist'] = playlist
+        result['latency'] = time.monotonic() - start
+        first = playlist['init'] or (playlist['segments'][0]['url'] if playlist['segments'] else None)
+        if not first:
+            return result
+
+        headers = dict(HEADERS, Range=f'bytes=0-{PROBE_BYTES - 1}')
+        t0 = time.monotonic()
+        response = session.get(first, headers=headers, timeout=PROBE_TIMEOUT)
+        response.raise_for_status()
+        elapsed = max(time.monotonic() - t0, 1e-3)
+        result['throughput'] = len(response.content) / elapsed
+        result['ok'] = True
+    except Exception as e:
+        result['error'] = str(e)[:100]
+    return result
+
+
+@traced()
+def race_mirrors(candidates, session=None):
+    """فحص كل الخوادم بالتوازي وإرجاعها مرتبة من الأسرع (الفاشلة تُستبعد)"""
+    if not candidates:
+        return []
+    if len(candidates) == 1:
+        return [probe_mirror(candidates[0], session)]
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(8, len(candidates))) as pool:
+        results = list(pool.map(lambda c: probe_mirror(c, session), candidates))
+
+    ranked = sorted(
+        (r for r in results if r['ok']),
+        key=lambda r: (-r['throughput'], r['latency'] if r['latency'] is not None else float('inf'))
+    )
+    for r in ranked:
+        print(f"[*] خادم: {r['url'][:60]}... {r['throughput'] / 1024:.0f}KB/s، {r['latency'] or 0:.2f}ث")
+    return ranked
+
+
+class RateWatch:
+    """مراقبة السرعة أثناء التنزيل ورفع SlowMirror إذا بقيت أقل من الحد"""
+
+    def __init__(self, min_rate=MIN_MIRROR_RATE, grace=SLOW_GRACE):
+        self.min_rate = min_rate
+        self.grace = grace
+        self.samples = []
+
+    def reset(self):
+        """بدء القياس من جديد (بعد توقف مقصود، مثل امتلاء القرص، لا يعني أن الخادم بطيء)"""
+        self.samples = []
+
+    def feed(self, total_bytes):
+        now = time.monotonic()
+        self.samples.append((now, total_bytes))
+        # نافذة متحركة بطول grace
+        while len(self.samples) > 2 and now - self.samples[1][0] >= self.grace:
+            self.samples.pop(0)
+        first_time, first_bytes = self.samples[0]
+        if now - first_time >= self.grace:
+            rate = (total_bytes - first_bytes) / (now - first_time)
+            if rate < self.min_rate:
+                raise SlowMirror(f"سرعة الخادم {rate / 1024:.0f}KB/s أقل من الحد")
+
+    def ytdl_hook(self, inner=None):
+        def hook(status):
+            if inner:
+                inner(status)
+            if status.get('status') == 'downloading':
+                self.feed(status.get('downloaded_bytes') or 0)
+        return hook
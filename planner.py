@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+تخطيط الموسم: تقدير مدة وحجم كل حلقة (EXTINF، BANDWIDTH، HEAD) عند قبولها وليس للموسم كله مقدماً
+ترتيب الأطول أولاً (LPT) لتقليل زمن الانتهاء، وقبول المهام حسب مساحة القرص والخط
+"""
+
+import time
+import heapq
+import shutil
+import threading
+from contextlib import contextmanager
+
+import requests
+
+import supervisor
+from bandwidth import TOTAL_BANDWIDTH, DOWNLOAD_SHARE
+from episodes import HEADERS
+from tracing import traced
+from storage import get_storage
+
+# عند غياب BANDWIDTH والمدة: معدل افتراضي للمصدر (~1.5Mbit/s)، وحجم نسخة 240p لكل ثانية
+SOURCE_BYTES_PER_SECOND = 192 * 1024
+OUTPUT_BYTES_PER_SECOND = 50 * 1024
+# سرعة التنزيل عند فشل قياس الخادم
+DEFAULT_RATE = 1024 * 1024
+HEAD_SAMPLES = 3
+HEAD_TIMEOUT = 8
+# الروابط الموقعة وقياس سرعة الخوادم لا تبقى صالحة طويلاً: خطة أقدم من هذا تُفحص من جديد عند البدء
+PLAN_TTL = 300
+
+
+def content_length(url, session):
+    try:
+        response = session.head(url, headers=HEADERS, timeout=HEAD_TIMEOUT, allow_redirects=True)
+        return int(response.headers.get('Content-Length') or 0)
+    except (requests.RequestException, ValueError):
+        return 0
+
+
+def estimate_mirror(mirror, session=None):
+    """(المدة بالثواني، الحجم بالبايت، مصدر التقدير) لخادم من race_mirrors"""
+    session = session or requests.Session()
+    playlist = mirror.get('playlist')
+    if playlist:
+        duration = playlist['duration']
+        bandwidth = (playlist.get('variant') or {}).get('bandwidth')
+        if bandwidth and duration:
+            return duration, int(bandwidth / 8 * duration), 'BANDWIDTH'
+        segments = playlist['segments']
+        sizes = [content_length(s['url'], session) for s in segments[:HEAD_SAMPLES]]
+        sizes = [s for s in sizes if s]
+        if sizes:
+            return duration, int(sum(sizes) / len(sizes) * len(segments)), 'HEAD'
+        return duration, int(duration * SOURCE_BYTES_PER_SECOND), 'EXTINF'
+    size = content_length(mirror['url'], session)
+    if size:
+        return size / SOURCE_BYTES_PER_SECOND, size, 'HEAD'
+    return 0.0, 0, ''
+
+
+def job_seconds(job):
+    """
+    الوقت المتوقع للحلقة: التنزيل والضغط يتداخلان (أنبوب HLS -> ffmpeg)، فالأبطأ هو المحدد
+    سرعة الضغط من القياسات السابقة في supervisor
+    """
+    download = 0.0
+    if job['source'] != 'cache':
+        download = job['bytes'] / (job['rate'] or DEFAULT_RATE)
+    return max(download, supervisor.expected_seconds(job['duration'], 'encode'))
+
+
+def plan_episode(episode_num, discover=None, cached=None, session=None):
+    """
+    مهمة حلقة واحدة: {'episode', 'mirrors', 'duration', 'bytes', 'output_bytes', 'rate', 'source', 'seconds'}
+    discover(episode_num) -> خوادم مرتبة من race_mirrors (لا تُستدعى إذا كان المصدر في الذاكرة)
+    بدون discover: مهمة بدون فحص (mirrors=None) - probe_job عند قبولها
+    """
+    job = {'episode': episode_num, 'mirrors': None, 'duration': 0.0, 'bytes': 0, 'rate': 0.0, 'source': ''}
+    if cached:
+        job['bytes'] = cached['size']
+        job['duration'] = cached['size'] / SOURCE_BYTES_PER_SECOND
+        job['source'] = 'cache'
+    elif discover:
+        return probe_job(job, discover, session)
+    return estimated(job)
+
+
+def probe_job(job, discover, session=None):
+    """فحص خوادم المهمة وتقدير مدتها وحجمها الآن (الروابط الموقعة صالحة لمن يبدأ فوراً)"""
+    job.update(mirrors=None, duration=0.0, bytes=0, rate=0.0, source='')
+    mirrors = job['mirrors'] = discover(job['episode'])
+    if mirrors:
+        job['duration'], job['bytes'], job['source'] = estimate_mirror(mirrors[0], session)
+        job['rate'] = mirrors[0].get('throughput') or 0.0
+    return estimated(job)
+
+
+def estimated(job):
+    job['output_bytes'] = int(job['duration'] * OUTPUT_BYTES_PER_SECOND)
+    job['seconds'] = job_seconds(job)
+    job['planned_at'] = time.monotonic()
+    return job
+
+
+def plan_is_stale(job, ttl=PLAN_TTL):
+    """خوادم المهمة فُحصت منذ أكثر من ttl ثانية (المصدر من الذاكرة لا يتقادم)"""
+    return job['source'] != 'cache' and time.monotonic() - job.get('planned_at', 0) > ttl
+
+
+@traced()
+def plan_jobs(episodes, cached=None):
+    """
+    مهام الحلقات بترتيب LPT (الأطول أولاً) بدون أي طلب شبكة
+    cached: {رقم الحلقة: نسخة من ذاكرة المصادر} - مدتها معروفة؛ البقية تُفحص عند قبولها (probe_job)
+    فحص الموسم كله مقدماً يهدر الطلبات ويجعل روابط الحلقات الأخيرة قديمة قبل أن تبدأ
+    """
+    cached = cached or {}
+    return longest_first([plan_episode(ep, cached=cached.get(ep)) for ep in episodes])
+
+
+def longest_first(jobs):
+    return sorted(jobs, key=lambda job: (-job['seconds'], job['episode']))
+
+
+def makespan(jobs, workers):
+    """زمن انتهاء الكل إذا أخذ كل عامل متاح المهمة التالية بهذا الترتيب"""
+    finish = [0.0] * max(1, workers)
+    for job in jobs:
+        heapq.heappush(finish, heapq.heappop(finish) + job['seconds'])
+    return max(finish)
+
+
+def job_disk_bytes(job):
+    """ما تكتبه المهمة على القرص في أسوأ حالة: المصدر (أو نسخته من الذاكرة) والنسخة المضغوطة معاً"""
+    return job['bytes'] + job['output_bytes']
+
+
+def peak_disk(jobs, workers):
+    """أقصى مساحة: كل النسخ النهائية + مصادر أكبر المهام التي قد تعمل معاً"""
+    sources = sorted((job['bytes'] for job in jobs), reverse=True)
+    return sum(job['output_bytes'] for job in jobs) + sum(sources[:workers])
+
+
+def print_plan(jobs, workers, path='.'):
+    unprobed = sum(1 for job in jobs if not job['source'])
+    if unprobed:
+        print(f"[*] {unprobed} حلقات تُفحص خوادمها عند بدئها")
+    jobs = [job for job in jobs if job['source']]
+    if not jobs:
+        return
+    print(f"\n{'الحلقة':<8}{'المدة':>8}{'الحجم':>10}{'التقدير':>10}{'المصدر':>12}")
+    for job in jobs:
+        print(f"{job['episode']:<8}{job['duration'] / 60:>7.1f}د{job['bytes'] / 1024 ** 2:>8.0f}MB"
+              f"{job['seconds'] / 60:>9.1f}د{job['source']:>12}")
+    numeric = makespan(sorted(jobs, key=lambda job: job['episode']), workers)
+    planned = makespan(jobs, workers)
+    print(f"[*] الوقت المتوقع: {planned / 60:.1f} دقيقة ({workers} عمال، بالترتيب الرقمي {numeric / 60:.1f} دقيقة)")
+    free = shutil.disk_usage(path).free
+    print(f"[*] القرص: حتى {peak_disk(jobs, workers) / 1024 ** 3:.1f}GB، المتاح {free / 1024 ** 3:.1f}GB")
+
+
+class Admission:
+    """
+    لا تبدأ مهمة إلا إذا حُجزت لها مساحة القرص (مصدرها ونسختها، storage.py) وبقي لها نصيب من الخط
+    مهمة واحدة تبدأ دائماً عندما لا يعمل شيء (تقدير خاطئ لا يوقف كل شيء)
+    """
+
+    def __init__(self, path='.', bandwidth=None, storage=None):
+        self.storage = storage or get_storage(path)
+        if bandwidth is None:
+            bandwidth = TOTAL_BANDWIDTH * DOWNLOAD_SHARE
+        self.bandwidth = bandwidth
+        self.rate_used = 0.0
+        self.running = 0
+        self.cond = threading.Condition()
+
+    def _fits(self, rate):
+        if not self.running:
+            return True
+        return not self.bandwidth or self.rate_used + rate <= self.bandwidth
+
+    @contextmanager
+    def admit(self, job):
+        """with admission.admit(job) as reservation: ... (reservation.track للملفات التي تكتبها المهمة)"""
+        rate = 0.0 if job['source'] == 'cache' else job['rate'] or DEFAULT_RATE
+        with self.storage.reserve(job_disk_bytes(job), f"الحلقة {job['episode']:02d}") as reservation:
+            with self.cond:
+                if not self._fits(rate):
+                    print(f"[*] الحلقة {job['episode']:02d}: بانتظار نصيب من الخط...")
+                    while not self._fits(rate):
+                        self.cond.wait()
+                self.rate_used += rate
+                self.running += 1
+            try:
+                yield reservation
+            finally:
+                with self.cond:
+                    self.rate_used -= rate
+                    self.running -= 1
+                    self.cond.notify_all()
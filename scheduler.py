@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+جدولة الحلقات على مجموعة عمال قابلة للتغيير أثناء التشغيل
+النتائج تُبث فور انتهاء كل حلقة، والفاشلة تعود بعد انتظار متزايد حتى حد للمحاولات
+كل عامل له طابور، والعامل الفارغ يسرق من آخر طابور أكثر العمال انشغالاً
+"""
+
+import os
+import time
+import heapq
+import signal
+import threading
+from collections import deque
+from queue import Queue, SimpleQueue, Empty
+
+from metrics import QUEUE_DEPTH
+
+MAX_ATTEMPTS = int(os.environ.get('FHRS_MAX_ATTEMPTS', '3'))
+RETRY_BACKOFF = 30.0      # ثوانٍ قبل المحاولة الثانية، وتتضاعف بعدها
+MAX_BACKOFF = 600.0
+# كل كم ثانية يطبق run() طلبات تغيير العمال القادمة من الإشارات
+SIGNAL_POLL = 0.5
+
+
+class Scheduler:
+    """
+    handler(job) -> (نجاح، رسالة) لمهمة (dict من planner)؛ يُستدعى من خيوط العمال
+    job['attempts'] = عدد المحاولات السابقة (0 في الأولى)
+    """
+
+    def __init__(self, handler, workers=4, max_attempts=MAX_ATTEMPTS, backoff=RETRY_BACKOFF,
+                 max_backoff=MAX_BACKOFF):
+        self.handler = handler
+        self.max_attempts = max(1, max_attempts)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.cond = threading.Condition()
+        self.queues = {}      # رقم العامل -> deque
+        self.retries = []     # (موعد الإعادة، ترتيب، مهمة)
+        self.threads = {}
+        self.retiring = set()
+        self.pending = 0
+        self.sequence = 0
+        self.next_worker = 0
+        self.target = max(1, workers)
+        self.results = Queue()
+        self.signals = SimpleQueue()   # +1/-1 من معالجات الإشارات
+
+    # ===== العمال =====
+
+    def _spawn(self):
+        worker_id = self.next_worker
+        self.next_worker += 1
+        self.queues[worker_id] = deque()
+        thread = threading.Thread(target=self._work, args=(worker_id,), daemon=True,
+                                  name=f"episode-worker-{worker_id}")
+        self.threads[worker_id] = thread
+        thread.start()
+
+    def resize(self, workers):
+        """تغيير عدد العمال: الزيادة فورية، والنقص بعد أن ينهي العامل حلقته الحالية"""
+        workers = max(1, workers)
+        with self.cond:
+            self.target = workers
+            live = [w for w in self.threads if w not in self.retiring]
+            for worker_id in sorted(live, reverse=True)[:max(0, len(live) - workers)]:
+                self.retiring.add(worker_id)
+            for _ in range(workers - len(live)):
+                self._spawn()
+            self.cond.notify_all()
+        print(f"[*] عدد العمال: {workers}")
+
+    @property
+    def workers(self):
+        with self.cond:
+            return self.target
+
+    def _steal(self, worker_id):
+        """من آخر أطول طابور (أقصر مهامه في ترتيب LPT)"""
+        victim = max((q for w, q in self.queues.items() if w != worker_id), key=len, default=None)
+        if victim:
+            return victim.pop()
+        return None
+
+    def _publish_depth(self):
+        # يُستدعى مع self.cond
+        QUEUE_DEPTH.set(sum(len(q) for q in self.queues.values()), queue='episodes')
+        QUEUE_DEPTH.set(len(self.retries), queue='retries')
+
+    def _take(self, worker_id):
+        with self.cond:
+            while True:
+                self._publish_depth()
+                if worker_id in self.retiring:
+                    self.retiring.discard(worker_id)
+                    self.threads.pop(worker_id, None)
+                    # مهامه المتبقية تبقى في طابوره ليسرقها الآخرون
+                    self.cond.notify_all()
+                    return None
+                if self.pending == 0:
+                    return None
+                now = time.monotonic()
+                if self.retries and self.retries[0][0] <= now:
+                    return heapq.heappop(self.retries)[2]
+                own = self.queues[worker_id]
+                if own:
+                    return own.popleft()
+                job = self._steal(worker_id)
+                if job is not None:
+                    return job
+                timeout = self.retries[0][0] - now if self.retries else None
+                self.cond.wait(timeout)
+
+    def _work(self, worker_id):
+        while True:
+            job = self._take(worker_id)
+            if job is None:
+                return
+            try:
+                success, message = self.handler(job)
+            except Exception as e:
+                success, message = False, f"خطأ: {str(e)[:50]}"
+            self._finish(job, success, message)
+
+    def _finish(self, job, success, message):
+        with self.cond:
+            job['attempts'] = job.get('attempts', 0) + 1
+            if success or job['attempts'] >= self.max_attempts:
+                self.pending -= 1
+                self.results.put((job, success, message))
+                if self.pending == 0:
+                    self.results.put(None)
+            else:
+                delay = min(self.backoff * 2 ** (job['attempts'] - 1), self.max_backoff)
+                print(f"[*] الحلقة {job['episode']:02d}: {message} - إعادة المحاولة بعد {delay:.0f}ث "
+                      f"({job['attempts']}/{self.max_attempts})")
+                self.sequence += 1
+                heapq.heappush(self.retries, (time.monotonic() + delay, self.sequence, job))
+            self._publish_depth()
+            self.cond.notify_all()
+
+    # ===== الواجهة =====
+
+    def run(self, jobs):
+        """
+        توزيع المهام (بترتيبها، عادةً الأطول أولاً) وبث (مهمة، نجاح، رسالة) عند انتهاء كل واحدة نهائياً
+        """
+        jobs = list(jobs)
+        if not jobs:
+            return
+        with self.cond:
+            self.pending += len(jobs)
+            for _ in range(self.target):
+                self._spawn()
+            ids = sorted(self.queues)
+            for index, job in enumerate(jobs):
+                self.queues[ids[index % len(ids)]].append(job)
+            self._publish_depth()
+            self.cond.notify_all()
+        while True:
+            try:
+                item = self.results.get(timeout=SIGNAL_POLL)
+            except Empty:
+                item = False
+            self._apply_signals()
+            if item is None:
+                break
+            if item:
+                yield item
+        for thread in list(self.threads.values()):
+            thread.join()
+
+    def _apply_signals(self):
+        delta = 0
+        while True:
+            try:
+                delta += self.signals.get_nowait()
+            except Empty:
+                break
+        if delta:
+            self.resize(self.workers + delta)
+
+    def install_signals(self):
+        """
+        SIGUSR1 يضيف عاملاً وSIGUSR2 يزيل عاملاً (kill -USR1 <pid>)
+        المعالج يضع الطلب في طابور فقط: قد يقاطع الخيط الرئيسي وهو يحمل self.cond،
+        فالتغيير يُطبق في حلقة run() خارج المعالج
+        """
+        if not hasattr(signal, 'SIGUSR1') or threading.current_thread() is not threading.main_thread():
+            return False
+        signal.signal(signal.SIGUSR1, lambda signum, frame: self.signals.put(1))
+        signal.signal(signal.SIGUSR2, lambda signum, frame: self.signals.put(-1))
+        return True
@@ -5,28 +5,43 @@
 
 import os
 import sys
+import json
+import time
+import queue
+import struct
+import threading
 import subprocess
-import glob
+import concurrent.futures
+from caps import tool_available
+import supervisor
+from supervisor import run_ffmpeg, encode_cpus
+from encoding import codec_args, codec_backend, codec_for
+
+VIDEO_EXTENSIONS = {'.mp4', '.mkv', '.avi', '.mov'}
+OUTPUT_DIR_NAME = "240p"
+MANIFEST_NAME = ".manifest.json"
 
 def check_ffmpeg():
     """التحقق من وجود ffmpeg"""
+    # فحص محفوظ في الذاكرة حسب مسار ffmpeg وتاريخ تعديله
+    if tool_available('ffmpeg'):
+        return True
+    
+    print("[!] ffmpeg غير مثبت")
+    print("[*] جاري التثبيت...")
     try:
-        subprocess.run(['ffmpeg', '-version'], capture_output=True, check=True)
+        subprocess.run(['sudo', 'apt', 'update'], check=True)
+        subprocess.run(['sudo', 'apt', 'install', '-y', 'ffmpeg'], check=True)
         return True
     except:
-        print("[!] ffmpeg غير مثبت")
-        print("[*] جاري التثبيت...")
-        try:
-            subprocess.run(['sudo', 'apt', 'update'], check=True)
-            subprocess.run(['sudo', 'apt', 'install', '-y', 'ffmpeg'], check=True)
-            return True
-        except:
-            print("[!] فشل تثبيت ffmpeg")
-            return False
+        print("[!] فشل تثبيت ffmpeg")
+        return False
 
-def fast_compress_240p(input_file, output_file=None, crf=30):
+def fast_compress_240p(input_file, output_file=None, crf=30, threads=0, codec=None):
     """
     تحويل سريع إلى 240p مع تقليل الحجم
+    threads: عدد خيوط ffmpeg (0 = تلقائي)
+    codec: x264/x265/svtav1 (الافتراضي FHRS_CODEC)
     """
     if not os.path.exists(input_file):
         print(f"[!] الملف غير موجود: {input_file}")
@@ -47,18 +62,18 @@ def fast_compress_240p(input_file, output_file=None, crf=30):
         'ffmpeg',
         '-i', input_file,
         '-vf', 'scale=-2:240',          # تحويل إلى 240p مع الحفاظ على النسبة
-        '-c:v', 'libx264',
-        '-crf', str(crf),               # ضغط أعلى
-        '-preset', 'fast',              # سرعة تنفيذ
+        *codec_args(codec, crf, 'fast'),  # ضغط أعلى وسرعة تنفيذ (CRF على مقياس المحرك)
         '-c:a', 'aac',
         '-b:a', '64k',                  # صوت منخفض
+        '-threads', str(threads),
         '-y',                           # نعم للكتابة فوق
         output_file
     ]
     
     try:
         print("[*] جاري التحويل...")
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        # أولوية منخفضة وأنوية الترميز فقط، وسجل محدود بدلاً من التقاط كل المخرجات
+        result = run_ffmpeg(cmd)
         
         if result.returncode == 0 and os.path.exists(output_file):
             new_size = os.path.getsize(output_file) / (1024 * 1024)  # MB
@@ -70,21 +85,70 @@ def fast_compress_240p(input_file, output_file=None, crf=30):
             print(f"    توفير: {reduction:.1f}%")
             return True
         else:
-            print(f"[!] فشل التحويل")
+            print(f"[!] فشل التحويل: {result.log.tail()[:200]}")
             return False
             
     except Exception as e:
         print(f"[!] خطأ: {e}")
         return False
 
-def batch_compress_240p(folder_path, crf=30):
-    """تحويل جميع الفيديوهات في مجلد"""
-    video_files = []
-    
+def scan_videos(folder_path, recursive=False):
+    """البحث عن ملفات الفيديو بمرور واحد (os.scandir) بدون تكرار بسبب حالة الأحرف"""
+    found = []
+    stack = [folder_path]
+    while stack:
+        current = stack.pop()
+        try:
+            entries = list(os.scandir(current))
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                # لا نعيد معالجة مجلد النتائج
+                if recursive and entry.name != OUTPUT_DIR_NAME:
+                    stack.append(entry.path)
+            elif entry.is_file() and os.path.splitext(entry.name)[1].lower() in VIDEO_EXTENSIONS:
+                found.append(entry)
+    return sorted(found, key=lambda e: e.path)
+
+def encode_settings(crf, codec=None):
+    """مفتاح إعدادات الترميز - تغييره يعني إعادة ترميز كل الملفات"""
+    _, backend = codec_backend(codec)
+    return f"240p;{backend['encoder']};fast;crf={crf};aac64k"
+
+def load_manifest(output_folder):
+    try:
+        with open(os.path.join(output_folder, MANIFEST_NAME), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_manifest(output_folder, manifest):
+    path = os.path.join(output_folder, MANIFEST_NAME)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(path + '.tmp', path)
+
+def pending_record(folder_path, output_folder, manifest, path, settings):
+    """(المسار النسبي، ملف الإخراج، سجل) إذا كان الملف يحتاج إلى ترميز، وإلا None"""
+    rel = os.path.relpath(path, folder_path)
+    name = os.path.splitext(rel)[0]
+    output_file = os.path.join(output_folder, f"{name}_240p.mp4")
+    st = os.stat(path)
+    record = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'settings': settings}
+    old = manifest.get(rel)
+    if old and all(old.get(k) == v for k, v in record.items()) and os.path.exists(output_file):
+        return None
+    return rel, output_file, record
+
+def folder_codec(folder_path):
+    """محرك الترميز حسب اسم المجلد (مفاتيح المسلسلات في ladders.json)"""
+    return codec_for(os.path.basename(os.path.abspath(folder_path)))
+
+def batch_compress_240p(folder_path, crf=30, recursive=False, jobs=None, codec=None):
+    """تحويل جميع الفيديوهات في مجلد (بالتوازي، مع تخطي ما تم تحويله سابقاً)"""
     # البحث عن ملفات الفيديو
-    for ext in ['*.mp4', '*.mkv', '*.avi', '*.mov']:
-        video_files.extend(glob.glob(os.path.join(folder_path, ext)))
-        video_files.extend(glob.glob(os.path.join(folder_path, ext.upper())))
+    video_files = scan_videos(folder_path, recursive)
     
     if not video_files:
         print("[!] لم يتم العثور على ملفات فيديو")
@@ -93,20 +157,250 @@ def batch_compress_240p(folder_path, crf=30):
     print(f"[*] تم العثور على {len(video_files)} ملف فيديو")
     
     # إنشاء مجلد للنتائج
-    output_folder = os.path.join(folder_path, "240p")
+    output_folder = os.path.join(folder_path, OUTPUT_DIR_NAME)
     os.makedirs(output_folder, exist_ok=True)
     
+    # السجل: الحجم وتاريخ التعديل والإعدادات لكل ملف تم تحويله
+    manifest = load_manifest(output_folder)
+    codec = codec or folder_codec(folder_path)
+    settings = encode_settings(crf, codec)
+    
+    pending = []
+    for entry in video_files:
+        item = pending_record(folder_path, output_folder, manifest, entry.path, settings)
+        if item:
+            rel, output_file, record = item
+            pending.append((rel, entry.path, output_file, record))
+    
+    skipped = len(video_files) - len(pending)
+    if skipped:
+        print(f"[*] تخطي {skipped} ملف محدث مسبقاً")
+    if not pending:
+        print("[✓] كل الملفات محدثة")
+        return
+    
+    # توزيع الأنوية: عدة عمليات ffmpeg، ولكل منها نصيب من الخيوط
+    # الأنوية المتاحة للترميز فقط (بعضها محجوز للشبكة)
+    cpus = len(encode_cpus()) or os.cpu_count() or 1
+    if jobs is None:
+        jobs = max(1, cpus // 2)
+    jobs = max(1, min(jobs, len(pending)))
+    threads = max(1, cpus // jobs)
+    print(f"[*] تحويل {len(pending)} ملف: {jobs} بالتوازي × {threads} خيوط")
+    
     successful = 0
     
-    for video_file in video_files:
-        filename = os.path.basename(video_file)
-        name, ext = os.path.splitext(filename)
-        output_file = os.path.join(output_folder, f"{name}_240p.mp4")
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {}
+        for rel, source, output_file, record in pending:
+            os.makedirs(os.path.dirname(output_file), exist_ok=True)
+            future = pool.submit(fast_compress_240p, source, output_file, crf, threads, codec)
+            futures[future] = (rel, record)
         
-        if fast_compress_240p(video_file, output_file, crf):
-            successful += 1
+        for future in concurrent.futures.as_completed(futures):
+            rel, record = futures[future]
+            try:
+                ok = future.result()
+            except Exception as e:
+                print(f"[!] خطأ في {rel}: {e}")
+                ok = False
+            if ok:
+                successful += 1
+                manifest[rel] = record
+                save_manifest(output_folder, manifest)
     
-    print(f"\n[*] اكتمل التحويل: {successful}/{len(video_files)}")
+    print(f"\n[*] اكتمل التحويل: {successful}/{len(pending)}")
+
+# ===== WATCH MODE =====
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+INOTIFY_EVENT = struct.Struct('iIII')
+STABLE_SECONDS = 2       # مدة ثبات الحجم قبل اعتبار الملف مكتملاً (بدون inotify)
+POLL_INTERVAL = 5
+WATCH_QUEUE_SIZE = 16
+
+def is_watch_candidate(name):
+    """ملفات الفيديو فقط، بدون الملفات المؤقتة أو المخفية"""
+    if name.startswith('.') or name.endswith(('.part', '.tmp', '.crdownload')):
+        return False
+    return os.path.splitext(name)[1].lower() in VIDEO_EXTENSIONS
+
+def inotify_open(folder_path):
+    """واصف inotify يراقب المجلد - OSError/AttributeError هنا إذا لم يكن inotify متاحاً"""
+    import ctypes
+    import ctypes.util
+    libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    fd = libc.inotify_init1(0)
+    if fd < 0:
+        raise OSError(ctypes.get_errno(), "inotify_init1")
+    if libc.inotify_add_watch(fd, os.fsencode(folder_path), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+        os.close(fd)
+        raise OSError(ctypes.get_errno(), "inotify_add_watch")
+    return fd
+
+def inotify_events(fd):
+    """
+    أسماء الملفات المكتملة من inotify (IN_CLOSE_WRITE / IN_MOVED_TO)
+    القراءة تحجب داخل النواة - لا استهلاك للمعالج عندما لا يتغير شيء
+    """
+    try:
+        while True:
+            data = os.read(fd, 64 * 1024)
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = INOTIFY_EVENT.unpack_from(data, offset)
+                offset += INOTIFY_EVENT.size
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+                if name:
+                    yield os.fsdecode(name)
+    finally:
+        os.close(fd)
+
+def polling_events(folder_path):
+    """بديل بدون inotify: ملف جاهز عندما يثبت حجمه وتاريخ تعديله STABLE_SECONDS"""
+    seen = {}
+    reported = set()
+    while True:
+        now = time.time()
+        for entry in os.scandir(folder_path):
+            if not entry.is_file():
+                continue
+            st = entry.stat()
+            key = (st.st_size, st.st_mtime_ns)
+            old = seen.get(entry.name)
+            if old is None or old[0] != key:
+                seen[entry.name] = (key, now)
+                reported.discard(entry.name)
+            elif now - old[1] >= STABLE_SECONDS and entry.name not in reported:
+                reported.add(entry.name)
+                yield entry.name
+        time.sleep(POLL_INTERVAL)
+
+def settle_files(on_stable, seconds=1.0):
+    """
+    تأكيد إضافي بعد close-write: الحجم لا يتغير seconds (بعض برامج النسخ تفتح الملف أكثر من مرة)
+    الانتظار في خيط خاص، فقارئ الأحداث لا يتوقف ثانية لكل ملف. يرجع add(path)
+    """
+    pending = {}
+    cond = threading.Condition()
+    
+    def settler():
+        while True:
+            with cond:
+                while not pending:
+                    cond.wait()
+            time.sleep(seconds / 2)
+            now = time.monotonic()
+            with cond:
+                items = list(pending.items())
+            for path, entry in items:
+                try:
+                    size = os.path.getsize(path)
+                except OSError:
+                    size = None
+                with cond:
+                    if pending.get(path) != entry:
+                        continue
+                    if size is None:
+                        del pending[path]
+                        continue
+                    if size != entry[0]:
+                        pending[path] = (size, now)
+                        continue
+                    if now - entry[1] < seconds:
+                        continue
+                    del pending[path]
+                on_stable(path)
+    
+    threading.Thread(target=settler, daemon=True).start()
+    
+    def add(path):
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        with cond:
+            pending[path] = (size, time.monotonic())
+            cond.notify()
+    
+    return add
+
+def watch_folder(folder_path, crf=30, jobs=None, codec=None):
+    """مراقبة مجلد وتحويل كل ملف جديد فور اكتمال كتابته"""
+    output_folder = os.path.join(folder_path, OUTPUT_DIR_NAME)
+    os.makedirs(output_folder, exist_ok=True)
+    manifest = load_manifest(output_folder)
+    manifest_lock = threading.Lock()
+    codec = codec or folder_codec(folder_path)
+    settings = encode_settings(crf, codec)
+    
+    # الأنوية المتاحة للترميز فقط (بعضها محجوز للشبكة)
+    cpus = len(encode_cpus()) or os.cpu_count() or 1
+    jobs = max(1, jobs or cpus // 2)
+    threads = max(1, cpus // jobs)
+    
+    # طابور محدود: إذا امتلأ يتوقف المراقب وتنتظر الأحداث في النواة
+    encode_queue = queue.Queue(maxsize=WATCH_QUEUE_SIZE)
+    queued = set()
+    
+    def encoder():
+        while True:
+            rel, source, output_file, record = encode_queue.get()
+            try:
+                os.makedirs(os.path.dirname(output_file), exist_ok=True)
+                if fast_compress_240p(source, output_file, crf, threads, codec):
+                    with manifest_lock:
+                        manifest[rel] = record
+                        save_manifest(output_folder, manifest)
+            except Exception as e:
+                print(f"[!] خطأ في {rel}: {e}")
+            finally:
+                with manifest_lock:
+                    queued.discard(source)
+                encode_queue.task_done()
+    
+    for _ in range(jobs):
+        threading.Thread(target=encoder, daemon=True).start()
+    
+    def submit(path):
+        if not os.path.isfile(path):
+            return
+        # يُستدعى من خيط الانتظار ومن الفحص الأولي معاً: الفحص والحجز في خطوة واحدة
+        with manifest_lock:
+            if path in queued:
+                return
+            item = pending_record(folder_path, output_folder, manifest, path, settings)
+            if not item:
+                return
+            queued.add(path)
+        rel, output_file, record = item
+        print(f"[*] ملف جديد: {rel}")
+        encode_queue.put((rel, path, output_file, record))
+    
+    settle = settle_files(submit)
+    
+    # المراقبة أولاً ثم فحص الموجود: ملف يكتمل بينهما يصل كحدث (والتكرار يتجاهله submit)
+    try:
+        # الإعداد خارج المولد: فشله يظهر هنا وليس عند أول قراءة
+        events = inotify_events(inotify_open(folder_path))
+        print(f"[*] مراقبة {folder_path} (inotify) - {jobs} تحويلات متوازية")
+    except (OSError, AttributeError):
+        events = polling_events(folder_path)
+        print(f"[*] مراقبة {folder_path} (فحص دوري كل {POLL_INTERVAL}ث)")
+    
+    # الملفات الموجودة قبل بدء المراقبة (مرة واحدة فقط)
+    for entry in scan_videos(folder_path):
+        submit(entry.path)
+    
+    try:
+        for name in events:
+            if is_watch_candidate(name):
+                settle(os.path.join(folder_path, name))
+    except KeyboardInterrupt:
+        print("\n[*] إيقاف المراقبة - انتظار التحويلات الجارية...")
+        encode_queue.join()
 
 def simple_menu():
     """واجهة بسيطة"""
@@ -120,9 +414,10 @@ def simple_menu():
     while True:
         print("\n1. تحويل ملف واحد")
         print("2. تحويل مجلد كامل")
-        print("3. الخروج")
+        print("3. مراقبة مجلد (تحويل الملفات الجديدة تلقائياً)")
+        print("4. الخروج")
         
-        choice = input("\nاختر [1-3]: ").strip()
+        choice = input("\nاختر [1-4]: ").strip()
         
         if choice == '1':
             file_path = input("أدخل مسار الملف: ").strip()
@@ -149,6 +444,13 @@ def simple_menu():
                 print("[!] المجلد غير موجود")
                 
         elif choice == '3':
+            folder_path = input("أدخل مسار المجلد: ").strip()
+            if os.path.isdir(folder_path):
+                watch_folder(folder_path)
+            else:
+                print("[!] المجلد غير موجود")
+                
+        elif choice == '4':
             print("[*] مع السلامة!")
             break
             
@@ -156,16 +458,31 @@ def simple_menu():
             print("[!] اختيار غير صحيح")
 
 # الاستخدام من سطر الأوامر
+# small.py [-r|--recursive] [-jN] [--watch] [--codec=x265] <ملف أو مجلد> [ملف الإخراج]
 if __name__ == "__main__":
-    if len(sys.argv) == 1:
+    supervisor.install()
+    flags = [a for a in sys.argv[1:] if a.startswith('-')]
+    args = [a for a in sys.argv[1:] if not a.startswith('-')]
+    recursive = '-r' in flags or '--recursive' in flags
+    jobs = None
+    codec = None
+    for flag in flags:
+        if flag.startswith('-j') and flag[2:].isdigit():
+            jobs = int(flag[2:])
+        elif flag.startswith('--codec='):
+            codec = flag.split('=', 1)[1]
+    
+    if len(args) == 0:
         # بدون معاملات، تشغيل الواجهة
         simple_menu()
-    elif len(sys.argv) == 2:
+    elif len(args) == 1:
         # ملف واحد
-        if os.path.isdir(sys.argv[1]):
-            batch_compress_240p(sys.argv[1])
+        if os.path.isdir(args[0]) and '--watch' in flags:
+            watch_folder(args[0], jobs=jobs, codec=codec)
+        elif os.path.isdir(args[0]):
+            batch_compress_240p(args[0], recursive=recursive, jobs=jobs, codec=codec)
         else:
-            fast_compress_240p(sys.argv[1])
-    elif len(sys.argv) == 3:
+            fast_compress_240p(args[0], codec=codec)
+    elif len(args) == 2:
         # ملف مع ملف إخراج
-        fast_compress_240p(sys.argv[1], sys.argv[2])
+        fast_compress_240p(args[0], args[1], codec=codec)
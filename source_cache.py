@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+ذاكرة محلية للمصادر المنزلة ومقاطع HLS، مفهرسة بالمحتوى (sha256) مع حد للحجم وإخلاء الأقدم استخداماً
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import threading
+from urllib.parse import urlsplit
+
+from bandwidth import parse_rate
+from metrics import CACHE_REQUESTS
+
+CACHE_DIR = os.environ.get('FHRS_CACHE_DIR') or os.path.join(os.path.expanduser('~'), '.cache', 'fhrs')
+SOURCE_CACHE_DIR = os.path.join(CACHE_DIR, 'sources')
+# الحد الأقصى للحجم (FHRS_SOURCE_CACHE_SIZE=50G مثلاً، 0 = تعطيل الذاكرة)
+SOURCE_CACHE_SIZE = parse_rate(os.environ.get('FHRS_SOURCE_CACHE_SIZE', '20G'))
+
+
+def episode_key(series_pattern, episode_num):
+    """مفتاح الحلقة: معروف قبل أي طلب شبكة (بخلاف الرابط النهائي أو رابط الخادم)"""
+    return f"episode:{series_pattern}{episode_num:02d}"
+
+
+def segment_key(url):
+    """مفتاح المقطع بدون query (رموز التوقيع تتغير بين التشغيلات، والمسار يحدد المحتوى)"""
+    parts = urlsplit(url)
+    return f"segment:{parts.netloc}{parts.path}"
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class SourceCache:
+    """
+    objects/<sha256>: المحتوى (نسخة واحدة مهما تكرر)
+    refs/<sha1(مفتاح)>: JSON يربط المفتاح بالمحتوى؛ وقت تعديل الكائن = آخر استخدام (LRU)
+    """
+
+    def __init__(self, root=SOURCE_CACHE_DIR, max_bytes=SOURCE_CACHE_SIZE):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.total = None  # يُحسب عند أول إضافة
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def _object_path(self, digest):
+        return os.path.join(self.root, 'objects', digest[:2], digest)
+
+    def _ref_path(self, key):
+        name = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.root, 'refs', name[:2], name)
+
+    def _read_ref(self, key):
+        try:
+            with open(self._ref_path(key), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_ref(self, key, ref):
+        path = self._ref_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(dict(ref, key=key), f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    def _valid_object(self, digest, size):
+        """الكائن موجود وبالحجم المسجل (فحص سريع - المحتوى يُتحقق منه عند الاستخدام)"""
+        path = self._object_path(digest)
+        try:
+            if os.path.getsize(path) != size:
+                return None
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def _drop(self, digest):
+        """حذف كائن لا يطابق محتواه اسمه (المراجع إليه تُعتبر غياباً)"""
+        print("[!] ذاكرة المصادر: محتوى تالف - حذفه")
+        try:
+            size = os.path.getsize(self._object_path(digest))
+            os.remove(self._object_path(digest))
+        except OSError:
+            return
+        with self.lock:
+            if self.total is not None:
+                self.total -= size
+
+    def _store_file(self, path, link=False):
+        """إضافة ملف إلى objects وإرجاع (sha256، الحجم)"""
+        digest = file_digest(path)
+        target = self._object_path(digest)
+        size = os.path.getsize(path)
+        if os.path.exists(target):
+            os.utime(target)
+            return digest, size
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        tmp = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            if not link:
+                raise OSError
+            # رابط صلب: بدون نسخ إذا كان على نفس القرص
+            os.link(path, tmp)
+        except OSError:
+            shutil.copyfile(path, tmp)
+        os.replace(tmp, target)
+        self._added(size)
+        return digest, size
+
+    def _store_bytes(self, data):
+        """(sha256، الحجم، البايتات المكتوبة فعلاً - 0 إذا كان المحتوى موجوداً)"""
+        digest = hashlib.sha256(data).hexdigest()
+        target = self._object_path(digest)
+        if os.path.exists(target):
+            os.utime(target)
+            return digest, len(data), 0
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        tmp = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, target)
+        self._added(len(data))
+        return digest, len(data), len(data)
+
+    # ===== مفاتيح بسيطة (مقاطع HLS) =====
+
+    def get(self, key):
+        """المحتوى المخزن للمفتاح أو None"""
+        if not self.enabled:
+            return None
+        ref = self._read_ref(key)
+        path = ref and self._valid_object(ref['hash'], ref['size'])
+        content = None
+        if path:
+            try:
+                with open(path, 'rb') as f:
+                    content = f.read()
+            except OSError:
+                pass
+            if content is not None and hashlib.sha256(content).hexdigest() != ref['hash']:
+                self._drop(ref['hash'])
+                content = None
+        CACHE_REQUESTS.inc(kind='segment', result='miss' if content is None else 'hit')
+        return content
+
+    def put(self, key, data):
+        """يرجع البايتات المكتوبة على القرص (لحسابها ضمن حجز المهمة)"""
+        if not self.enabled:
+            return 0
+        try:
+            digest, size, written = self._store_bytes(data)
+            self._write_ref(key, {'hash': digest, 'size': size})
+            self.evict()
+            return written
+        except OSError as e:
+            print(f"[!] تعذر الحفظ في ذاكرة المصادر: {e}")
+            return 0
+
+    # ===== مصادر الحلقات (عدة دقات لكل حلقة) =====
+
+    def sources(self, key, count=True):
+        """
+        الدقات المخزنة للحلقة: [{'path', 'height', 'quality'}] من الأعلى للأقل
+        count=False: فحص للتخطيط - الإصابة تُحسب مرة واحدة عند الاستخدام
+        """
+        if not self.enabled:
+            return []
+        ref = self._read_ref(key) or {}
+        found = []
+        for variant in ref.get('variants', []):
+            path = self._valid_object(variant['hash'], variant['size'])
+            if path:
+                found.append(dict(variant, path=path))
+        if count:
+            CACHE_REQUESTS.inc(kind='source', result='hit' if found else 'miss')
+        return sorted(found, key=lambda v: v.get('height') or 0, reverse=True)
+
+    def add_source(self, key, path, height=0, quality=None, link=False):
+        """
+        حفظ ملف مصدر للحلقة؛ دقة جديدة تُضاف بجانب الدقات السابقة، ونفس الدقة تستبدلها
+        link=True: رابط صلب بدون نسخ - فقط لملف مؤقت لن يُعدّل أو يُسلّم بعد ذلك (يُحذف أو يُستبدل)
+        """
+        if not self.enabled or not os.path.exists(path):
+            return
+        try:
+            digest, size = self._store_file(path, link)
+            with self.lock:
+                ref = self._read_ref(key) or {}
+                variants = [v for v in ref.get('variants', [])
+                            if v.get('height') != height or v.get('quality') != quality]
+                variants.append({'hash': digest, 'size': size, 'height': height, 'quality': quality})
+                self._write_ref(key, {'variants': variants})
+            self.evict()
+        except OSError as e:
+            print(f"[!] تعذر الحفظ في ذاكرة المصادر: {e}")
+
+    def materialize(self, variant, dest):
+        """
+        نسخ المصدر المخزن إلى dest (نسخة مستقلة: ffmpeg -y لا يفسد الذاكرة)
+        المحتوى يُتحقق منه أثناء النسخ - كائن تالف يُحذف ويرجع None (التنزيل من جديد)
+        """
+        if os.path.exists(dest):
+            os.remove(dest)
+        digest = hashlib.sha256()
+        with open(variant['path'], 'rb') as src, open(dest, 'wb') as out:
+            for chunk in iter(lambda: src.read(1024 * 1024), b''):
+                digest.update(chunk)
+                out.write(chunk)
+        if digest.hexdigest() != variant['hash']:
+            os.remove(dest)
+            self._drop(variant['hash'])
+            return None
+        return dest
+
+    # ===== الحجم والإخلاء =====
+
+    def _objects(self):
+        objects_dir = os.path.join(self.root, 'objects')
+        for shard in os.scandir(objects_dir) if os.path.isdir(objects_dir) else []:
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.is_file() and not entry.name.endswith('.tmp'):
+                    yield entry
+
+    def _added(self, size):
+        with self.lock:
+            if self.total is None:
+                self.total = sum(entry.stat().st_size for entry in self._objects())
+            else:
+                self.total += size
+
+    def evict(self, target=None):
+        """
+        حذف الأقدم استخداماً حتى يعود الحجم تحت الحد (المراجع اليتيمة تُعتبر غياباً)
+        target: حجم أصغر من الحد (القرص شبه ممتلئ، storage.py) - يرجع البايتات المحررة
+        """
+        with self.lock:
+            if target is None:
+                if self.total is None or self.total <= self.max_bytes:
+                    return 0
+                target = self.max_bytes * 0.9
+            entries = sorted(self._objects(), key=lambda e: e.stat().st_mtime_ns)
+            total = sum(entry.stat().st_size for entry in entries)
+            freed = 0
+            for entry in entries:
+                if total - freed <= target:
+                    break
+                try:
+                    size = entry.stat().st_size
+                    os.remove(entry.path)
+                    freed += size
+                except OSError:
+                    pass
+            self.total = total - freed
+        if freed:
+            print(f"[*] ذاكرة المصادر: تحرير {freed / (1024 ** 2):.0f}MB")
+        return freed
+
+    def size(self):
+        return sum(entry.stat().st_size for entry in self._objects())
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """الذاكرة المشتركة للعملية"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = SourceCache()
+        return _cache
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+إدارة مساحة القرص للحلقات المتزامنة: حجز البايتات المقدرة لكل مهمة قبل قبولها،
+إيقاف التنزيل مؤقتاً عندما تهبط المساحة الحرة تحت حد أدنى (واستئنافه فوق حد أعلى)،
+وحذف الملفات الوسيطة فور اكتمال المرحلة التالية - ذروة استخدام القرص محدودة ومعروفة مسبقاً
+"""
+
+import os
+import shutil
+import threading
+import contextvars
+from contextlib import contextmanager, nullcontext
+
+from bandwidth import parse_rate
+
+# مساحة تبقى فارغة دائماً على القرص (لا تُحجز لأي مهمة)
+DISK_RESERVE = parse_rate(os.environ.get('FHRS_DISK_RESERVE', '1G'))
+# إيقاف التنزيل عندما تقل المساحة الحرة عن LOW، واستئنافه عند HIGH
+LOW_WATERMARK = parse_rate(os.environ.get('FHRS_DISK_LOW_WATERMARK', '2G'))
+HIGH_WATERMARK = max(LOW_WATERMARK, parse_rate(os.environ.get('FHRS_DISK_HIGH_WATERMARK', '3G')))
+POLL_INTERVAL = 5.0        # المساحة الحرة تتغير من خارج العملية أيضاً: فحص دوري أثناء الانتظار
+
+_current = contextvars.ContextVar('fhrs_reservation', default=None)
+
+
+def current_reservation():
+    """حجز المهمة الجارية في هذا الخيط (داخل storage.reserve) أو None"""
+    return _current.get()
+
+
+def _device(path):
+    path = os.path.abspath(path or '.')
+    while not os.path.exists(path):
+        path = os.path.dirname(path)
+    return path, os.stat(path).st_dev
+
+
+class Reservation:
+    """
+    حجز مهمة واحدة: need بايت ستكتبها المهمة، والملفات المسجلة بـ track تُحسب مما كُتب
+    (ما لم يُكتب بعد = need - أحجام الملفات الموجودة)
+    """
+
+    def __init__(self, storage, need, label=''):
+        self.storage = storage
+        self.need = need
+        self.label = label
+        self.files = []
+        self.extra = 0
+        self.lock = threading.Lock()
+
+    def track(self, *paths):
+        for path in paths:
+            if path not in self.files:
+                self.files.append(path)
+        return self
+
+    def add(self, nbytes):
+        """بايتات كتبتها المهمة خارج ملفاتها (مقاطع في ذاكرة المصادر على نفس القرص)"""
+        with self.lock:
+            self.extra += nbytes
+
+    def written(self):
+        total = self.extra
+        for path in self.files:
+            try:
+                total += os.path.getsize(path)
+            except OSError:
+                pass
+        return total
+
+    def outstanding(self):
+        return max(0, self.need - self.written())
+
+    def commit(self, output, *intermediates):
+        """
+        المرحلة التالية أنتجت output: حذف الملفات الوسيطة فوراً (لا تنتظر نهاية الحلقة)
+        حجمها يخرج من الحجز أيضاً - لن تُكتب مرة أخرى
+        """
+        if not commit(output, *intermediates):
+            return False
+        for path in intermediates:
+            if path in self.files:
+                self.files.remove(path)
+        self.storage.notify()
+        return True
+
+
+def commit(output, *intermediates):
+    """حذف intermediates إذا كان output موجوداً وغير فارغ -> True إذا تم"""
+    try:
+        if os.path.getsize(output) <= 0:
+            return False
+    except OSError:
+        return False
+    for path in intermediates:
+        if path and path != output and os.path.exists(path):
+            try:
+                os.remove(path)
+            except OSError as e:
+                print(f"[!] تعذر حذف الملف الوسيط {os.path.basename(path)}: {e}")
+    return True
+
+
+class Storage:
+    """القرص الذي يحتوي path: الحجوزات القائمة، والحد الأدنى للمساحة الحرة"""
+
+    def __init__(self, path='.', reserve=DISK_RESERVE, low_watermark=LOW_WATERMARK, high_watermark=HIGH_WATERMARK):
+        self.path = path
+        self.reserve_bytes = reserve
+        self.low_watermark = low_watermark
+        self.high_watermark = max(low_watermark, high_watermark)
+        self.reservations = []
+        self.cond = threading.Condition()
+        self.paused = False
+
+    def free(self):
+        return shutil.disk_usage(self.path).free
+
+    def outstanding(self):
+        """البايتات المحجوزة التي لم تُكتب بعد (يجب أن تبقى متاحة)"""
+        with self.cond:
+            return sum(r.outstanding() for r in self.reservations)
+
+    def contains(self, path):
+        """path على نفس القرص"""
+        return _device(path)[1] == _device(self.path)[1]
+
+    def reclaim(self):
+        """
+        ذاكرة المصادر على نفس القرص تُخلى حتى الحد الأعلى قبل إيقاف أي تنزيل
+        (وإلا تبقى كل العمال متوقفة بلا شيء يحرر المساحة) - يرجع البايتات المحررة
+        """
+        from source_cache import get_cache
+        cache = get_cache()
+        want = self.high_watermark - self.free()
+        if want <= 0 or not cache.enabled or not self.contains(cache.root):
+            return 0
+        return cache.evict(max(0, cache.size() - want))
+
+    def notify(self):
+        with self.cond:
+            self.cond.notify_all()
+
+    def _fits(self, need):
+        # مهمة واحدة تبدأ دائماً عندما لا يعمل شيء (تقدير خاطئ لا يوقف كل شيء)
+        if not self.reservations:
+            return True
+        return need <= self.free() - self.reserve_bytes - sum(r.outstanding() for r in self.reservations)
+
+    @contextmanager
+    def reserve(self, need, label=''):
+        """with storage.reserve(bytes, 'الحلقة 03') as reservation: ... (الانتظار حتى تتسع المساحة)"""
+        reservation = Reservation(self, need, label)
+        with self.cond:
+            if not self._fits(need):
+                print(f"[*] {label or 'مهمة'}: بانتظار مساحة القرص ({need / 1024 ** 2:.0f}MB)...")
+                while not self._fits(need):
+                    self.cond.wait(POLL_INTERVAL)
+            self.reservations.append(reservation)
+        token = _current.set(reservation)
+        try:
+            yield reservation
+        finally:
+            _current.reset(token)
+            with self.cond:
+                self.reservations.remove(reservation)
+                self.cond.notify_all()
+
+    def wait_for_space(self, label='', during=None):
+        """
+        يُستدعى من حلقات التنزيل: إيقاف مؤقت ما دامت المساحة الحرة تحت الحد الأدنى
+        (حتى الحد الأعلى، حتى لا يتذبذب) - True إذا توقف (مراقبة السرعة يجب أن تبدأ من جديد)
+        during: سياق يُدخل طوال الإيقاف (ffmpeg الذي ينتظر المدخلات: job.paused())
+        """
+        if not self.low_watermark or self.free() >= self.low_watermark:
+            return False
+        if self.reclaim() and self.free() >= self.low_watermark:
+            return False
+        with during or nullcontext(), self.cond:
+            if not self.paused:
+                self.paused = True
+                print(f"\n[!] المساحة الحرة أقل من {self.low_watermark / 1024 ** 3:.1f}GB - إيقاف التنزيل مؤقتاً"
+                      f"{f' ({label})' if label else ''}")
+            while self.free() < self.high_watermark:
+                self.cond.wait(POLL_INTERVAL)
+            if self.paused:
+                self.paused = False
+                print(f"[*] المساحة الحرة {self.free() / 1024 ** 3:.1f}GB - استئناف التنزيل")
+        return True
+
+    def ytdl_hook(self, inner=None, on_resume=None):
+        """خطاف تقدم yt-dlp يوقف التنزيل عند امتلاء القرص"""
+        def hook(status):
+            if status.get('status') == 'downloading' and self.wait_for_space() and on_resume:
+                on_resume()
+            if inner:
+                inner(status)
+        return hook
+
+
+_storages = {}
+_storages_lock = threading.Lock()
+
+
+def get_storage(path='.'):
+    """مدير القرص الذي يحتوي path (مجلدان على نفس القرص يتشاركان نفس الحجوزات)"""
+    probe, device = _device(path)
+    with _storages_lock:
+        storage = _storages.get(device)
+        if storage is None:
+            storage = _storages[device] = Storage(probe)
+        return storage
@@ -0,0 +1,521 @@
+#!/usr/bin/env python3
+"""
+مشرف العمليات الفرعية (ffmpeg/ffprobe): سجلات محدودة الحجم، أولويات وأنوية مخصصة للترميز،
+إلغاء نظيف عند Ctrl-C، ومراقبة التقدم مع الاستئناف بدلاً من المهلة الثابتة
+"""
+
+import io
+import os
+import json
+import time
+import atexit
+import signal
+import threading
+import subprocess
+from contextlib import contextmanager
+from collections import deque, namedtuple
+
+import tracing
+from caps import tool_available
+from metrics import FFMPEG_SECONDS, ENCODE_FPS, ENCODE_SPEED
+
+LOG_LINES = 200            # آخر الأسطر المحفوظة من stderr لكل عملية
+LOG_LINE_CHARS = 1000      # أقصى طول للسطر الواحد (ffmpeg قد يكتب أسطراً طويلة جداً)
+CAPTURE_LIMIT = 1024 * 1024  # أقصى حجم لمخرجات stdout الملتقطة (ffprobe)
+CANCEL_GRACE = 10          # ثوانٍ بين SIGINT و kill
+
+# نترك أنوية للشبكة والتنزيل: الترميز لا يستخدم أول RESERVED_CPUS أنوية
+RESERVED_CPUS = int(os.environ.get('FHRS_RESERVED_CPUS', '1'))
+
+# nice، فئة ionice (2 = best-effort) ومستواها، وهل تُقيد بأنوية الترميز
+ROLES = {
+    'encode': {'nice': 10, 'ionice': (2, 7), 'encode_cpus': True},
+    'download': {'nice': 0, 'ionice': None, 'encode_cpus': False},
+    'probe': {'nice': 0, 'ionice': None, 'encode_cpus': False},
+}
+
+STALL_TIMEOUT = 90         # ثوانٍ بدون أي تقدم قبل اعتبار العملية متوقفة
+STARTUP_GRACE = 60         # وقت إضافي للبدء (فتح الشبكة، تحليل المدخلات)
+DEADLINE_FACTOR = 3.0      # المهلة المتوقعة = (المدة ÷ السرعة المتوقعة) × هذا المعامل
+MAX_RESUMES = 2
+
+# متوسط السرعة المقاسة (ثواني فيديو لكل ثانية) لكل نوع عمل، يتحسن مع كل تشغيل
+SPEED_HISTORY = {'encode': 2.0, 'copy': 20.0}
+_history_lock = threading.Lock()
+
+
+Result = namedtuple('Result', 'returncode stdout log')
+
+
+class RingLog:
+    """آخر الأسطر فقط: الذاكرة ثابتة مهما كانت العملية ثرثارة"""
+
+    def __init__(self, lines=LOG_LINES):
+        self.lines = deque(maxlen=lines)
+
+    def append(self, line):
+        self.lines.append(line.rstrip()[:LOG_LINE_CHARS])
+
+    def tail(self, count=3):
+        return ' | '.join(list(self.lines)[-count:])
+
+    def text(self):
+        return '\n'.join(self.lines)
+
+
+def encode_cpus():
+    """الأنوية المسموحة للترميز (كلها إذا كان الجهاز صغيراً)"""
+    try:
+        cpus = sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        return []
+    if len(cpus) <= RESERVED_CPUS + 1:
+        return cpus
+    return cpus[RESERVED_CPUS:]
+
+
+def priority_prefix(role):
+    """taskset/ionice/nice قبل الأمر حسب نوع العمل (تُتجاهل إذا لم تتوفر الأدوات)"""
+    settings = ROLES.get(role, ROLES['probe'])
+    prefix = []
+    if settings['encode_cpus'] and tool_available('taskset', ('--version',)):
+        cpus = encode_cpus()
+        if cpus:
+            prefix += ['taskset', '-c', ','.join(str(c) for c in cpus)]
+    if settings['ionice'] and tool_available('ionice', ('--version',)):
+        io_class, io_level = settings['ionice']
+        prefix += ['ionice', '-c', str(io_class), '-n', str(io_level)]
+    if settings['nice'] and tool_available('nice', ('--version',)):
+        prefix += ['nice', '-n', str(settings['nice'])]
+    return prefix
+
+
+_children = set()
+_children_lock = threading.Lock()
+
+
+def cancel_all():
+    """إيقاف كل العمليات الفرعية الحية (عند Ctrl-C أو الخروج)"""
+    with _children_lock:
+        children = list(_children)
+    # SIGINT للجميع أولاً حتى تنتهي معاً، ثم kill لمن تأخر
+    for child in children:
+        child.signal(signal.SIGINT)
+    for child in children:
+        child.cancel()
+
+
+def _on_sigint(signum, frame):
+    # الأبناء في جلسات مستقلة لا يصلهم Ctrl-C من الطرفية: نمرره لهم ثم نكمل السلوك المعتاد
+    # (kill لمن لم يخرج يتم في cancel_all عند الخروج)
+    for child in list(_children):
+        child.signal(signal.SIGINT)
+    if callable(_previous_sigint):
+        _previous_sigint(signum, frame)
+    else:
+        raise KeyboardInterrupt
+
+
+_previous_sigint = None
+_installed = False
+
+
+def install():
+    """
+    تمرير Ctrl-C للأبناء وإيقافهم عند الخروج - تستدعيها main() في السكربتات
+    (الاستيراد وحده لا يغير معالج الإشارات لمن يستخدم الوحدة كمكتبة)
+    """
+    global _previous_sigint, _installed
+    if _installed:
+        return
+    _installed = True
+    atexit.register(cancel_all)
+    if threading.current_thread() is threading.main_thread():
+        _previous_sigint = signal.getsignal(signal.SIGINT)
+        signal.signal(signal.SIGINT, _on_sigint)
+
+
+class Child:
+    """
+    عملية فرعية تحت الإشراف: stderr في RingLog، stdout محدود أو يُحلل سطراً سطراً،
+    وفي جلسة مستقلة حتى يكون الإلغاء (SIGINT ثم kill) بأيدينا وبالترتيب
+    """
+
+    def __init__(self, cmd, role='probe', stdin=False):
+        self.cmd = list(cmd)
+        self.role = role
+        self.use_stdin = stdin
+        self.log = RingLog()
+        self.captured = []
+        self.captured_size = 0
+        self.process = None
+        self.readers = []
+        self.trace = tracing.begin(os.path.basename(self.cmd[0]), 'process', role=role, cmd=' '.join(self.cmd)[:300])
+
+    def start(self):
+        self.process = subprocess.Popen(
+            priority_prefix(self.role) + self.cmd,
+            stdin=subprocess.PIPE if self.use_stdin else subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            start_new_session=True
+        )
+        with _children_lock:
+            _children.add(self)
+        for target in (self._read_stdout, self._read_stderr):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self.readers.append(thread)
+        return self
+
+    @property
+    def stdin(self):
+        # ثنائي: مقاطع HLS تُكتب كما هي
+        return self.process.stdin
+
+    def _read_lines(self, stream, handle):
+        stream = io.TextIOWrapper(stream, encoding='utf-8', errors='replace')
+        while True:
+            line = stream.readline(LOG_LINE_CHARS)
+            if not line:
+                break
+            handle(line)
+
+    def _read_stdout(self):
+        self._read_lines(self.process.stdout, self.on_stdout)
+
+    def _read_stderr(self):
+        self._read_lines(self.process.stderr, self.log.append)
+
+    def on_stdout(self, line):
+        if self.captured_size < CAPTURE_LIMIT:
+            self.captured.append(line)
+            self.captured_size += len(line)
+
+    def stdout_text(self):
+        return ''.join(self.captured)
+
+    def wait(self, timeout=None):
+        try:
+            returncode = self.process.wait(timeout)
+        except KeyboardInterrupt:
+            self.cancel()
+            raise
+        for thread in self.readers:
+            thread.join(1)
+        with _children_lock:
+            _children.discard(self)
+        self.trace.finish(returncode=returncode)
+        return returncode
+
+    def signal(self, signum):
+        if self.process and self.process.poll() is None:
+            try:
+                self.process.send_signal(signum)
+            except OSError:
+                pass
+
+    def interrupt(self):
+        """SIGINT ثم kill إذا لم يخرج (SIGINT يجعل ffmpeg ينهي الملف بشكل صالح)"""
+        if self.process.poll() is not None:
+            return
+        try:
+            self.process.send_signal(signal.SIGINT)
+            self.process.wait(timeout=CANCEL_GRACE)
+        except Exception:
+            self.process.kill()
+
+    def cancel(self):
+        if self.process and self.process.poll() is None:
+            self.interrupt()
+            if self.process.poll() is None:
+                self.process.kill()
+            self.process.wait()
+        with _children_lock:
+            _children.discard(self)
+        self.trace.finish(cancelled=True)
+
+
+def run(cmd, role='probe', timeout=None):
+    """تشغيل أمر قصير (ffprobe وما شابه) مع التقاط محدود للمخرجات"""
+    child = Child(cmd, role).start()
+    try:
+        returncode = child.wait(timeout)
+    except subprocess.TimeoutExpired:
+        child.cancel()
+        raise
+    return Result(returncode, child.stdout_text(), child.log)
+
+
+def probe_duration(source):
+    """مدة الفيديو بالثواني عبر ffprobe (0 إذا تعذر)"""
+    try:
+        result = run(
+            ['ffprobe', '-v', 'error', '-show_entries', 'format=duration',
+             '-of', 'default=noprint_wrappers=1:nokey=1', source],
+            timeout=30
+        )
+        return float(result.stdout.strip())
+    except Exception:
+        return 0.0
+
+
+def expected_seconds(duration, kind):
+    """الوقت المتوقع للعمل بناءً على المدة والسرعة المقاسة سابقاً"""
+    with _history_lock:
+        speed = SPEED_HISTORY.get(kind, 1.0)
+    return duration / max(speed, 0.05) if duration else 0.0
+
+
+def record_speed(kind, speed):
+    if speed <= 0:
+        return
+    with _history_lock:
+        old = SPEED_HISTORY.get(kind)
+        SPEED_HISTORY[kind] = speed if old is None else old * 0.7 + speed * 0.3
+
+
+def with_progress(cmd):
+    """إضافة -progress pipe:1 إلى أمر ffmpeg"""
+    return [cmd[0], '-progress', 'pipe:1', '-nostats'] + list(cmd[1:])
+
+
+class FfmpegRun(Child):
+    """ffmpeg تحت المراقبة: التقدم من -progress pipe:1، والإيقاف فقط عند التوقف الفعلي"""
+
+    def __init__(self, cmd, duration=0, kind='encode', stall_timeout=STALL_TIMEOUT, stdin=False,
+                 role=None, progress=None):
+        super().__init__(with_progress(cmd), role or ('encode' if kind == 'encode' else 'download'), stdin)
+        self.duration = duration
+        self.kind = kind
+        self.stall_timeout = stall_timeout
+        self.progress = progress
+        self.out_time = 0.0
+        self.total_size = 0
+        self.speed = 0.0
+        self.frames = 0
+        self.stalled = False
+        self.started = None
+        self.last_progress = None
+        self.pauses = 0
+
+    @contextmanager
+    def paused(self):
+        """المدخلات متوقفة عمداً (القرص شبه ممتلئ): الانتظار لا يُحسب توقفاً ولا تُقتل العملية"""
+        self.pauses += 1
+        try:
+            yield
+        finally:
+            self.pauses -= 1
+            self.last_progress = time.monotonic()
+
+    def start(self):
+        self.started = self.last_progress = time.monotonic()
+        super().start()
+        threading.Thread(target=self._watchdog, daemon=True).start()
+        return self
+
+    def on_stdout(self, line):
+        key, _, value = line.strip().partition('=')
+        try:
+            if key == 'out_time_us' or key == 'out_time_ms':
+                # out_time_ms في ffmpeg هو بالميكروثانية أيضاً
+                out_time = int(value) / 1000000.0
+                if out_time > self.out_time:
+                    self.out_time = out_time
+                    self.last_progress = time.monotonic()
+                    if self.progress:
+                        self.progress(self.out_time, self.duration)
+            elif key == 'total_size':
+                size = int(value)
+                if size > self.total_size:
+                    self.total_size = size
+                    self.last_progress = time.monotonic()
+            elif key == 'frame':
+                self.frames = int(value)
+            elif key == 'speed' and value.endswith('x'):
+                self.speed = float(value[:-1])
+        except ValueError:
+            pass
+
+    def _watchdog(self):
+        expected = expected_seconds(self.duration, self.kind)
+        deadline = self.started + STARTUP_GRACE + expected * DEADLINE_FACTOR if expected else None
+        warned = False
+        while self.process.poll() is None:
+            time.sleep(1)
+            now = time.monotonic()
+            if self.pauses:
+                continue
+            grace = STARTUP_GRACE if self.out_time == 0 else 0
+            if now - self.last_progress > self.stall_timeout + grace:
+                # توقف حقيقي: إيقاف لطيف حتى يكتب ffmpeg ما أنجزه بشكل صالح
+                print(f"\n[!] ffmpeg متوقف منذ {now - self.last_progress:.0f}ث عند {self.out_time:.0f}ث - إيقاف")
+                self.stalled = True
+                self.interrupt()
+                return
+            if deadline and now > deadline and not warned:
+                # تجاوز الوقت المتوقع لكنه ما زال يتقدم - لا نقتله
+                warned = True
+                print(f"\n[*] ffmpeg أبطأ من المتوقع ({self.out_time:.0f}/{self.duration:.0f}ث) لكنه يتقدم - الاستمرار")
+
+    def wait(self, timeout=None):
+        returncode = super().wait(timeout)
+        elapsed = time.monotonic() - self.started
+        FFMPEG_SECONDS.observe(elapsed, kind=self.kind)
+        if returncode == 0 and self.out_time and elapsed > 0:
+            record_speed(self.kind, self.out_time / elapsed)
+            ENCODE_SPEED.observe(self.out_time / elapsed, kind=self.kind)
+            if self.frames:
+                ENCODE_FPS.observe(self.frames / elapsed, kind=self.kind)
+        return returncode
+
+
+def run_ffmpeg(cmd, duration=None, kind='encode', progress=None):
+    """
+    تشغيل ffmpeg واحد تحت المراقبة (بدون استئناف)
+    يرجع Result؛ duration=None يعني قراءتها من ملف الإدخال
+    """
+    if duration is None:
+        source = cmd[cmd.index('-i') + 1] if '-i' in cmd else None
+        duration = probe_duration(source) if source else 0
+    child = FfmpegRun(cmd, duration, kind, progress=progress).start()
+    returncode = child.wait()
+    return Result(returncode, '', child.log)
+
+
+def concat_parts(parts, output_file):
+    """دمج الأجزاء بدون إعادة ترميز؛ parts = [(ملف، نقطة النهاية أو None)]"""
+    list_file = output_file + '.concat.txt'
+    with open(list_file, 'w', encoding='utf-8') as f:
+        for path, outpoint in parts:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+            if outpoint:
+                f.write(f"outpoint {outpoint:.3f}\n")
+    try:
+        result = run(
+            ['ffmpeg', '-f', 'concat', '-safe', '0', '-i', list_file, '-c', 'copy', '-y',
+             '-loglevel', 'error', output_file],
+            role='download'
+        )
+        return result.returncode == 0
+    finally:
+        os.remove(list_file)
+
+
+def _remove_parts(parts):
+    for path, _, _ in parts:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _parts_file(output_file):
+    return output_file + '.parts.json'
+
+
+def _save_parts(output_file, parts, duration, kind):
+    with open(_parts_file(output_file), 'w', encoding='utf-8') as f:
+        json.dump({'kind': kind, 'duration': duration, 'parts': parts}, f)
+
+
+def _forget_parts(output_file):
+    if os.path.exists(_parts_file(output_file)):
+        os.remove(_parts_file(output_file))
+
+
+def _load_parts(output_file, duration, kind):
+    """أجزاء تشغيل سابق لنفس العمل تجاوز عدد مرات الاستئناف - هذا التشغيل يكمل من بعدها"""
+    try:
+        with open(_parts_file(output_file), 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        parts = [tuple(part) for part in state['parts']]
+    except (OSError, ValueError, KeyError, TypeError):
+        return []
+    if (state.get('kind') == kind and abs(state.get('duration', 0) - duration) <= 1.0 and parts
+            and all(os.path.exists(path) for path, _, _ in parts)):
+        return parts
+    # عمل آخر بنفس الاسم (مصدر بمدة مختلفة) - أجزاؤه لا تصلح للدمج مع هذا
+    _remove_parts(parts)
+    _forget_parts(output_file)
+    return []
+
+
+def run_resumable(build, output_file, duration=0, kind='encode', max_resumes=MAX_RESUMES):
+    """
+    تشغيل عمل ffmpeg قابل للاستئناف
+    build(start_seconds, part_file) -> (cmd, feeder أو None, البداية الفعلية بالثواني)
+    feeder(stdin, job) يكتب المدخلات (مثل مقاطع HLS) ثم يعود؛ with job.paused() أثناء إيقافها عمداً
+    عند التوقف: الجزء المنجز يُحفظ، ويبدأ جزء جديد من آخر نقطة، ثم تُدمج الأجزاء
+    بعد آخر محاولة تبقى الأجزاء على القرص (output_file.parts.json) ويكمل منها التشغيل التالي
+    """
+    base, ext = os.path.splitext(output_file)
+    # [(ملف، البداية الفعلية، ما تم الوصول إليه)]
+    parts = _load_parts(output_file, duration, kind) if max_resumes else []
+    start = parts[-1][2] if parts else 0.0
+    if parts:
+        print(f"[*] متابعة من {start:.0f}ث بأجزاء تشغيل سابق ({len(parts)})")
+
+    for attempt in range(max_resumes + 1):
+        part_file = f"{base}_part{len(parts)}{ext}" if parts else output_file
+        cmd, feeder, actual_start = build(start, part_file)
+        job = FfmpegRun(cmd, max(0.0, duration - actual_start), kind, stdin=feeder is not None).start()
+        try:
+            if feeder:
+                try:
+                    feeder(job.stdin, job)
+                    job.stdin.close()
+                except BrokenPipeError:
+                    # ffmpeg خرج (توقف أو خطأ) - النتيجة تحددها حالة العملية
+                    pass
+            returncode = job.wait()
+        except BaseException:
+            job.cancel()
+            raise
+
+        if returncode == 0 and not job.stalled:
+            parts.append((part_file, actual_start, None))
+            break
+
+        if not job.stalled or job.out_time <= 0 or not os.path.exists(part_file):
+            print(f"[!] فشل ffmpeg (رمز {returncode}): {job.log.tail()[:200]}")
+            _remove_parts(parts)
+            _forget_parts(output_file)
+            return False
+
+        # الجزء المتوقف صالح (أُنهي بـ SIGINT) - نحتفظ به ونكمل من بعده
+        if part_file == output_file:
+            first_part = f"{base}_part0{ext}"
+            os.replace(part_file, first_part)
+            part_file = first_part
+        parts.append((part_file, actual_start, actual_start + job.out_time))
+        start = actual_start + job.out_time
+        if attempt < max_resumes:
+            print(f"[*] استئناف من {start:.0f}ث بدلاً من البدء من جديد")
+    else:
+        if not max_resumes:
+            print("[!] توقف ffmpeg والعمل غير قابل للاستئناف")
+            _remove_parts(parts)
+            return False
+        # الأجزاء صالحة: التشغيل التالي لنفس الملف يكمل منها بدلاً من البدء من الصفر
+        _save_parts(output_file, parts, duration, kind)
+        print(f"[!] تجاوز عدد مرات الاستئناف - الأجزاء محفوظة حتى {start:.0f}ث للتشغيل التالي")
+        return False
+
+    _forget_parts(output_file)
+    if len(parts) == 1:
+        return True
+
+    # نقطة نهاية كل جزء = بداية الجزء التالي (نسبةً لبداية الجزء نفسه)
+    concat_list = []
+    for index, (path, actual_start, _) in enumerate(parts):
+        outpoint = parts[index + 1][1] - actual_start if index + 1 < len(parts) else None
+        concat_list.append((path, outpoint))
+    merged = output_file + '.merged' + ext
+    ok = concat_parts(concat_list, merged)
+    if ok:
+        os.replace(merged, output_file)
+    for path, _, _ in parts:
+        if path != output_file and os.path.exists(path):
+            os.remove(path)
+    return ok
@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+"""
+رفع إلى Telegram قابل للاستئناف بعد توقف العملية: الملف يُرفع أجزاءً (upload.saveBigFilePart)
+ومعرّف الملف والأجزاء المكتملة تُحفظ محلياً، فالتشغيل التالي يرسل الأجزاء الناقصة فقط ثم ينشر الفيديو
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import asyncio
+import hashlib
+import inspect
+import tempfile
+import functools
+import threading
+from types import SimpleNamespace
+from unittest import mock
+
+from source_cache import CACHE_DIR
+from metrics import UPLOAD_PARTS
+
+UPLOAD_STATE_DIR = os.path.join(CACHE_DIR, 'uploads')
+PART_SIZE = 512 * 1024            # أقصى حجم جزء في Telegram
+BIG_FILE = 10 * 1024 * 1024       # الملفات الأكبر تستخدم saveBigFilePart
+# طلبات saveBigFilePart المتزامنة على جلسة العميل نفسها (اتصال MTProto واحد):
+# تخفي زمن انتظار كل طلب ولا تضيف اتصالات - الرفع بعدة اتصالات هو UploadPool في tg_upload.py
+PART_WORKERS = 4
+# الأجزاء المرفوعة تبقى على الخادم لفترة محدودة؛ حالة أقدم من هذا تبدأ من جديد
+STATE_TTL = 6 * 3600
+SAVE_EVERY = 1.0                  # أقصى فترة بين حفظ الحالة على القرص (ثوانٍ)
+
+
+class UploadState:
+    """حالة رفع ملف واحد في JSON: {'file_id', 'parts', 'done', 'created'} (مفتاحها المسار والحجم ووقت التعديل)"""
+
+    def __init__(self, path, part_size=PART_SIZE, state_dir=UPLOAD_STATE_DIR):
+        stat = os.stat(path)
+        key = f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}|{part_size}"
+        self.file = os.path.join(state_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json')
+        self.size = stat.st_size
+        self.parts = max(1, -(-stat.st_size // part_size))
+        self.file_id = None
+        self.done = set()
+        self.created = 0.0
+        self.saved_at = 0.0
+        self.lock = threading.Lock()
+
+    def load(self):
+        """True إذا وُجدت حالة صالحة لاستئنافها"""
+        try:
+            with open(self.file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = None
+        if data and data.get('parts') == self.parts and time.time() - data.get('created', 0) < STATE_TTL:
+            self.file_id = data['file_id']
+            self.done = set(data.get('done', []))
+            self.created = data['created']
+            return True
+        self.file_id = random.getrandbits(63)
+        self.done = set()
+        self.created = time.time()
+        return False
+
+    def save(self, force=False):
+        now = time.monotonic()
+        if not force and now - self.saved_at < SAVE_EVERY:
+            return
+        self.saved_at = now
+        with self.lock:
+            data = {'file_id': self.file_id, 'parts': self.parts, 'done': sorted(self.done),
+                    'created': self.created}
+        os.makedirs(os.path.dirname(self.file), exist_ok=True)
+        tmp = f"{self.file}.{os.getpid()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp, self.file)
+
+    def remove(self):
+        try:
+            os.remove(self.file)
+        except OSError:
+            pass
+
+    @property
+    def missing(self):
+        return [part for part in range(self.parts) if part not in self.done]
+
+
+def pending_upload(path, part_size=PART_SIZE, state_dir=UPLOAD_STATE_DIR):
+    """
+    عدد الأجزاء المرفوعة سابقاً لهذا الملف بعينه (0 إذا لا توجد حالة صالحة)
+    الحالة مرتبطة بالحجم ووقت التعديل: إعادة إنشاء الملف تبطلها، فالمستدعي يحتفظ به بدل إعادة بنائه
+    """
+    if not os.path.exists(path):
+        return 0
+    state = UploadState(path, part_size, state_dir)
+    return len(state.done) if state.load() else 0
+
+
+class PyrogramApi:
+    """استدعاءات MTProto الخام اللازمة للرفع بالأجزاء والنشر (pyrogram.raw)"""
+
+    async def save_part(self, client, file_id, part, total, data, big):
+        from pyrogram.raw import functions
+        if big:
+            request = functions.upload.SaveBigFilePart(file_id=file_id, file_part=part, file_total_parts=total,
+                                                       bytes=data)
+        else:
+            request = functions.upload.SaveFilePart(file_id=file_id, file_part=part, bytes=data)
+        return await client.invoke(request)
+
+    def input_file(self, file_id, parts, name, big):
+        from pyrogram.raw import types
+        if big:
+            return types.InputFileBig(id=file_id, parts=parts, name=name)
+        return types.InputFile(id=file_id, parts=parts, name=name, md5_checksum='')
+
+    async def send_video(self, client, chat_id, video, thumb, caption, name, width=0, height=0, duration=0):
+        from pyrogram.raw import functions, types
+        media = types.InputMediaUploadedDocument(
+            mime_type='video/mp4',
+            file=video,
+            thumb=thumb,
+            attributes=[
+                types.DocumentAttributeVideo(duration=int(duration or 0), w=width or 0, h=height or 0,
+                                             supports_streaming=True),
+                types.DocumentAttributeFilename(file_name=name),
+            ],
+        )
+        return await client.invoke(functions.messages.SendMedia(
+            peer=await client.resolve_peer(chat_id), media=media, message=caption or '', random_id=client.rnd_id()
+        ))
+
+    def missing_part(self, error):
+        """FILE_PART_X_MISSING -> X (الجزء انتهت صلاحيته على الخادم)"""
+        if 'FILE_PART' in str(getattr(error, 'ID', '')) and isinstance(getattr(error, 'value', None), int):
+            return error.value
+        return None
+
+
+class ResumableUploader:
+    """
+    رفع ملف بالأجزاء (عدة طلبات متزامنة على جلسة client) مع حفظ التقدم، ثم النشر بـ messages.sendMedia
+    الأجزاء المكتملة من تشغيل سابق (نفس الملف) لا تُرسل مرة أخرى؛ resumed_bytes حجمها
+    """
+
+    def __init__(self, client, api=None, part_size=PART_SIZE, workers=PART_WORKERS, state_dir=UPLOAD_STATE_DIR):
+        self.client = client
+        self.api = api or PyrogramApi()
+        self.part_size = part_size
+        self.workers = workers
+        self.state_dir = state_dir
+        self.sent_parts = 0
+        self.resumed_bytes = 0
+
+    async def _send_parts(self, path, state, parts, progress=None):
+        big = state.size > BIG_FILE
+        pending = asyncio.Queue()
+        for part in parts:
+            pending.put_nowait(part)
+
+        async def worker():
+            with open(path, 'rb') as f:
+                while not pending.empty():
+                    part = pending.get_nowait()
+                    f.seek(part * self.part_size)
+                    data = f.read(self.part_size)
+                    await self.api.save_part(self.client, state.file_id, part, state.parts, data, big)
+                    self.sent_parts += 1
+                    UPLOAD_PARTS.inc(result='sent')
+                    with state.lock:
+                        state.done.add(part)
+                    state.save()
+                    if progress:
+                        result = progress(min(len(state.done) * self.part_size, state.size), state.size)
+                        if inspect.isawaitable(result):
+                            await result
+
+        tasks = [asyncio.ensure_future(worker()) for _ in range(min(self.workers, len(parts)) or 1)]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            # عامل فشل (انقطاع الاتصال): البقية تتوقف أيضاً بدل أن تكمل الرفع بعد عودة الدالة
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        finally:
+            # ما اكتمل يُحفظ حتى لو انقطع الاتصال أو توقفت العملية
+            state.save(force=True)
+        return self.api.input_file(state.file_id, state.parts, os.path.basename(path), big)
+
+    async def save_file(self, path, progress=None):
+        """رفع الملف (أو ما نقص منه) وإرجاع InputFile للنشر"""
+        state = UploadState(path, self.part_size, self.state_dir)
+        self.resumed_bytes = 0
+        if state.load() and state.done:
+            print(f"[*] استئناف الرفع: {len(state.done)}/{state.parts} جزء مرفوع سابقاً")
+            UPLOAD_PARTS.inc(len(state.done), result='resumed')
+            self.resumed_bytes = min(len(state.done) * self.part_size, state.size)
+        return state, await self._send_parts(path, state, state.missing, progress)
+
+    async def send_video(self, chat_id, path, caption='', thumb=None, progress=None, width=0, height=0,
+                         duration=0):
+        state, video = await self.save_file(path, progress)
+        thumb_file = None
+        if thumb and os.path.exists(thumb) and os.path.getsize(thumb) <= self.part_size:
+            # الصورة المصغرة جزء واحد: تُرفع كل مرة ولا تبقى لها حالة
+            thumb_state = UploadState(thumb, self.part_size, self.state_dir)
+            thumb_state.load()
+            thumb_file = await self._send_parts(thumb, thumb_state, [0])
+            thumb_state.remove()
+        for _ in range(3):
+            try:
+                result = await self.api.send_video(self.client, chat_id, video, thumb_file, caption,
+                                                   os.path.basename(path), width, height, duration)
+                state.remove()
+                return result
+            except Exception as e:
+                part = self.api.missing_part(e)
+                if part is None:
+                    raise
+                print(f"[*] الجزء {part} غير موجود على الخادم - إعادة رفعه")
+                with state.lock:
+                    state.done.discard(part)
+                video = await self._send_parts(path, state, [part])
+        raise RuntimeError("تعذر إكمال أجزاء الملف على الخادم")
+
+
+# ===== بديل محلي للاختبار =====
+
+class FakeUploadApi:
+    """
+    خادم وهمي للأجزاء: يحفظ الأجزاء لكل file_id، ويقطع الاتصال بعد عدد محدد من الأجزاء
+    (محاكاة انقطاع الشبكة أو توقف العملية أثناء الرفع)
+    """
+
+    def __init__(self, disconnect_after=None, latency=0.001):
+        self.files = {}
+        self.posts = []
+        self.disconnect_after = disconnect_after
+        self.latency = latency
+        self.received = 0
+
+    async def save_part(self, client, file_id, part, total, data, big):
+        await asyncio.sleep(self.latency)
+        if self.disconnect_after is not None and self.received >= self.disconnect_after:
+            raise ConnectionError("انقطع الاتصال (محاكاة)")
+        self.received += 1
+        self.files.setdefault(file_id, {})[part] = data
+        return True
+
+    def input_file(self, file_id, parts, name, big):
+        return SimpleNamespace(id=file_id, parts=parts, name=name, big=big)
+
+    async def send_video(self, client, chat_id, video, thumb, caption, name, width=0, height=0, duration=0):
+        stored = self.files.get(video.id, {})
+        missing = [part for part in range(video.parts) if part not in stored]
+        if missing:
+            raise FakePartMissing(missing[0])
+        data = b''.join(stored[part] for part in range(video.parts))
+        self.posts.append((chat_id, caption, hashlib.sha256(data).hexdigest()))
+        return SimpleNamespace(chat=chat_id, caption=caption)
+
+    def missing_part(self, error):
+        return error.value if isinstance(error, FakePartMissing) else None
+
+
+class FakePartMissing(Exception):
+    ID = 'FILE_PART_X_MISSING'
+
+    def __init__(self, value):
+        super().__init__(f"FILE_PART_{value}_MISSING")
+        self.value = value
+
+
+async def simulate(size_mb=24, cut_at=0.9):
+    """رفع ينقطع عند cut_at من الأجزاء، ثم "تشغيل جديد" يكمل الناقص فقط"""
+    workdir = tempfile.mkdtemp(prefix='fhrs_resume_')
+    path = os.path.join(workdir, 'episode.mp4')
+    with open(path, 'wb') as f:
+        f.write(os.urandom(size_mb * 1024 * 1024))
+    state_dir = os.path.join(workdir, 'state')
+    try:
+        parts = -(-os.path.getsize(path) // PART_SIZE)
+        api = FakeUploadApi(disconnect_after=int(parts * cut_at))
+        first = ResumableUploader(None, api, state_dir=state_dir)
+        try:
+            await first.send_video('@channel', path, 'الحلقة 1')
+        except ConnectionError as e:
+            print(f"[*] التشغيل الأول: {e} بعد {first.sent_parts}/{parts} جزء")
+        # عملية جديدة: الحالة من القرص فقط
+        api.disconnect_after = None
+        second = ResumableUploader(None, api, state_dir=state_dir)
+        await second.send_video('@channel', path, 'الحلقة 1')
+        with open(path, 'rb') as f:
+            intact = api.posts and api.posts[-1][2] == hashlib.sha256(f.read()).hexdigest()
+        print(f"[*] التشغيل الثاني: {second.sent_parts} جزء فقط، المنشور {'سليم' if intact else 'تالف!'}")
+        return first.sent_parts, second.sent_parts, bool(intact)
+    finally:
+        for root, dirs, files in os.walk(workdir, topdown=False):
+            for name in files:
+                os.remove(os.path.join(root, name))
+            os.rmdir(root)
+
+
+async def simulate_lowg():
+    """
+    lowg.process_episode مرتين بدون شبكة ولا ffmpeg: الرفع ينقطع في التشغيل الأول، والثاني يجب أن
+    يحتفظ بالملف النهائي (لا تنزيل ولا ضغط) ويرسل الأجزاء الناقصة فقط
+    """
+    import lowg
+
+    workdir = tempfile.mkdtemp(prefix='fhrs_lowg_resume_')
+    state_dir = os.path.join(workdir, 'state')
+    size = 12 * 1024 * 1024
+    parts = -(-size // PART_SIZE)
+    api = FakeUploadApi(disconnect_after=parts // 2)
+    downloads = []
+
+    def fake_download(url, output_path, watch=None):
+        downloads.append(url)
+        with open(output_path, 'wb') as f:
+            f.write(os.urandom(size))
+        return {'height': 720}
+
+    fakes = {
+        'app': SimpleNamespace(),
+        'upload_pool': None,
+        'FloodWait': type('FloodWait', (Exception,), {'value': 0}),
+        'extract_video_url': lambda *args: (['fake://episode'], "خادم وهمي"),
+        'download_video': fake_download,
+        'create_thumbnail_16_9': lambda source, thumb: False,
+        'ladder_for': lambda pattern: [{'codec': lowg.CODEC}],
+        'compress_video_240p_simple': lambda source, output, **kwargs: bool(shutil.copy2(source, output)),
+        'ensure_streamable': lambda path: True,
+        'get_video_dimensions': lambda path: (426, 240),
+        'get_video_duration': lambda path: 60,
+        'get_cache': lambda: SimpleNamespace(sources=lambda key: [], add_source=lambda *args, **kwargs: None),
+        'ResumableUploader': functools.partial(ResumableUploader, api=api, state_dir=state_dir),
+        'pending_upload': functools.partial(pending_upload, state_dir=state_dir),
+    }
+    try:
+        with mock.patch.multiple(lowg, **fakes):
+            await lowg.process_episode(1, 'series', 'مسلسل', 1, workdir)
+            final = os.path.join(workdir, 'مسلسل_S01_E01.mp4')
+            with open(final, 'rb') as f:
+                digest = hashlib.sha256(f.read()).hexdigest()
+            print(f"[*] التشغيل الأول: {api.received}/{parts} جزء، ثم انقطع الاتصال")
+            # تشغيل جديد لنفس الحلقة
+            api.disconnect_after = None
+            first = api.received
+            ok, message = await lowg.process_episode(1, 'series', 'مسلسل', 1, workdir)
+        intact = bool(api.posts) and api.posts[-1][2] == digest
+        print(f"[*] التشغيل الثاني: {message} - {api.received - first} جزء، تنزيلات {len(downloads)}، "
+              f"المنشور {'سليم' if intact else 'تالف!'}")
+        return len(downloads) == 1 and api.received - first < parts and intact
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == '--simulate':
+        asyncio.run(simulate())
+        # نفس الاستئناف عبر مسار lowg الكامل (الملف النهائي يُحتفظ به بين التشغيلين)
+        asyncio.run(simulate_lowg())
+    else:
+        print("الاستخدام: python tg_resume.py --simulate")
@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+"""
+رفع متوازٍ إلى Telegram عبر عدة جلسات لنفس الحساب مع الحفاظ على ترتيب المنشورات في القناة
+كل ملف يُرفع أولاً إلى "الرسائل المحفوظة" من أول جلسة متاحة، ثم تنشره الجلسة الرئيسية
+بواسطة file_id بالترتيب (النشر فوري، الرفع هو ما يأخذ الوقت)
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import inspect
+import tempfile
+from types import SimpleNamespace
+
+from metrics import FLOODWAIT_SECONDS, QUEUE_DEPTH
+from source_cache import CACHE_DIR
+import tracing
+
+# عدد جلسات الرفع (1 = الجلسة الرئيسية فقط، بدون مجمع)
+UPLOAD_SESSIONS = max(1, int(os.environ.get('FHRS_UPLOAD_SESSIONS', '1')))
+SAVED_CHAT = 'me'
+# أقصى عدد عناصر في send_media_group
+MEDIA_GROUP_SIZE = 10
+PUBLISHED_FILE = os.path.join(CACHE_DIR, 'published.json')
+
+
+class PublishedLog:
+    """المنشورات المكتملة في القنوات (القناة + التعليق) - إعادة التشغيل بعد فشل جزئي لا تنشرها مرة أخرى"""
+
+    def __init__(self, path=PUBLISHED_FILE):
+        self.path = path
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                self.keys = set(json.load(f))
+        except (OSError, ValueError):
+            self.keys = set()
+
+    @staticmethod
+    def _key(chat_id, caption):
+        return f"{chat_id}|{caption}"
+
+    def has(self, chat_id, caption):
+        return self._key(chat_id, caption) in self.keys
+
+    def add(self, chat_id, captions):
+        self.keys.update(self._key(chat_id, caption) for caption in captions)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(sorted(self.keys), f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+
+def pyrogram_input_media(file_id, caption='', **params):
+    from pyrogram.types import InputMediaVideo
+    return InputMediaVideo(file_id, caption=caption, **params)
+
+
+def pyrogram_factory(app):
+    """جلسات إضافية من جلسة app الحالية (بدون تسجيل دخول جديد، في الذاكرة فقط، بدون تحديثات)"""
+    def factory(name, session_string):
+        return type(app)(name, api_id=app.api_id, api_hash=app.api_hash, session_string=session_string,
+                         in_memory=True, no_updates=True)
+    return factory
+
+
+class UploadPool:
+    """
+    uploaders: الجلسات التي ترفع (الجلسة الرئيسية ضمنها)
+    poster: الجلسة التي تنشر في القناة - بالترتيب حسب turn أو حسب ترتيب الاستدعاء
+    """
+
+    def __init__(self, poster, uploaders, chat_id, flood_wait=(), input_media=pyrogram_input_media):
+        self.poster = poster
+        self.uploaders = list(uploaders)
+        self.chat_id = chat_id
+        self.flood_wait = flood_wait
+        self.input_media = input_media
+        self.extra = []
+        self.idle = asyncio.Queue()
+        for client in self.uploaders:
+            self.idle.put_nowait(client)
+        self.last_turn = None
+
+    @classmethod
+    async def open(cls, app, chat_id, size=UPLOAD_SESSIONS, factory=None, flood_wait=(),
+                   input_media=pyrogram_input_media):
+        """مجمع من app وsize-1 جلسات إضافية (الجلسات التي تفشل في البدء تُتجاهل)"""
+        extra = []
+        if size > 1:
+            factory = factory or pyrogram_factory(app)
+            session_string = await app.export_session_string()
+            for index in range(1, size):
+                client = factory(f"upload_{index}", session_string)
+                try:
+                    await client.start()
+                    extra.append(client)
+                except Exception as e:
+                    print(f"[!] تعذر بدء جلسة الرفع {index}: {e}")
+        pool = cls(app, [app] + extra, chat_id, flood_wait, input_media)
+        pool.extra = extra
+        return pool
+
+    @property
+    def size(self):
+        return len(self.uploaders)
+
+    async def close(self):
+        for client in self.extra:
+            try:
+                await client.stop()
+            except Exception:
+                pass
+        self.extra = []
+
+    async def _call(self, method, *args, **kwargs):
+        """استدعاء مع انتظار FloodWait ثم إعادة المحاولة"""
+        while True:
+            try:
+                return await method(*args, **kwargs)
+            except self.flood_wait as e:
+                print(f"\n[*] انتظر {e.value} ثانية...")
+                FLOODWAIT_SECONDS.inc(e.value)
+                with tracing.span('floodwait', seconds=e.value):
+                    await asyncio.sleep(e.value)
+
+    async def _upload(self, file_path, thumb, progress, params):
+        QUEUE_DEPTH.inc(queue='upload')
+        try:
+            client = await self.idle.get()
+        finally:
+            QUEUE_DEPTH.dec(queue='upload')
+        try:
+            saved = await self._call(client.send_video, SAVED_CHAT, file_path, thumb=thumb, progress=progress,
+                                     **params)
+            return client, saved
+        finally:
+            self.idle.put_nowait(client)
+
+    async def publish(self, file_path, caption, thumb=None, progress=None, turn=None, **params):
+        """
+        رفع من أول جلسة متاحة ثم النشر في القناة بعد turn (حدث asyncio)
+        بدون turn: النشر بترتيب استدعاء publish
+        """
+        mine = None
+        if turn is None:
+            turn, mine = self.last_turn, asyncio.Event()
+            self.last_turn = mine
+        try:
+            client, saved = await self._upload(file_path, thumb, progress, params)
+            if turn is not None:
+                await turn.wait()
+            message = await self._call(self.poster.send_video, self.chat_id, saved.video.file_id,
+                                       caption=caption, **params)
+            try:
+                await client.delete_messages(SAVED_CHAT, saved.id)
+            except Exception:
+                pass
+            return message
+        finally:
+            if mine is not None:
+                mine.set()
+
+    async def publish_group(self, items, turn=None, published=None):
+        """
+        نشر موسم كامل: رفع كل الملفات أولاً بالتوازي، ثم send_media_group لكل 10 بالترتيب
+        items: [{'file_path', 'caption', 'thumb', 'progress', ...خيارات send_video}] بترتيب الحلقات
+        published: PublishedLog - المنشور سابقاً يُتخطى، وكل مجموعة تُسجل فور نشرها (الفشل بعدها لا يعيدها)
+        يرجع رسائل القناة بنفس الترتيب (للعناصر التي نُشرت الآن)
+        """
+        mine = None
+        if turn is None:
+            turn, mine = self.last_turn, asyncio.Event()
+            self.last_turn = mine
+        if published is not None:
+            items = [item for item in items if not published.has(self.chat_id, item.get('caption', ''))]
+        results = []
+        try:
+            results = await asyncio.gather(*(
+                self._upload(item['file_path'], item.get('thumb'), item.get('progress'), self._params(item))
+                for item in items
+            ), return_exceptions=True)
+            for result in results:
+                if isinstance(result, BaseException):
+                    raise result
+            if turn is not None:
+                await turn.wait()
+            messages = []
+            for start in range(0, len(items), MEDIA_GROUP_SIZE):
+                group = list(zip(items, results))[start:start + MEDIA_GROUP_SIZE]
+                media = [self.input_media(saved.video.file_id, caption=item.get('caption', ''), **self._params(item))
+                         for item, (_, saved) in group]
+                messages += await self._call(self.poster.send_media_group, self.chat_id, media)
+                if published is not None:
+                    published.add(self.chat_id, [item.get('caption', '') for item, _ in group])
+            return messages
+        finally:
+            # النسخ في الرسائل المحفوظة تُحذف حتى عند فشل رفع آخر أو نشر مجموعة
+            for result in results:
+                if isinstance(result, BaseException):
+                    continue
+                client, saved = result
+                try:
+                    await client.delete_messages(SAVED_CHAT, saved.id)
+                except Exception:
+                    pass
+            if mine is not None:
+                mine.set()
+
+    @staticmethod
+    def _params(item):
+        return {key: value for key, value in item.items()
+                if key not in ('file_path', 'caption', 'thumb', 'progress')}
+
+
+# ===== بديل محلي للاختبار =====
+
+class FakeTelegram:
+    """حالة "الخادم" المشتركة بين الجلسات الوهمية: سرعة كل اتصال، الملفات، ومنشورات القنوات بالترتيب"""
+
+    def __init__(self, rate=4 * 1024 * 1024, latency=0.05):
+        self.rate = rate
+        self.latency = latency
+        self.files = {}
+        self.posts = []
+        self.next_id = 0
+        self.calls = 0     # استدعاءات النشر في القنوات (بدون الرفع إلى الرسائل المحفوظة)
+
+
+def fake_input_media(file_id, caption='', **params):
+    """بديل InputMediaVideo"""
+    return SimpleNamespace(media=file_id, caption=caption, **params)
+
+
+class FakeTelegramClient:
+    """بديل لـ pyrogram.Client بالقدر الذي يستخدمه المجمع (send_video بمسار أو file_id)"""
+
+    CHUNK = 512 * 1024
+
+    def __init__(self, name='fake', server=None):
+        self.name = name
+        self.server = server or FakeTelegram()
+
+    async def start(self):
+        await asyncio.sleep(self.server.latency)
+
+    async def stop(self):
+        pass
+
+    async def export_session_string(self):
+        return f"fake:{self.name}"
+
+    async def send_video(self, chat_id, video, caption='', thumb=None, progress=None, **kwargs):
+        server = self.server
+        await asyncio.sleep(server.latency)
+        if video in server.files:
+            file_id = video
+        else:
+            # سرعة محدودة لكل اتصال (كما في Telegram)، الاتصالات المختلفة مستقلة
+            total = os.path.getsize(video)
+            current = 0
+            with open(video, 'rb') as f:
+                for chunk in iter(lambda: f.read(self.CHUNK), b''):
+                    await asyncio.sleep(len(chunk) / server.rate)
+                    current += len(chunk)
+                    if progress:
+                        result = progress(current, total)
+                        if inspect.isawaitable(result):
+                            await result
+            file_id = f"file{len(server.files)}"
+            server.files[file_id] = video
+        server.next_id += 1
+        if chat_id != SAVED_CHAT:
+            server.posts.append((chat_id, caption))
+            server.calls += 1
+        return SimpleNamespace(id=server.next_id, chat=chat_id, video=SimpleNamespace(file_id=file_id))
+
+    async def send_media_group(self, chat_id, media):
+        server = self.server
+        await asyncio.sleep(server.latency)
+        if not 1 <= len(media) <= MEDIA_GROUP_SIZE:
+            raise ValueError(f"media group يقبل حتى {MEDIA_GROUP_SIZE} عناصر")
+        messages = []
+        for item in media:
+            if item.media not in server.files:
+                raise ValueError(f"file_id غير معروف: {item.media}")
+            server.next_id += 1
+            server.posts.append((chat_id, item.caption))
+            messages.append(SimpleNamespace(id=server.next_id, chat=chat_id,
+                                            video=SimpleNamespace(file_id=item.media)))
+        server.calls += 1
+        return messages
+
+    async def delete_messages(self, chat_id, message_ids):
+        return True
+
+
+# ===== القياس =====
+
+async def benchmark(sizes=(1, 2, 4), files=8, file_mb=8, rate=4 * 1024 * 1024, group=False):
+    """
+    إنتاجية الرفع الكلية (MB/s) حسب عدد الجلسات، مع التحقق من ترتيب المنشورات
+    group: نشر الكل بمجموعات وسائط بدلاً من send_video لكل ملف (عدد استدعاءات النشر)
+    """
+    workdir = tempfile.mkdtemp(prefix='fhrs_upload_')
+    paths = []
+    for index in range(files):
+        path = os.path.join(workdir, f"episode_{index + 1:02d}.mp4")
+        with open(path, 'wb') as f:
+            f.write(b'\0' * file_mb * 1024 * 1024)
+        paths.append(path)
+    print(f"[*] {files} ملفات × {file_mb}MB، {rate / 1024 / 1024:.0f}MB/s لكل اتصال")
+    results = {}
+    try:
+        for size in sizes:
+            server = FakeTelegram(rate)
+            app = FakeTelegramClient('main', server)
+            pool = await UploadPool.open(app, '@channel', size,
+                                         factory=lambda name, session: FakeTelegramClient(name, server),
+                                         input_media=fake_input_media)
+            start = time.monotonic()
+            if group:
+                await pool.publish_group([{'file_path': path, 'caption': os.path.basename(path)} for path in paths])
+            else:
+                await asyncio.gather(*(pool.publish(path, os.path.basename(path)) for path in paths))
+            elapsed = time.monotonic() - start
+            await pool.close()
+            ordered = [caption for _, caption in server.posts] == [os.path.basename(p) for p in paths]
+            results[size] = files * file_mb / elapsed
+            print(f"  {size} جلسة: {results[size]:.1f}MB/s ({elapsed:.1f}ث، {server.calls} استدعاءات نشر) "
+                  f"{'الترتيب سليم' if ordered else 'الترتيب خاطئ!'}")
+    finally:
+        for path in paths:
+            os.remove(path)
+        os.rmdir(workdir)
+    return results
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == '--bench':
+        group = '--group' in sys.argv
+        sizes = tuple(int(s) for s in sys.argv[2:] if s.isdigit()) or (1, 2, 4)
+        asyncio.run(benchmark(sizes, files=12 if group else 8, group=group))
+    else:
+        print("الاستخدام: python tg_upload.py --bench [--group] [1 2 4 ...]")
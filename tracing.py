@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+وضع --profile: مقاطع زمنية (spans) لكل مرحلة وعملية فرعية وطلب HTTP مع علاقة الأب بالابن،
+تُكتب بصيغة Chrome trace JSON (تفتح في ui.perfetto.dev أو chrome://tracing)، مسار لكل عامل
+--cprofile يضيف قياس cProfile لدوال Python (تحليل HTML وما شابه) في ملف .prof بجانب الملف
+"""
+
+import os
+import sys
+import json
+import time
+import atexit
+import inspect
+import functools
+import itertools
+import threading
+import contextvars
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+TOP_FUNCTIONS = 25        # عدد الدوال المطبوعة من cProfile
+
+_enabled = False
+_path = None
+_events = []
+_lock = threading.Lock()
+_ids = itertools.count(1)
+_track_ids = itertools.count(1)
+_thread_tracks = {}
+_current = contextvars.ContextVar('fhrs_span', default=None)
+_track = contextvars.ContextVar('fhrs_track', default=None)
+_profilers = []
+
+
+def enabled():
+    return _enabled
+
+
+def _now():
+    return time.perf_counter_ns() // 1000
+
+
+def _emit(event):
+    with _lock:
+        _events.append(event)
+
+
+def _name_track(tid, name):
+    _emit({'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': tid, 'args': {'name': name}})
+
+
+def _current_track():
+    """مسار السياق الحالي (track) أو مسار الخيط باسمه (episode-worker-N وغيرها)"""
+    tid = _track.get()
+    if tid is not None:
+        return tid
+    ident = threading.get_ident()
+    with _lock:
+        tid = _thread_tracks.get(ident)
+        if tid is None:
+            tid = _thread_tracks[ident] = next(_track_ids)
+            new = True
+        else:
+            new = False
+    if new:
+        _name_track(tid, threading.current_thread().name)
+    return tid
+
+
+class Span:
+    """مقطع زمني واحد؛ with span(...) أو begin(...) ثم finish() لما لا يتبع كتلة واحدة"""
+
+    def __init__(self, name, cat, args):
+        self.name = name
+        self.cat = cat
+        self.args = args
+        self.id = next(_ids)
+        self.tid = _current_track()
+        self.parent = _current.get()
+        self.start = _now()
+        self.token = None
+        self.done = False
+        if self.parent is not None and self.parent.tid != self.tid:
+            # الأب في مسار آخر (عامل، خيط): سهم من الأب إلى الابن
+            flow = {'name': 'parent', 'cat': 'flow', 'id': self.id, 'pid': os.getpid(), 'ts': self.start}
+            _emit(dict(flow, ph='s', tid=self.parent.tid))
+            _emit(dict(flow, ph='f', bp='e', tid=self.tid))
+
+    def finish(self, **args):
+        if self.done:
+            return
+        self.done = True
+        self.args.update(args)
+        self.args['span'] = self.id
+        if self.parent is not None:
+            self.args['parent'] = self.parent.id
+        _emit({'name': self.name, 'cat': self.cat, 'ph': 'X', 'ts': self.start, 'dur': _now() - self.start,
+               'pid': os.getpid(), 'tid': self.tid, 'args': self.args})
+
+    def __enter__(self):
+        self.token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current.reset(self.token)
+        if exc_type is not None:
+            self.args['error'] = f"{exc_type.__name__}: {str(exc)[:100]}"
+        self.finish()
+        return False
+
+
+class _NoSpan:
+    args = {}
+
+    def finish(self, **args):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name, cat='stage', **args):
+    """with span('thumbnail', episode=3): ... (لا شيء إذا لم يكن --profile مفعلاً)"""
+    if not _enabled:
+        return _NO_SPAN
+    return Span(name, cat, args)
+
+
+def begin(name, cat='stage', **args):
+    """مقطع بدون كتلة (عملية فرعية تبدأ في مكان وتنتهي في آخر) - لا يصبح أباً لما بعده"""
+    if not _enabled:
+        return _NO_SPAN
+    return Span(name, cat, args)
+
+
+@contextmanager
+def track(name):
+    """مسار مستقل لكل ما يجري داخل الكتلة (حلقة في asyncio، حيث كل الحلقات على خيط واحد)"""
+    if not _enabled:
+        yield
+        return
+    tid = next(_track_ids)
+    _name_track(tid, name)
+    token = _track.set(tid)
+    parent = _current.set(None)
+    try:
+        yield
+    finally:
+        _current.reset(parent)
+        _track.reset(token)
+
+
+def traced(name=None, cat='stage'):
+    """مُزخرف لمرحلة كاملة (دالة عادية أو async)"""
+    def decorator(func):
+        label = name or func.__name__
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if not _enabled:
+                    return await func(*args, **kwargs)
+                with Span(label, cat, {}):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with Span(label, cat, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _trace_requests():
+    """كل طلب requests يصبح مقطعاً (يشمل requests.get وجلسات الوحدات)"""
+    import requests
+    original = requests.Session.request
+    if getattr(original, 'fhrs_traced', False):
+        return
+
+    def request(self, method, url, *args, **kwargs):
+        with span(f"{method} {urlsplit(str(url)).netloc}", 'http', url=str(url)[:200]) as current:
+            response = original(self, method, url, *args, **kwargs)
+            current.args['status'] = response.status_code
+            if not kwargs.get('stream'):
+                current.args['bytes'] = len(response.content)
+            return response
+    request.fhrs_traced = True
+    requests.Session.request = request
+
+
+# ===== cProfile =====
+
+def _start_cprofile():
+    import cProfile
+    if sys.version_info >= (3, 12):
+        # sys.monitoring: مقياس واحد يغطي كل الخيوط
+        profiler = cProfile.Profile()
+        profiler.enable()
+        _profilers.append(profiler)
+        return
+
+    # قبل 3.12 المقياس يعمل في الخيط الذي بدأه فقط: واحد لكل خيط جديد
+    def per_thread(frame, event, arg):
+        sys.setprofile(None)
+        profiler = cProfile.Profile()
+        with _lock:
+            _profilers.append(profiler)
+        profiler.enable()
+
+    threading.setprofile(per_thread)
+    profiler = cProfile.Profile()
+    profiler.enable()
+    _profilers.append(profiler)
+
+
+def _write_cprofile(path):
+    import pstats
+    threading.setprofile(None)
+    with _lock:
+        profilers = list(_profilers)
+    stats = None
+    for profiler in profilers:
+        profiler.disable()
+        try:
+            stats = pstats.Stats(profiler) if stats is None else stats.add(profiler)
+        except TypeError:
+            # خيط لم يُسجل أي استدعاء
+            pass
+    if stats is None:
+        return None
+    stats.dump_stats(path)
+    print(f"\n[*] cProfile: {path} (أعلى {TOP_FUNCTIONS} حسب الوقت التراكمي)")
+    stats.sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+    return path
+
+
+# ===== التفعيل والكتابة =====
+
+def enable(path=None, python_profile=False):
+    """تفعيل التتبع حتى نهاية العملية (يُكتب الملف عند الخروج)"""
+    global _enabled, _path
+    if _enabled:
+        return _path
+    _path = path or time.strftime('fhrs_trace_%Y%m%d_%H%M%S.json')
+    _enabled = True
+    _emit({'name': 'process_name', 'ph': 'M', 'pid': os.getpid(), 'tid': 0,
+           'args': {'name': os.path.basename(sys.argv[0] or 'fhrs')}})
+    _trace_requests()
+    if python_profile:
+        _start_cprofile()
+    atexit.register(write)
+    print(f"[*] التتبع مفعل: {_path}")
+    return _path
+
+
+def write(path=None):
+    """كتابة كل ما سُجل حتى الآن (Chrome trace JSON)"""
+    path = path or _path
+    if not path:
+        return None
+    with _lock:
+        events = list(_events)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f, ensure_ascii=False)
+    os.replace(tmp, path)
+    spans = sum(1 for event in events if event['ph'] == 'X')
+    print(f"\n[*] التتبع: {path} ({spans} مقطع) - افتحه في https://ui.perfetto.dev")
+    if _profilers:
+        _write_cprofile(os.path.splitext(path)[0] + '.prof')
+    return path
+
+
+def from_argv(argv=None):
+    """
+    --profile أو --profile=trace.json، و--cprofile (يفعّل التتبع أيضاً)
+    يرجع باقي المعاملات
+    """
+    argv = sys.argv if argv is None else argv
+    rest, path, wanted, python_profile = [], None, False, False
+    for arg in argv:
+        if arg == '--profile' or arg.startswith('--profile='):
+            wanted = True
+            path = arg.partition('=')[2] or path
+        elif arg == '--cprofile':
+            wanted = python_profile = True
+        else:
+            rest.append(arg)
+    if wanted:
+        enable(path, python_profile)
+    argv[:] = rest
+    return rest
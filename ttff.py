@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+قياس زمن أول إطار (TTFF) والتنقل عبر خادم HTTP محلي يدعم Range ويحاكي خط الجوال
+بديل محلي لطريقة تشغيل تليجرام للفيديو المتقطع: طلبات Range على ملف MP4
+"""
+
+import os
+import re
+import sys
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import supervisor
+
+MOBILE_RATE = 1024 * 1024 // 8   # 1 ميجابت/ثانية
+MOBILE_LATENCY = 0.15            # ثوانٍ لكل طلب
+CHUNK = 16 * 1024
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """GET/HEAD مع Range لملف واحد، بسرعة وزمن استجابة محددين"""
+
+    path_on_disk = None
+    rate = MOBILE_RATE
+    latency = MOBILE_LATENCY
+    requests_seen = 0
+
+    def log_message(self, format, *args):
+        pass
+
+    def _range(self, size):
+        match = re.match(r'bytes=(\d*)-(\d*)', self.headers.get('Range', ''))
+        if not match:
+            return 0, size - 1, False
+        start, end = match.group(1), match.group(2)
+        if not start:
+            return max(0, size - int(end)), size - 1, True
+        return int(start), min(size - 1, int(end) if end else size - 1), True
+
+    def _headers(self):
+        size = os.path.getsize(self.path_on_disk)
+        start, end, partial = self._range(size)
+        type(self).requests_seen += 1
+        time.sleep(self.latency)
+        self.send_response(206 if partial else 200)
+        self.send_header('Content-Type', 'video/mp4')
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(end - start + 1))
+        if partial:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        self.end_headers()
+        return start, end
+
+    def do_HEAD(self):
+        self._headers()
+
+    def do_GET(self):
+        start, end = self._headers()
+        remaining = end - start + 1
+        with open(self.path_on_disk, 'rb') as f:
+            f.seek(start)
+            while remaining > 0:
+                data = f.read(min(CHUNK, remaining))
+                if not data:
+                    break
+                try:
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    return
+                remaining -= len(data)
+                if self.rate:
+                    time.sleep(len(data) / self.rate)
+
+
+class RangeServer:
+    """خادم محلي لملف واحد: with RangeServer(path) as url: ..."""
+
+    def __init__(self, path, rate=MOBILE_RATE, latency=MOBILE_LATENCY):
+        handler = type('Handler', (RangeHandler,), {
+            'path_on_disk': os.path.abspath(path), 'rate': rate, 'latency': latency, 'requests_seen': 0,
+        })
+        self.handler = handler
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/{os.path.basename(path)}"
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    @property
+    def requests(self):
+        return self.handler.requests_seen
+
+
+def first_frame_time(url, seek=None, timeout=120):
+    """ثوانٍ حتى يفك ffmpeg أول إطار (من البداية أو بعد التنقل إلى seek)"""
+    cmd = ['ffmpeg', '-v', 'error']
+    if seek:
+        cmd += ['-ss', str(seek)]
+    cmd += ['-i', url, '-map', '0:v:0', '-frames:v', '1', '-f', 'null', '-']
+    start = time.monotonic()
+    result = supervisor.run(cmd, role='download', timeout=timeout)
+    if result.returncode != 0:
+        return None
+    return time.monotonic() - start
+
+
+def measure_ttff(path, seek=None, rate=MOBILE_RATE, latency=MOBILE_LATENCY):
+    """{'ttff', 'seek', 'requests'} لملف عبر الخادم المحلي"""
+    duration = supervisor.probe_duration(path)
+    if seek is None and duration:
+        seek = duration / 2
+    with RangeServer(path, rate, latency) as server:
+        ttff = first_frame_time(server.url)
+        seek_time = first_frame_time(server.url, seek) if seek else None
+        return {'ttff': ttff, 'seek': seek_time, 'requests': server.requests}
+
+
+def compare(paths, rate=MOBILE_RATE, latency=MOBILE_LATENCY):
+    print(f"[*] خط محاكى: {rate * 8 / 1024 / 1024:.1f}Mbit/s، {latency * 1000:.0f}ms لكل طلب")
+    print(f"{'الملف':<40}{'أول إطار':>10}{'تنقل':>10}{'طلبات':>8}")
+    results = {}
+    for path in paths:
+        result = results[path] = measure_ttff(path, rate=rate, latency=latency)
+
+        def fmt(value):
+            return f"{value:.2f}ث" if value is not None else 'فشل'
+        print(f"{os.path.basename(path)[:38]:<40}{fmt(result['ttff']):>10}{fmt(result['seek']):>10}"
+              f"{result['requests']:>8}")
+    return results
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("الاستخدام: python ttff.py video1.mp4 [video2.mp4 ...]")
+        sys.exit(1)
+    compare(sys.argv[1:])
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+محرك yt-dlp داخل العملية: استخراج واحد للصفحة واختيار الصيغة محلياً ثم تنزيلها فقط
+"""
+
+import os
+import copy
+import time
+import threading
+
+from caps import lazy_import
+
+# روابط الصيغ الموقعة تنتهي صلاحيتها: نتيجة الاستخراج تُستخدم لفترة قصيرة فقط
+INFO_TTL = 300
+# اتصال لا يرسل شيئاً لا يستدعي خطاف التقدم أبداً: مهلة القراءة تقطعه بدلاً من انتظار بلا نهاية
+SOCKET_TIMEOUT = 30
+
+
+class DownloadTimeout(Exception):
+    """توقف التنزيل عن التقدم لمدة أطول من المسموح"""
+
+
+def format_height(fmt):
+    return fmt.get('height') or 0
+
+
+def select_format(formats, max_height=240, prefer='best'):
+    """
+    اختيار الصيغة من قائمة formats بدون أي طلب شبكة
+    يرجع (الصيغة، هل هي ضمن الدقة المطلوبة)
+    prefer='best': أعلى دقة ضمن الحد، prefer='worst': أقل دقة ضمن الحد
+    """
+    video = [f for f in formats if f.get('vcodec') != 'none']
+    # نفضل الصيغ التي تحتوي على صوت وصورة معاً حتى لا نحتاج إلى دمج
+    muxed = [f for f in video if f.get('acodec') != 'none'] or video or list(formats)
+    if not muxed:
+        return None, False
+
+    def rate(f):
+        return f.get('tbr') or f.get('filesize') or 0
+
+    if not max_height:
+        return max(muxed, key=lambda f: (format_height(f), rate(f))), True
+
+    within = [f for f in muxed if 0 < format_height(f) <= max_height]
+    if within:
+        if prefer == 'worst':
+            return min(within, key=lambda f: (format_height(f), rate(f))), True
+        return max(within, key=lambda f: (format_height(f), rate(f))), True
+
+    if not any(format_height(f) for f in muxed):
+        # لا توجد معلومات دقة (مثل m3u8 بجودة واحدة) - الأصغر حجماً
+        return min(muxed, key=rate), False
+
+    # لا توجد صيغة ضمن الحد - أصغر صيغة فوقه (الأقرب للحد) ثم نضغطها لاحقاً
+    above = [f for f in muxed if format_height(f) > max_height]
+    return min(above, key=lambda f: (format_height(f), rate(f))), False
+
+
+class YtdlEngine:
+    """غلاف مشترك حول YoutubeDL (نسخة لكل خيط) مع ذاكرة لنتائج الاستخراج"""
+
+    def __init__(self, base_opts=None):
+        self.base_opts = dict(base_opts or {})
+        self.local = threading.local()
+        self.info_cache = {}
+        self.lock = threading.Lock()
+        # سياق كل تنزيل حسب اسم الملف: خطافات التقدم تُستدعى من خيوط الأجزاء المتوازية أيضاً
+        self.contexts = {}
+
+    def _ydl(self):
+        ydl = getattr(self.local, 'ydl', None)
+        if ydl is None:
+            yt_dlp = lazy_import('yt_dlp', ['yt-dlp'])
+            opts = {
+                'quiet': True,
+                'no_warnings': True,
+                'noprogress': True,
+                'merge_output_format': 'mp4',
+                'overwrites': True,
+                'socket_timeout': SOCKET_TIMEOUT,
+                # يُستدعى بين محاولات yt-dlp الداخلية، حيث لا يصل أي تقدم إلى الخطاف
+                'retry_sleep_functions': {'http': self._retry_sleep, 'fragment': self._retry_sleep},
+            }
+            opts.update(self.base_opts)
+            # الصيغة يتم اختيارها محلياً في select_format، هنا فقط نعيدها
+            opts['format'] = self._format_selector
+            ydl = yt_dlp.YoutubeDL(opts)
+            ydl.add_progress_hook(self._progress_hook)
+            self.local.ydl = ydl
+        return ydl
+
+    def _format_selector(self, ctx):
+        formats = ctx.get('formats') or []
+        wanted = getattr(self.local, 'format_id', None)
+        for f in formats:
+            if f.get('format_id') == wanted:
+                yield f
+                return
+        if formats:
+            yield formats[-1]
+
+    @staticmethod
+    def _check_stall(ctx):
+        if ctx['stall_timeout'] and time.monotonic() - ctx['last_progress'] > ctx['stall_timeout']:
+            # لا نقطع تنزيلاً طويلاً يتقدم، فقط تنزيلاً متوقفاً فعلاً
+            raise DownloadTimeout(f"لا تقدم في التنزيل منذ {ctx['stall_timeout']}ث")
+
+    def _retry_sleep(self, n):
+        # مهلة القراءة ثم إعادة المحاولة مرة بعد مرة: تُحسب من stall_timeout كأي توقف آخر
+        ctx = getattr(self.local, 'ctx', None)
+        if ctx:
+            self._check_stall(ctx)
+        return 0
+
+    def _progress_hook(self, status):
+        ctx = self.contexts.get(status.get('filename')) or getattr(self.local, 'ctx', None)
+        if not ctx:
+            return
+        if status.get('status') == 'downloading':
+            downloaded = status.get('downloaded_bytes') or 0
+            if downloaded > ctx['bytes']:
+                ctx['bytes'] = downloaded
+                ctx['last_progress'] = time.monotonic()
+            else:
+                self._check_stall(ctx)
+        if ctx['hook']:
+            ctx['hook'](status)
+
+    def extract(self, url):
+        """استخراج معلومات الصفحة مرة واحدة لكل رابط (خلال INFO_TTL ثانية)"""
+        now = time.monotonic()
+        with self.lock:
+            # المنتهية تُحذف هنا حتى لا تكبر الذاكرة مع كل حلقة
+            for key in [key for key, (stamp, _) in self.info_cache.items() if now - stamp > INFO_TTL]:
+                del self.info_cache[key]
+            entry = self.info_cache.get(url)
+        if entry is None:
+            info = self._ydl().extract_info(url, download=False, process=False)
+            with self.lock:
+                self.info_cache[url] = (now, info)
+        else:
+            info = entry[1]
+        return copy.deepcopy(info)
+
+    def forget(self, url):
+        """إسقاط نتيجة الاستخراج (فشل التنزيل: قد تكون روابط الصيغ انتهت)"""
+        with self.lock:
+            self.info_cache.pop(url, None)
+
+    def download(self, url, output_file, max_height=240, prefer='best', stall_timeout=None, progress_hook=None,
+                 options=None):
+        """
+        تنزيل الصيغة المختارة فقط
+        stall_timeout: أقصى مدة بدون بايتات جديدة قبل الإلغاء (بدون حد للمدة الكلية)
+        يرجع الصيغة المختارة (dict) أو None عند الفشل
+        """
+        try:
+            info = self.extract(url)
+            formats = info.get('formats') or [info]
+            fmt, fits = select_format(formats, max_height, prefer)
+            if fmt is None:
+                return None
+
+            ydl = self._ydl()
+            ydl.params['outtmpl'] = {'default': output_file}
+            saved = {}
+            for key, value in (options or {}).items():
+                saved[key] = ydl.params.get(key)
+                ydl.params[key] = value
+            self.local.format_id = fmt.get('format_id')
+            ctx = {'stall_timeout': stall_timeout, 'bytes': 0, 'last_progress': time.monotonic(),
+                   'hook': progress_hook}
+            self.local.ctx = ctx
+            self.contexts[output_file] = ctx
+            try:
+                ydl.process_ie_result(info, download=True)
+            finally:
+                ydl.params.update(saved)
+                self.local.ctx = None
+                self.contexts.pop(output_file, None)
+
+            if not os.path.exists(output_file):
+                self.forget(url)
+                return None
+            fmt = dict(fmt)
+            fmt['fits'] = fits
+            return fmt
+        except Exception as e:
+            print(f"[!] خطأ في yt-dlp: {e}")
+            self.forget(url)
+            # لا نترك ملفاً ناقصاً قد يُعتبر مكتملاً في المحاولة التالية
+            if os.path.exists(output_file):
+                try:
+                    os.remove(output_file)
+                except OSError:
+                    pass
+            return None
+
+
+_engines = {}
+
+
+def get_engine(name='default', base_opts=None):
+    """محرك مشترك لكل سكربت (لا يتم استيراد yt_dlp إلا عند أول تنزيل)"""
+    engine = _engines.get(name)
+    if engine is None:
+        engine = _engines[name] = YtdlEngine(base_opts)
+    return engine